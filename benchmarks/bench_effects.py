@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Per-effect render benchmark on synthetic inputs
+
+Generates videos (ffmpeg testsrc2 + sine) at several resolutions, lengths
+and frame rates, plus photos at several sizes, then for each input times
+the mezzanine step and process_video_to_kruzhok / process_photo_to_kruzhok
+for every effect. Each measurement runs in a fresh worker process so wall
+time, CPU time (ffmpeg children included) and peak RSS belong to that
+measurement alone. Output fps is output frames per wall second.
+
+Prints JSON. With --baseline, cases that got slower than --threshold are
+listed under "regressions" and the exit status is 1.
+
+Usage: python benchmarks/bench_effects.py [--quick] [--engine cli|pyav]
+                                          [--runs N] [--baseline OLD.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, width, height, fps, seconds)
+VIDEO_INPUTS = [
+    ('480p30_5s', 854, 480, 30, 5),
+    ('720p30_15s', 1280, 720, 30, 15),
+    ('1080p60_15s', 1920, 1080, 60, 15),
+    ('1080p30_60s', 1920, 1080, 30, 60),
+    ('2160p30_10s', 3840, 2160, 30, 10),
+]
+PHOTO_INPUTS = [
+    ('1280x960', 1280, 960),
+    ('4000x3000', 4000, 3000),
+]
+QUICK_VIDEO_INPUTS = ['480p30_5s', '1080p60_15s']
+QUICK_PHOTO_INPUTS = ['4000x3000']
+
+def make_video(path, width, height, fps, seconds):
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(seconds), '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', path
+    ], check=True)
+
+def make_photo(path, width, height):
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}',
+        '-frames:v', '1', '-q:v', '3', path
+    ], check=True)
+
+def run_worker(task):
+    """Run one measurement in this (fresh) process, print its numbers"""
+    sys.path.insert(0, ROOT)
+    import media
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    if task['stage'] == 'mezzanine':
+        output = media.make_mezzanine(task['media_type'], task['input'])
+        os.replace(output, task['output'])
+        ok = True
+    else:
+        engine = media.get_render_engine(task['engine'])
+        ok = media.render_media(task['media_type'], task['input'], task['output'],
+                                task['effect_type'], engine=engine)
+    wall = time.perf_counter() - start
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print(json.dumps({
+        'ok': ok,
+        'wall': wall,
+        'cpu': (own.ru_utime + own.ru_stime - before.ru_utime - before.ru_stime
+                + children.ru_utime + children.ru_stime),
+        # ru_maxrss is in KiB on Linux. Children: largest ffmpeg process;
+        # worker: this process, which is where in-process engines run
+        'ffmpeg_peak_rss_kb': children.ru_maxrss,
+        'worker_peak_rss_kb': own.ru_maxrss
+    }))
+
+def measure(task, runs, frames=None):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', json.dumps(task)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        sample = json.loads(out.strip().splitlines()[-1])
+        if not sample['ok']:
+            raise RuntimeError(f"Render failed: {task}")
+        samples.append(sample)
+
+    wall = statistics.median(s['wall'] for s in samples)
+    result = {
+        'wall_ms': round(wall * 1000, 1),
+        'cpu_ms': round(statistics.median(s['cpu'] for s in samples) * 1000, 1),
+        'ffmpeg_peak_rss_mb': round(max(s['ffmpeg_peak_rss_kb'] for s in samples) / 1024, 1),
+        'worker_peak_rss_mb': round(max(s['worker_peak_rss_kb'] for s in samples) / 1024, 1),
+        'runs': runs
+    }
+    if frames:
+        result['output_fps'] = round(frames / wall, 1)
+    return result
+
+def bench_input(kind, name, source, work_dir, effects, engine, runs, output_frames):
+    mezzanine = os.path.join(work_dir, f'{name}.mezz' + ('.mkv' if kind == 'video' else '.bmp'))
+    results = {
+        'mezzanine': measure({
+            'stage': 'mezzanine', 'media_type': kind, 'input': source, 'output': mezzanine
+        }, runs),
+        'effects': {}
+    }
+    output = os.path.join(work_dir, 'out.mp4')
+    for effect_type in effects:
+        results['effects'][str(effect_type)] = measure({
+            'stage': 'render', 'media_type': kind, 'engine': engine,
+            'input': mezzanine, 'output': output, 'effect_type': effect_type
+        }, runs, frames=output_frames)
+        results['effects'][str(effect_type)]['output_kb'] = round(os.path.getsize(output) / 1024, 1)
+    return results
+
+def find_regressions(report, baseline, threshold):
+    """Cases whose wall time grew more than threshold (fraction) vs baseline"""
+    regressions = []
+    for kind in ('video', 'photo'):
+        for name, current in report.get(kind, {}).items():
+            old = baseline.get(kind, {}).get(name)
+            if not old:
+                continue
+            pairs = [('mezzanine', current['mezzanine'], old.get('mezzanine'))]
+            pairs += [(f'effect {effect}', result, old.get('effects', {}).get(effect))
+                      for effect, result in current['effects'].items()]
+            for stage, new_result, old_result in pairs:
+                if old_result and new_result['wall_ms'] > old_result['wall_ms'] * (1 + threshold):
+                    regressions.append({
+                        'case': f'{kind} {name} {stage}',
+                        'old_wall_ms': old_result['wall_ms'],
+                        'new_wall_ms': new_result['wall_ms']
+                    })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--quick', action='store_true', help='two videos and one photo only')
+    parser.add_argument('--engine', default='cli', help='render engine (cli or pyav)')
+    parser.add_argument('--effects', default='1,2,3,4,5', help='comma-separated effect numbers')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(json.loads(args.worker))
+        return
+
+    if not shutil.which('ffmpeg'):
+        print(json.dumps({'error': 'ffmpeg not found'}))
+        return
+
+    sys.path.insert(0, ROOT)
+    import media
+
+    effects = [int(effect) for effect in args.effects.split(',')]
+    videos = [v for v in VIDEO_INPUTS if not args.quick or v[0] in QUICK_VIDEO_INPUTS]
+    photos = [p for p in PHOTO_INPUTS if not args.quick or p[0] in QUICK_PHOTO_INPUTS]
+
+    ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout
+    report = {
+        'python': sys.version.split()[0],
+        'ffmpeg': ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+        'cpus': os.cpu_count(),
+        'engine': args.engine,
+        'video': {},
+        'photo': {}
+    }
+
+    work_dir = tempfile.mkdtemp(prefix='kruzhok-bench-')
+    try:
+        for name, width, height, fps, seconds in videos:
+            source = os.path.join(work_dir, f'{name}.mp4')
+            make_video(source, width, height, fps, seconds)
+            frames = int(min(seconds, media.MAX_VIDEO_DURATION) * media.MEZZANINE_FPS)
+            report['video'][name] = bench_input(
+                'video', name, source, work_dir, effects, args.engine, args.runs, frames
+            )
+        for name, width, height in photos:
+            source = os.path.join(work_dir, f'{name}.jpg')
+            make_photo(source, width, height)
+            frames = media.PHOTO_DURATION * media.PHOTO_FPS
+            report['photo'][name] = bench_input(
+                'photo', name, source, work_dir, effects, args.engine, args.runs, frames
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = find_regressions(report, json.load(f), args.threshold)
+
+    print(json.dumps(report, indent=2))
+    if report.get('regressions'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Render engine throughput benchmark
+
+Renders every effect from the same video and photo mezzanines with each
+available engine (ffmpeg CLI, PyAV) and reports wall time, CPU time
+(ffmpeg children included) and output frames per wall second. Prints JSON
+so runs can be compared between versions and machines.
+
+Usage: python benchmarks/bench_engines.py [--runs N] [--seconds S]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import media
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def bench_render(engine, media_type, mezzanine, output, effect_type, frames, runs):
+    wall = []
+    cpu = []
+    for _ in range(runs):
+        cpu_start = cpu_seconds()
+        start = time.perf_counter()
+        if not media.render_media(media_type, mezzanine, output, effect_type, engine=engine):
+            raise RuntimeError(f"{engine.name} {media_type} render of effect {effect_type} failed")
+        wall.append(time.perf_counter() - start)
+        cpu.append(cpu_seconds() - cpu_start)
+    wall_median = statistics.median(wall)
+    return {
+        'wall_median_ms': round(wall_median * 1000, 1),
+        'cpu_median_ms': round(statistics.median(cpu) * 1000, 1),
+        'fps': round(frames / wall_median, 1),
+        'runs': runs
+    }
+
+def make_sources(work_dir, seconds):
+    """1080p60 clip with audio and a 12 MP JPEG, like phone uploads"""
+    video = os.path.join(work_dir, 'source.mp4')
+    photo = os.path.join(work_dir, 'photo.jpg')
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1920x1080:rate=60',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', str(seconds), '-c:v', 'libx264', '-preset', 'veryfast', video
+    ], check=True)
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=4000x3000', '-frames:v', '1', photo
+    ], check=True)
+    return video, photo
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--seconds', type=int, default=10, help='length of the test video')
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        print(json.dumps({'error': 'ffmpeg not found'}))
+        return
+
+    engines = [media.get_render_engine('cli')]
+    pyav = media.get_render_engine('pyav')
+    report = {'python': sys.version.split()[0], 'cpus': os.cpu_count(), 'engines': {}}
+    if pyav.name == 'pyav':
+        engines.append(pyav)
+    else:
+        report['pyav'] = 'skipped: PyAV not installed'
+
+    work_dir = tempfile.mkdtemp(prefix='kruzhok-bench-')
+    mezzanines = {}
+    try:
+        video, photo = make_sources(work_dir, args.seconds)
+        mezzanines['video'] = media.make_mezzanine('video', video)
+        mezzanines['photo'] = media.make_mezzanine('photo', photo)
+        frames = {
+            'video': args.seconds * media.MEZZANINE_FPS,
+            'photo': media.PHOTO_DURATION * media.PHOTO_FPS
+        }
+        output = os.path.join(work_dir, 'out.mp4')
+        for engine in engines:
+            results = report['engines'][engine.name] = {}
+            for media_type, mezzanine in mezzanines.items():
+                results[media_type] = {
+                    effect_type: bench_render(
+                        engine, media_type, mezzanine, output, effect_type,
+                        frames[media_type], args.runs
+                    )
+                    for effect_type in sorted(media.VIDEO_EFFECT_FILTERS)
+                }
+    finally:
+        for mezzanine in mezzanines.values():
+            media.cleanup_file(mezzanine)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
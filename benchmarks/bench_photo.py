@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Photo renderer benchmark
+
+Renders every photo effect from the same 480x480 mezzanine with the ffmpeg
+filter path and with the NumPy/Pillow frame renderer, and reports wall time
+and CPU time (ffmpeg children included) per effect. Prints JSON so runs can
+be compared between versions.
+
+Usage: python benchmarks/bench_photo.py [--runs N] [--photo PATH]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import media
+import frame_render
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def bench_render(mezzanine, output, effect_type, renderer, runs):
+    media.PHOTO_RENDERER = renderer
+    wall = []
+    cpu = []
+    for _ in range(runs):
+        cpu_start = cpu_seconds()
+        start = time.perf_counter()
+        if not media.render_media('photo', mezzanine, output, effect_type):
+            raise RuntimeError(f"{renderer} render of effect {effect_type} failed")
+        wall.append(time.perf_counter() - start)
+        cpu.append(cpu_seconds() - cpu_start)
+    return {
+        'wall_median_ms': round(statistics.median(wall) * 1000, 1),
+        'cpu_median_ms': round(statistics.median(cpu) * 1000, 1),
+        'output_kb': round(os.path.getsize(output) / 1024, 1),
+        'runs': runs
+    }
+
+def make_test_photo(path):
+    """12 MP JPEG with detail, like a phone photo"""
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=4000x3000',
+        '-frames:v', '1', path
+    ], check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--photo', help='JPEG to render (default: generated 4000x3000 test image)')
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        print(json.dumps({'error': 'ffmpeg not found'}))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='kruzhok-bench-')
+    report = {'python': sys.version.split()[0], 'cpus': os.cpu_count(), 'effects': {}}
+    try:
+        photo = args.photo or os.path.join(work_dir, 'photo.jpg')
+        if not args.photo:
+            make_test_photo(photo)
+
+        start = time.perf_counter()
+        mezzanine = media.make_mezzanine('photo', photo)
+        report['mezzanine_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+        output = os.path.join(work_dir, 'out.mp4')
+        renderers = ['ffmpeg'] + (['frames'] if frame_render.AVAILABLE else [])
+        if not frame_render.AVAILABLE:
+            report['frames'] = 'skipped: numpy/Pillow not installed'
+        for effect_type in sorted(media.PHOTO_EFFECT_FILTERS):
+            report['effects'][effect_type] = {
+                renderer: bench_render(mezzanine, output, effect_type, renderer, args.runs)
+                for renderer in renderers
+            }
+        media.cleanup_file(mezzanine)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Startup-time benchmark
+
+Measures cold `import main` in a fresh interpreter, schema check with and
+without the disk cache, and ffmpeg capability detection with and without
+the disk cache. Prints JSON so runs can be compared between versions.
+
+Usage: python benchmarks/bench_startup.py [--runs N]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def summarize(samples):
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 2),
+        'min_ms': round(min(samples) * 1000, 2),
+        'max_ms': round(max(samples) * 1000, 2),
+        'runs': len(samples)
+    }
+
+def bench_import(env, runs):
+    """Time `import main` in a fresh interpreter"""
+    samples = []
+    for _ in range(runs):
+        samples.append(timed(lambda: subprocess.run(
+            [sys.executable, '-c', 'import main'],
+            cwd=ROOT, env=env, check=True
+        )))
+    baseline = [timed(lambda: subprocess.run([sys.executable, '-c', 'pass'], env=env, check=True))
+                for _ in range(runs)]
+    result = summarize(samples)
+    result['interpreter_median_ms'] = summarize(baseline)['median_ms']
+    return result
+
+def bench_in_process(code, env, runs):
+    """Time a snippet in fresh interpreters, reported by the child itself"""
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', code], cwd=ROOT, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(out.strip().splitlines()[-1]))
+    return summarize(samples)
+
+SCHEMA_SNIPPET = """
+import time, models
+start = time.perf_counter()
+models.ensure_schema()
+print(time.perf_counter() - start)
+"""
+
+CAPS_SNIPPET = """
+import time, ffmpeg_caps
+start = time.perf_counter()
+ffmpeg_caps.get_ffmpeg_capabilities()
+print(time.perf_counter() - start)
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    
+    work_dir = tempfile.mkdtemp(prefix='kruzhok-bench-')
+    env = dict(os.environ)
+    env.pop('BOT_TOKEN', None)
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    env['KRUZHOK_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+    
+    report = {'python': sys.version.split()[0]}
+    try:
+        report['import_main'] = bench_import(env, args.runs)
+        
+        report['schema_first_boot'] = bench_in_process(SCHEMA_SNIPPET, env, 1)
+        report['schema_cached'] = bench_in_process(SCHEMA_SNIPPET, env, args.runs)
+        
+        if shutil.which('ffmpeg'):
+            report['ffmpeg_caps_first_boot'] = bench_in_process(CAPS_SNIPPET, env, 1)
+            report['ffmpeg_caps_cached'] = bench_in_process(CAPS_SNIPPET, env, args.runs)
+        else:
+            report['ffmpeg_caps'] = 'skipped: ffmpeg not found'
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Rate-limited, resumable admin broadcast"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+from telebot.apihelper import ApiTelegramException
+
+from ratelimit import TokenBucket
+from send_queue import get_retry_after, PRIORITY_BULK
+from models import (
+    get_broadcast_recipients,
+    get_running_broadcast_jobs,
+    update_broadcast_job
+)
+
+logger = logging.getLogger(__name__)
+
+# Bot API allows ~30 messages/second overall; leave headroom for regular replies
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', '25'))
+RECIPIENT_BATCH_SIZE = 500
+PROGRESS_SAVE_EVERY = 25  # sends between cursor saves (max re-sent after crash)
+STATUS_EDIT_INTERVAL = 5.0  # seconds between admin progress edits
+# Sends queued but not finished; enough to keep BROADCAST_RATE going while
+# each send waits its round trip (at most this many re-sent after crash)
+BROADCAST_WINDOW = int(os.environ.get('BROADCAST_WINDOW', '50'))
+
+def format_duration(seconds):
+    """Format seconds as H:MM:SS or M:SS"""
+    seconds = int(max(seconds, 0))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+class Broadcaster:
+    """Runs broadcast jobs in background threads, one send per bucket token"""
+    
+    def __init__(self, bot, rate=BROADCAST_RATE):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self._threads = {}
+        self._stop_event = threading.Event()
+    
+    def start(self, job):
+        """Start (or resume) job in a background thread"""
+        thread = self._threads.get(job.id)
+        if thread and thread.is_alive():
+            return
+        thread = threading.Thread(
+            target=self._run, args=(job,),
+            name=f"broadcast-{job.id}", daemon=True
+        )
+        self._threads[job.id] = thread
+        thread.start()
+    
+    def resume_all(self):
+        """Resume jobs left running by a previous process"""
+        jobs = get_running_broadcast_jobs()
+        for job in jobs:
+            logger.info(f"Resuming broadcast #{job.id} after user {job.last_user_id}")
+            self.start(job)
+        return len(jobs)
+    
+    def stop(self):
+        """Stop all jobs; progress is saved and they resume on next start"""
+        self._stop_event.set()
+    
+    def _send(self, job, user_id):
+        """Queue copy of broadcast message to one user
+        
+        self.bot is the queued bot: copy_message goes out at bulk priority and
+        the send queue retries 429s itself. Returns the send's Future, or None
+        when stopping.
+        """
+        if not self.bucket.acquire(stop_event=self._stop_event):
+            return None
+        return self.bot.send_later(
+            'copy_message', user_id, job.source_chat_id, job.source_message_id,
+            priority=PRIORITY_BULK
+        )
+    
+    def _result(self, job, user_id, future):
+        """Wait for a queued send: True if delivered, False if it failed
+        
+        A 429 that reaches here means the queue gave up; pause the broadcast
+        for retry_after and move on.
+        """
+        try:
+            future.result()
+            return True
+        except ApiTelegramException as e:
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                logger.warning(f"Broadcast #{job.id} to {user_id} still rate limited, pausing {retry_after}s")
+                self.bucket.block_for(retry_after)
+            else:
+                # Blocked bot, deleted account etc. - not worth retrying
+                logger.info(f"Broadcast #{job.id} to {user_id} failed: {e.description}")
+            return False
+        except Exception as e:
+            logger.error(f"Broadcast #{job.id} to {user_id} failed: {e}")
+            return False
+    
+    def _report(self, job, sent, failed, done_this_run, started_at, finished=False):
+        """Edit admin status message with progress, throughput and ETA"""
+        processed = sent + failed
+        elapsed = time.monotonic() - started_at
+        rate = done_this_run / elapsed if elapsed > 0 else 0.0
+        remaining = max(job.total_count - processed, 0)
+        
+        if finished:
+            header = f"✅ Xabar yuborish #{job.id} tugadi"
+            eta = format_duration(elapsed)
+            eta_line = f"⏱ Vaqt: {eta}"
+        else:
+            header = f"📣 Xabar yuborilmoqda #{job.id}"
+            eta_line = f"⏳ Qoldi: ~{format_duration(remaining / rate)}" if rate else "⏳ Qoldi: ..."
+        
+        text = (
+            f"{header}\n\n"
+            f"📨 Yuborildi: {sent}/{job.total_count}\n"
+            f"❌ Xato: {failed}\n"
+            f"⚡ Tezlik: {rate:.1f} xabar/s\n"
+            f"{eta_line}"
+        )
+        try:
+            if job.status_message_id:
+                self.bot.edit_message_text(text, job.admin_chat_id, job.status_message_id)
+            else:
+                status_message = self.bot.send_message(job.admin_chat_id, text)
+                job.status_message_id = status_message.message_id
+                update_broadcast_job(job.id, status_message_id=job.status_message_id)
+        except Exception as e:
+            logger.debug(f"Broadcast #{job.id} status edit skipped: {e}")
+    
+    def _run(self, job):
+        cursor = job.last_user_id or 0
+        sent = job.sent_count or 0
+        failed = job.failed_count or 0
+        done_this_run = 0
+        started_at = time.monotonic()
+        last_report = 0.0
+        window = deque()  # (user_id, future) in send order
+        
+        logger.info(f"Broadcast #{job.id} started: {job.total_count} recipients")
+        while not self._stop_event.is_set():
+            recipients = get_broadcast_recipients(cursor if not window else window[-1][0], RECIPIENT_BATCH_SIZE)
+            if not recipients:
+                break
+            
+            for user_id in recipients:
+                future = self._send(job, user_id)
+                if future is None:
+                    break  # Stopping - user_id was not queued
+                window.append((user_id, future))
+                
+                # Finished sends are counted in order, so the saved cursor
+                # never skips a recipient whose send is still queued
+                while window and (len(window) >= BROADCAST_WINDOW or window[0][1].done()):
+                    done_user_id, done_future = window.popleft()
+                    if self._result(job, done_user_id, done_future):
+                        sent += 1
+                    else:
+                        failed += 1
+                    cursor = done_user_id
+                    done_this_run += 1
+                    if done_this_run % PROGRESS_SAVE_EVERY == 0:
+                        update_broadcast_job(job.id, last_user_id=cursor, sent_count=sent, failed_count=failed)
+                
+                now = time.monotonic()
+                if now - last_report >= STATUS_EDIT_INTERVAL:
+                    last_report = now
+                    self._report(job, sent, failed, done_this_run, started_at)
+        
+        # Queued sends go out even when stopping; count them before saving
+        while window:
+            done_user_id, done_future = window.popleft()
+            if self._result(job, done_user_id, done_future):
+                sent += 1
+            else:
+                failed += 1
+            cursor = done_user_id
+            done_this_run += 1
+        
+        update_broadcast_job(job.id, last_user_id=cursor, sent_count=sent, failed_count=failed)
+        if self._stop_event.is_set():
+            logger.info(f"Broadcast #{job.id} paused at user {cursor}")
+            return
+        
+        update_broadcast_job(job.id, status='done', finished_at=datetime.utcnow())
+        self._report(job, sent, failed, done_this_run, started_at, finished=True)
+        logger.info(f"Broadcast #{job.id} done: {sent} sent, {failed} failed")
@@ -0,0 +1,8 @@
+"""Pytest setup: run tests against a throwaway SQLite database and cache dir"""
+
+import os
+import tempfile
+
+_test_dir = tempfile.mkdtemp(prefix='kruzhok-test-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_test_dir, 'test.db')}")
+os.environ.setdefault('KRUZHOK_CACHE_DIR', os.path.join(_test_dir, 'cache'))
@@ -0,0 +1,37 @@
+"""Small JSON cache on local disk for startup checks"""
+
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    'KRUZHOK_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'kruzhok')
+)
+
+def _cache_path(name):
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+def read_cache(name):
+    """Read cached JSON value, None if missing or unreadable"""
+    try:
+        with open(_cache_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_cache(name, data):
+    """Atomically write JSON value to cache"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = _cache_path(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        logger.warning(f"Could not write cache {name}: {e}")
+        return False
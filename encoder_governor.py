@@ -0,0 +1,117 @@
+"""Pick x264 speed/quality per render from current load"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rungs from best quality (idle) to fastest (overloaded): (preset, crf, threads).
+# threads 0 lets x264 decide; under load fewer threads per job keep
+# concurrent jobs from fighting over the cores.
+DEFAULT_LADDER = [
+    ('medium', 21, 0),
+    ('fast', 23, 0),
+    ('faster', 24, 2),
+    ('veryfast', 26, 2),
+    ('ultrafast', 28, 1),
+]
+DEFAULT_LEVEL = 1  # '-preset fast -crf 23', what renders always used
+
+# Latency (submit to finished render) the governor tries to stay under
+TARGET_LATENCY = float(os.environ.get('RENDER_TARGET_LATENCY', '20'))
+
+# Hysteresis: speed up quickly, slow down (better quality) only after load
+# stayed low for a while
+UP_PRESSURE = 1.0
+DOWN_PRESSURE = 0.5
+UP_INTERVAL = 5.0
+DOWN_INTERVAL = 60.0
+LATENCY_WINDOW = 20
+LATENCY_MAX_AGE = 300.0  # Seconds; older latencies no longer describe the load
+
+def load_ladder():
+    """Ladder from ENCODER_LADDER (JSON list of [preset, crf, threads]) or default"""
+    raw = os.environ.get('ENCODER_LADDER')
+    if not raw:
+        return list(DEFAULT_LADDER)
+    try:
+        ladder = [(str(preset), int(crf), int(threads)) for preset, crf, threads in json.loads(raw)]
+    except (ValueError, TypeError) as e:
+        logger.error(f"Invalid ENCODER_LADDER, using default: {e}")
+        return list(DEFAULT_LADDER)
+    return ladder or list(DEFAULT_LADDER)
+
+def encoder_settings(preset='fast', crf=23, threads=0):
+    """Encoder settings dict as passed to media render functions"""
+    return {'preset': preset, 'crf': crf, 'threads': threads}
+
+class EncoderGovernor:
+    """Moves along the ladder from render queue depth and recent latency
+
+    pressure = max(queued+running renders / workers, p90 latency / target).
+    Above UP_PRESSURE it steps to a faster rung (at most every UP_INTERVAL
+    seconds); below DOWN_PRESSURE it steps back toward quality (at most
+    every DOWN_INTERVAL seconds). In between it holds.
+    """
+
+    def __init__(self, depth, workers, ladder=None, level=DEFAULT_LEVEL,
+                 target_latency=TARGET_LATENCY, clock=time.monotonic):
+        self.ladder = ladder or load_ladder()
+        self.level = min(level, len(self.ladder) - 1)
+        self.target_latency = target_latency
+        self._depth = depth
+        self._workers = max(1, workers)
+        self._clock = clock
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._changed_at = clock()
+        self._lock = threading.Lock()
+        metrics.set_gauge('encoder_governor.level', lambda: self.level)
+
+    def record(self, latency):
+        """Record latency (seconds) of a finished user-facing render"""
+        with self._lock:
+            self._latencies.append((self._clock(), latency))
+
+    def _p90_latency(self):
+        """p90 of recent latencies; 0.0 when none is younger than LATENCY_MAX_AGE"""
+        cutoff = self._clock() - LATENCY_MAX_AGE
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(latency for _, latency in self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+    def pressure(self):
+        return max(self._depth() / self._workers, self._p90_latency() / self.target_latency)
+
+    def choose(self, job=''):
+        """Settings for the next render; logs the decision with job"""
+        with self._lock:
+            now = self._clock()
+            pressure = self.pressure()
+            since_change = now - self._changed_at
+            previous = self.level
+            if pressure > UP_PRESSURE and self.level < len(self.ladder) - 1 and since_change >= UP_INTERVAL:
+                self.level += 1
+            elif pressure < DOWN_PRESSURE and self.level > 0 and since_change >= DOWN_INTERVAL:
+                self.level -= 1
+                # Latencies seen at the faster rung no longer say much
+                self._latencies.clear()
+            if self.level != previous:
+                self._changed_at = now
+            preset, crf, threads = self.ladder[self.level]
+
+        logger.info(
+            f"Encoder for {job or 'render'}: preset={preset} crf={crf} threads={threads or 'auto'} "
+            f"(level {self.level}, pressure {pressure:.2f}"
+            + (f", was level {previous})" if self.level != previous else ")")
+        )
+        metrics.incr(f'encoder_governor.preset.{preset}')
+        return encoder_settings(preset, crf, threads)
@@ -0,0 +1,23 @@
+"""Admin data export to gzip-compressed CSV"""
+
+import csv
+import gzip
+import logging
+
+from models import iter_export_rows
+
+logger = logging.getLogger(__name__)
+
+def write_csv_export(kind, output_path, batch_size=1000):
+    """Write export table to gzip CSV file row by row, return row count"""
+    row_count = 0
+    with gzip.open(output_path, 'wt', encoding='utf-8', newline='', compresslevel=6) as f:
+        writer = csv.writer(f)
+        rows = iter_export_rows(kind, batch_size=batch_size)
+        writer.writerow(next(rows))
+        for row in rows:
+            writer.writerow(row)
+            row_count += 1
+    
+    logger.info(f"Exported {row_count} {kind} rows to {output_path}")
+    return row_count
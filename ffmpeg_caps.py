@@ -0,0 +1,83 @@
+"""FFmpeg capability detection, done once and cached to disk"""
+
+import os
+import re
+import shutil
+import subprocess
+import logging
+import threading
+
+from disk_cache import read_cache, write_cache
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+# Features the render pipeline may use
+WANTED_ENCODERS = ('libx264', 'aac')
+WANTED_FILTERS = ('zoompan', 'gblur', 'hue', 'rotate', 'zscale', 'tonemap')
+
+_caps = None
+_caps_lock = threading.Lock()
+
+def _binary_fingerprint(path):
+    """Identify ffmpeg build by path, size and mtime"""
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{int(stat.st_mtime)}"
+
+def _list_names(path, flag):
+    """Parse names from `ffmpeg -encoders` / `ffmpeg -filters` output"""
+    result = subprocess.run(
+        [path, '-hide_banner', flag],
+        capture_output=True, text=True, check=True
+    )
+    names = set()
+    for line in result.stdout.splitlines():
+        match = re.match(r'^\s*[A-Z.|]{3,}\s+(\S+)\s', line)
+        if match:
+            names.add(match.group(1))
+    return names
+
+def detect_ffmpeg_capabilities(path):
+    """Run ffmpeg to detect version, encoders and filters"""
+    result = subprocess.run([path, '-version'], capture_output=True, text=True, check=True)
+    version = result.stdout.splitlines()[0] if result.stdout else ''
+    encoders = _list_names(path, '-encoders')
+    filters = _list_names(path, '-filters')
+    return {
+        'available': True,
+        'version': version,
+        'encoders': {name: name in encoders for name in WANTED_ENCODERS},
+        'filters': {name: name in filters for name in WANTED_FILTERS}
+    }
+
+def get_ffmpeg_capabilities(refresh=False):
+    """Get ffmpeg capabilities, detecting only when the binary changed"""
+    global _caps
+    with _caps_lock:
+        if _caps is not None and not refresh:
+            return _caps
+        
+        path = shutil.which(FFMPEG_BINARY)
+        if not path:
+            _caps = {'available': False}
+            return _caps
+        
+        fingerprint = _binary_fingerprint(path)
+        cached = read_cache('ffmpeg_caps')
+        if not refresh and cached and cached.get('fingerprint') == fingerprint:
+            _caps = cached['caps']
+            return _caps
+        
+        try:
+            _caps = detect_ffmpeg_capabilities(path)
+            write_cache('ffmpeg_caps', {'fingerprint': fingerprint, 'caps': _caps})
+            logger.info(f"Detected {_caps['version']}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"FFmpeg capability detection failed: {e}")
+            _caps = {'available': False}
+        return _caps
+
+def has_filter(name):
+    """Check if ffmpeg build has given filter"""
+    return get_ffmpeg_capabilities().get('filters', {}).get(name, False)
@@ -0,0 +1,169 @@
+"""In-process photo effect renderer (NumPy + Pillow)
+
+The photo is decoded once, effect frames are computed in Python and piped
+as raw RGB to a single ffmpeg encoder. Static effects compute one frame.
+NumPy and Pillow are optional; AVAILABLE is False without them and
+callers use the ffmpeg filter path instead.
+"""
+
+import math
+import logging
+import subprocess
+
+try:
+    import numpy as np
+    from PIL import Image, ImageFilter
+except ImportError:  # pragma: no cover - depends on environment
+    np = None
+    Image = ImageFilter = None
+
+from process_runner import SupervisedProcess, ProcessCancelled
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+
+# Same effects as media.PHOTO_EFFECT_FILTERS
+ZOOM_STEP = 0.002    # zoom per frame
+ZOOM_MAX = 1.8
+BLUR_SIGMA = 3
+HUE_PERIOD = 3.0     # seconds per hue cycle
+HUE_DEGREES = 180
+HUE_SATURATION = 1.3
+ROTATE_SPEED = math.pi / 3  # radians per second
+
+# BT.601 full range RGB <-> YUV, as used for the hue rotation
+_RGB_TO_YUV = None
+_YUV_TO_RGB = None
+
+def _yuv_matrices():
+    global _RGB_TO_YUV, _YUV_TO_RGB
+    if _RGB_TO_YUV is None:
+        _RGB_TO_YUV = np.array([
+            [0.299, 0.587, 0.114],
+            [-0.168736, -0.331264, 0.5],
+            [0.5, -0.418688, -0.081312]
+        ], dtype=np.float32)
+        _YUV_TO_RGB = np.linalg.inv(_RGB_TO_YUV).astype(np.float32)
+    return _RGB_TO_YUV, _YUV_TO_RGB
+
+def _to_bytes(frame):
+    if isinstance(frame, Image.Image):
+        return frame.tobytes()
+    return np.ascontiguousarray(frame).tobytes()
+
+def static_frame(image, effect_type):
+    """Single frame for effects that don't change over time, else None"""
+    if effect_type == 3:
+        return image.filter(ImageFilter.GaussianBlur(BLUR_SIGMA))
+    if effect_type not in (2, 4, 5):
+        return image
+    return None
+
+def zoom_frames(image, count):
+    width, height = image.size
+    for n in range(count):
+        zoom = min(1 + ZOOM_STEP * (n + 1), ZOOM_MAX)
+        crop_w, crop_h = width / zoom, height / zoom
+        left, top = (width - crop_w) / 2, (height - crop_h) / 2
+        yield image.resize(
+            (width, height), Image.BILINEAR,
+            box=(left, top, left + crop_w, top + crop_h)
+        )
+
+def hue_frames(image, count, fps):
+    """Rotate chroma by sin(2*PI*t/3)*180 degrees and scale saturation"""
+    rgb_to_yuv, yuv_to_rgb = _yuv_matrices()
+    pixels = np.asarray(image, dtype=np.float32).reshape(-1, 3)
+    yuv = pixels @ rgb_to_yuv.T
+    luma = yuv[:, :1] * yuv_to_rgb[:, 0] + 0.5  # Y contribution, +0.5 rounds on cast
+    chroma = np.ascontiguousarray(yuv[:, 1:])
+    chroma_to_rgb = yuv_to_rgb[:, 1:].T
+    rgb = np.empty_like(pixels)
+    out = np.empty(pixels.shape, dtype=np.uint8)
+    shape = (image.size[1], image.size[0], 3)
+    for n in range(count):
+        t = n / fps
+        angle = math.radians(math.sin(2 * math.pi * t / HUE_PERIOD) * HUE_DEGREES)
+        cos_h = math.cos(angle) * HUE_SATURATION
+        sin_h = math.sin(angle) * HUE_SATURATION
+        # (u, v) -> rotated, scaled (u, v) -> RGB as one 2x3 matrix
+        rotation = np.array([[cos_h, sin_h], [-sin_h, cos_h]], dtype=np.float32)
+        np.matmul(chroma, rotation @ chroma_to_rgb, out=rgb)
+        rgb += luma
+        np.clip(rgb, 0, 255, out=rgb)
+        out[:] = rgb
+        yield out.reshape(shape)
+
+def rotate_frames(image, count, fps):
+    for n in range(count):
+        # PIL rotates counter-clockwise, ffmpeg's rotate clockwise
+        degrees = -math.degrees(ROTATE_SPEED * n / fps)
+        yield image.rotate(degrees, resample=Image.BILINEAR)
+
+def effect_frames(image, effect_type, count, fps):
+    """Yield count RGB frames (PIL images or uint8 arrays) for effect"""
+    frame = static_frame(image, effect_type)
+    if frame is not None:
+        data = _to_bytes(frame)
+        for _ in range(count):
+            yield data
+        return
+    if effect_type == 2:
+        frames = zoom_frames(image, count)
+    elif effect_type == 4:
+        frames = hue_frames(image, count, fps)
+    else:
+        frames = rotate_frames(image, count, fps)
+    for frame in frames:
+        yield _to_bytes(frame)
+
+def render_photo(input_path, output_path, effect_type, duration, fps,
+                 cancel_event=None, nice=0, encoder_args=(), progress=None):
+    """Render photo kruzhok by piping effect frames into one ffmpeg encoder
+
+    progress(seconds) is called once per second of frames written.
+    Returns False if cancelled; raises on decode or encoder errors.
+    """
+    with Image.open(input_path) as source:
+        image = source.convert('RGB')
+    width, height = image.size
+    count = int(round(duration * fps))
+
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error', '-nostats',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        '-s', f'{width}x{height}', '-r', str(fps),
+        '-i', '-',
+        '-c:v', 'libx264',
+        '-pix_fmt', 'yuv420p',
+        *encoder_args,
+        output_path
+    ]
+    logger.info(f"Running frame encoder: {' '.join(cmd)}")
+    process = SupervisedProcess(cmd, cancel_event=cancel_event, nice=nice, ionice_idle=bool(nice),
+                                stdin=subprocess.PIPE)
+    cancelled = False
+    try:
+        for n, data in enumerate(effect_frames(image, effect_type, count, fps), 1):
+            if cancel_event is not None and cancel_event.is_set():
+                process.kill('cancel')  # Else closing stdin would finish a short video
+                break
+            process.stdin.write(data)
+            if progress is not None and n % fps == 0:
+                progress(n / fps)
+    except BrokenPipeError:
+        pass  # Encoder died or was killed; wait() says why
+    except BaseException:
+        process.kill('cancel')  # Don't leave a half-fed encoder behind
+        raise
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            process.wait()
+        except ProcessCancelled:
+            cancelled = True
+    return not cancelled
@@ -0,0 +1,75 @@
+"""Per-stage timings of render jobs, kept as RenderJob rows"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import metrics
+from models import save_render_job
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('download', 'probe', 'mezzanine', 'queue', 'encode', 'upload', 'db')
+
+class JobTelemetry:
+    """Collects stage timings of one job; save() stores and logs them
+
+    Stages may repeat (several DB calls) and add up. Helpers that run for
+    speculative renders get a throwaway instance that is never saved.
+    """
+
+    def __init__(self, user_id=None, media_type=None, effect_type=None, clock=time.monotonic):
+        self.user_id = user_id
+        self.media_type = media_type
+        self.effect_type = effect_type
+        self.stages = {}
+        self._clock = clock
+        self._started = clock()
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def start(self, name):
+        """Start timing a stage that ends elsewhere (see stop)"""
+        self._running[name] = self._clock()
+
+    def stop(self, name):
+        started = self._running.pop(name, None)
+        if started is not None:
+            self.add(name, self._clock() - started)
+
+    @contextmanager
+    def stage(self, name):
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.add(name, self._clock() - started)
+
+    def save(self, status, **fields):
+        """Store job with status and extra RenderJob fields; never raises"""
+        total = self._clock() - self._started
+        for name, seconds in self.stages.items():
+            metrics.observe(f'job.{name}', seconds)
+        metrics.observe('job.total', total)
+        logger.info(
+            f"Job user {self.user_id} effect {self.effect_type} {status} in {total:.2f}s: "
+            + ', '.join(f"{name} {self.stages[name]:.2f}s" for name in STAGES if name in self.stages)
+        )
+        try:
+            return save_render_job(
+                user_id=self.user_id,
+                media_type=self.media_type,
+                effect_type=self.effect_type,
+                status=status,
+                total_seconds=total,
+                **{f'{name}_seconds': self.stages.get(name) for name in STAGES},
+                **fields
+            )
+        except Exception as e:
+            logger.error(f"Error saving job telemetry: {e}")
+            return False
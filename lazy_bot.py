@@ -0,0 +1,56 @@
+"""TeleBot proxy that defers bot construction until first use"""
+
+import threading
+
+class LazyBot:
+    """Collects handler registrations and builds the real bot on first API use"""
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._bot = None
+        self._handlers = []
+        self._lock = threading.Lock()
+    
+    def _register(self, bot, kind, handler, kwargs):
+        if kind == 'message':
+            bot.register_message_handler(handler, **kwargs)
+        else:
+            bot.register_callback_query_handler(handler, **kwargs)
+    
+    def _add_handler(self, kind, handler, kwargs):
+        with self._lock:
+            self._handlers.append((kind, handler, kwargs))
+            if self._bot is not None:
+                self._register(self._bot, kind, handler, kwargs)
+    
+    def message_handler(self, **kwargs):
+        """Decorator with the same arguments as TeleBot.message_handler"""
+        def decorator(handler):
+            self._add_handler('message', handler, kwargs)
+            return handler
+        return decorator
+    
+    def callback_query_handler(self, func, **kwargs):
+        """Decorator with the same arguments as TeleBot.callback_query_handler"""
+        def decorator(handler):
+            self._add_handler('callback_query', handler, dict(kwargs, func=func))
+            return handler
+        return decorator
+    
+    @property
+    def is_built(self):
+        return self._bot is not None
+    
+    def get_bot(self):
+        """Build the real bot (once) and register collected handlers"""
+        if self._bot is None:
+            with self._lock:
+                if self._bot is None:
+                    bot = self._factory()
+                    for kind, handler, kwargs in self._handlers:
+                        self._register(bot, kind, handler, kwargs)
+                    self._bot = bot
+        return self._bot
+    
+    def __getattr__(self, name):
+        return getattr(self.get_bot(), name)
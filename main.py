@@ -2,16 +2,39 @@
 # -*- coding: utf-8 -*-
 
 import os
-import subprocess
 import time
-import tempfile
-import json
 from pathlib import Path
+from collections import OrderedDict
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import telebot
 from telebot import types
 import logging
+from lazy_bot import LazyBot
+from export import write_csv_export
+from broadcast import Broadcaster
+from send_queue import SendQueue, QueuedBot, PRIORITY_INTERACTIVE
+from telegram_http import install_session, configure_api_server, fetch_file, upload_source
+from render_pool import RenderPool, system_load, LANE_PREMIUM, LANE_FREE, LANE_BACKGROUND
+from encoder_governor import EncoderGovernor
+from job_telemetry import JobTelemetry
+from progress import ProgressReporter, format_eta
+from render_cost import CostModel
+from upload_admission import (
+    UploadLimiter, check_video, check_photo, pick_photo_size,
+    UPLOAD_MAX_BYTES, UPLOAD_MAX_DURATION, UPLOAD_MAX_SIDE
+)
+from process_runner import kill_all
+import metrics
+from ffmpeg_caps import get_ffmpeg_capabilities
+from media import (
+    create_temp_file, cleanup_file, make_mezzanine, render_media, probe_media,
+    audio_levels, choose_audio, size_targeted, output_budget,
+    MediaInfo, RenderCancelled, SPLIT_SEGMENTS, MAX_VIDEO_DURATION
+)
 from models import (
-    create_tables, 
+    ensure_schema,
+    get_db_session,
     save_user_history, 
     get_user_history, 
     get_total_user_kruzhoks,
@@ -23,23 +46,25 @@ from models import (
     get_user_limits,
     add_referral,
     get_referral_stats,
+    get_favourite_effect,
+    get_admin_counts,
+    get_usage_stats,
+    EXPORT_MODELS,
+    create_broadcast_job,
+    update_broadcast_job,
     create_payment_request,
-    get_pending_payments,
+    get_pending_payments_page,
+    count_pending_payments,
     approve_payment,
+    approve_payments,
     reject_payment
 )
 
 # Environment variables are handled by Replit automatically
-
-# DATABASE_URL ni tekshirish
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable is required")
+# DATABASE_URL bo'lmasa models.py SQLite fayldan foydalanadi
 
 # BOT_TOKEN ni olish
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN environment variable is required")
 
 # Admin ID
 ADMIN_ID = 5615887242
@@ -54,8 +79,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Botni ishga tushirish
-bot = telebot.TeleBot(BOT_TOKEN)
+def create_bot():
+    """Create TeleBot instance (called on first bot use)"""
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN environment variable is required")
+    install_session()
+    configure_api_server()
+    return telebot.TeleBot(BOT_TOKEN)
+
+# Botni ishga tushirish - haqiqiy bot birinchi ishlatilganda yaratiladi.
+# Barcha yuborishlar umumiy navbat orqali (global va chat limitlari bilan)
+send_queue = SendQueue()
+bot = QueuedBot(LazyBot(create_bot), send_queue)
+
+# Botning o'z ma'lumotlari (get_me) - bir marta olinadi
+_bot_identity = None
+
+def get_bot_identity():
+    """Get bot's own User object, fetched once and cached"""
+    global _bot_identity
+    if _bot_identity is None:
+        _bot_identity = bot.get_me()
+    return _bot_identity
+
+# Admin /broadcast ishlari (restartdan keyin davom etadi)
+broadcaster = Broadcaster(bot)
 
 # ⬇️ Shu yerga qolgan bot kodlaringizni yozasiz
 
@@ -64,6 +112,48 @@ user_states = {}
 user_media_files = {}
 user_payment_plans = {}  # Store selected payment plan
 
+# Renders run on a shared pool
+render_pool = RenderPool()
+# x264 preset/CRF per render, faster when the pool is backed up
+encoder_governor = EncoderGovernor(render_pool.pending, render_pool.workers)
+# Predicted render seconds per job, calibrated from finished renders
+render_cost = CostModel()
+# Renders are refused while the predicted wait for a worker is longer
+RENDER_MAX_BACKLOG = float(os.getenv("RENDER_MAX_BACKLOG", "120"))
+
+# Optional: pre-render the user's likely effect while the keyboard is shown
+SPECULATIVE_RENDER = os.getenv("SPECULATIVE_RENDER", "").lower() in ('1', 'true', 'yes')
+SPECULATION_MAX_LOAD = float(os.getenv("SPECULATION_MAX_LOAD", "0.5"))  # load avg per core
+SPECULATION_NICE = 10
+GLOBAL_FAVOURITE_TTL = 600
+speculation_lock = threading.Lock()
+# Guards user_media_files replacement and sessions' in-flight effect
+session_lock = threading.Lock()
+
+def speculation_hit_rate():
+    """Share of chosen effects served by a speculative render"""
+    hits = metrics.get_counter('speculation.hit')
+    total = hits + metrics.get_counter('speculation.miss')
+    return round(hits / total, 3) if total else None
+
+metrics.set_gauge('speculation.hit_rate', speculation_hit_rate)
+
+# Source files are downloaded while the user picks an effect
+# Upload stays available for other effects this long after last use
+SESSION_TTL = int(os.getenv("SESSION_TTL", "600"))
+SESSION_SWEEP_INTERVAL = 60
+
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+# Uploads per user are rate limited before anything is downloaded
+upload_limiter = UploadLimiter()
+download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='download')
+payment_inboxes = OrderedDict()  # (chat_id, message_id) -> admin inbox page state
+PAYMENT_INBOXES_MAX = 20  # Older inbox messages fall back to a fresh first page
+pending_broadcasts = set()  # (chat_id, message_id) previewed, waiting for admin's confirm
+
+# Admin payment inbox page size
+PAYMENTS_PAGE_SIZE = 5
+
 # Effect names mapping
 EFFECT_NAMES = {
     1: "Oddiy",
@@ -93,6 +183,16 @@ Tezkor buyruqlar:
         'unsupported': "❌ Qo'llab-quvvatlanmaydigan fayl turi. Faqat video yoki rasm yuboring.",
         'choose_effect': "🎨 Quyidagi effektlardan birini tanlang:",
         'effect_processing': "🎬 Effekt qo'llanmoqda...",
+        'effect_progress': "🎬 Effekt qo'llanmoqda... {percent}%\n⏳ Taxminan {eta} qoldi",
+        'effect_eta': "🎬 Effekt qo'llanmoqda...\n⏳ Taxminan {eta} ichida tayyor bo'ladi",
+        'render_busy': "⏳ Hozir navbat juda uzun (taxminan {eta}). Birozdan keyin effektni qayta tanlang:",
+        'effect_cancelled': "⏹ Yangi fayl yuborildi, bu ishlov to'xtatildi.",
+        'effect_in_flight': "⏳ Effekt allaqachon qo'llanmoqda, biroz kuting",
+        'upload_too_large': "❌ Fayl juda katta (ko'pi bilan {mb} MB).",
+        'upload_too_long': "❌ Video juda uzun (ko'pi bilan {minutes} daqiqa).",
+        'upload_too_big_frame': "❌ Video o'lchami juda katta (ko'pi bilan {side} px).",
+        'upload_bad_type': "❌ Bu video formati qo'llab-quvvatlanmaydi. MP4 yuboring.",
+        'upload_flood': "⏳ Juda ko'p fayl yubordingiz. {seconds} soniyadan keyin qayta urinib ko'ring.",
         'history_header': "🗂 Oxirgi kruzhok videolaringiz:",
         'history_empty': "📭 Hali kruzhok yaratmagansiz. Video yoki rasm yuboring!",
         'history_count': "📊 Jami yaratilgan kruzhoklar: {count} ta",
@@ -146,11 +246,23 @@ Chek rasmini yuboring!""",
         'unsupported': "❌ Неподдерживаемый тип файла. Отправьте только видео или фото.",
         'choose_effect': "🎨 Выберите один из следующих эффектов:",
         'effect_processing': "🎬 Применяется эффект...",
+        'effect_progress': "🎬 Применяется эффект... {percent}%\n⏳ Осталось примерно {eta}",
+        'effect_eta': "🎬 Применяется эффект...\n⏳ Будет готово примерно через {eta}",
+        'render_busy': "⏳ Сейчас очередь слишком длинная (примерно {eta}). Выберите эффект чуть позже:",
+        'effect_cancelled': "⏹ Отправлен новый файл, эта обработка остановлена.",
+        'effect_in_flight': "⏳ Эффект уже применяется, подождите немного",
+        'upload_too_large': "❌ Файл слишком большой (не больше {mb} МБ).",
+        'upload_too_long': "❌ Видео слишком длинное (не больше {minutes} мин).",
+        'upload_too_big_frame': "❌ Слишком большое разрешение видео (не больше {side} px).",
+        'upload_bad_type': "❌ Этот формат видео не поддерживается. Отправьте MP4.",
+        'upload_flood': "⏳ Слишком много файлов. Попробуйте снова через {seconds} сек.",
         'history_header': "🗂 Ваши последние кружки:",
         'history_empty': "📭 Вы еще не создали кружки. Отправьте видео или фото!",
         'history_count': "📊 Всего создано кружков: {count} шт.",
         'lang_selection': "🌐 Выберите один из следующих языков:",
-        'language_set': "✅ Язык установлен на русский!"
+        'language_set': "✅ Язык установлен на русский!",
+        'payment_approved': "🎉 Ваш платёж подтверждён! Премиум активирован.",
+        'payment_rejected': "❌ Ваш платёж отклонён. Причина: {reason}"
     },
     'en': {
         'welcome': """👋 Hello, {}!
@@ -170,14 +282,29 @@ Quick commands:
         'unsupported': "❌ Unsupported file type. Send video or photo only.",
         'choose_effect': "🎨 Choose one of the following effects:",
         'effect_processing': "🎬 Applying effect...",
+        'effect_progress': "🎬 Applying effect... {percent}%\n⏳ About {eta} left",
+        'effect_eta': "🎬 Applying effect...\n⏳ Ready in about {eta}",
+        'render_busy': "⏳ The queue is too long right now (about {eta}). Choose the effect again a bit later:",
+        'effect_cancelled': "⏹ A new file was sent, this render was stopped.",
+        'effect_in_flight': "⏳ An effect is already being applied, please wait",
+        'upload_too_large': "❌ The file is too large (up to {mb} MB).",
+        'upload_too_long': "❌ The video is too long (up to {minutes} min).",
+        'upload_too_big_frame': "❌ The video resolution is too high (up to {side} px).",
+        'upload_bad_type': "❌ This video format is not supported. Send an MP4.",
+        'upload_flood': "⏳ Too many files. Try again in {seconds} s.",
         'history_header': "🗂 Your recent circles:",
         'history_empty': "📭 You haven't created any circles yet. Send a video or photo!",
         'history_count': "📊 Total circles created: {count}",
         'lang_selection': "🌐 Choose one of the following languages:",
-        'language_set': "✅ Language set to English!"
+        'language_set': "✅ Language set to English!",
+        'payment_approved': "🎉 Your payment was approved! Premium is active.",
+        'payment_rejected': "❌ Your payment was rejected. Reason: {reason}"
     }
 }
 
+# Keys missing in a translation fall back to Uzbek
+USER_MESSAGES = {lang: {**MESSAGES['uz'], **texts} for lang, texts in MESSAGES.items()}
+
 def is_admin(user_id):
     """Check if user is admin"""
     return user_id == ADMIN_ID
@@ -185,7 +312,7 @@ def is_admin(user_id):
 def get_user_messages(user_id):
     """Get messages in user's preferred language"""
     lang = get_user_language(user_id)
-    return MESSAGES.get(lang, MESSAGES['uz'])
+    return USER_MESSAGES.get(lang, USER_MESSAGES['uz'])
 
 def create_language_keyboard():
     """Create inline keyboard for language selection"""
@@ -216,131 +343,345 @@ def create_effect_keyboard():
     
     return markup
 
-def create_temp_file(suffix=""):
-    """Create a temporary file and return its path"""
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    temp_file.close()
-    return temp_file.name
+def start_media_session(message, file_id, media_type, suffix, info=None, file_unique_id=None):
+    """Start background download and show effect keyboard immediately
+    
+    The same file sent again keeps its session (download, mezzanine and any
+    running render) and only gets a fresh keyboard.
+    """
+    user_id = message.from_user.id
+    messages = get_user_messages(user_id)
+    
+    with session_lock:
+        previous = user_media_files.get(user_id)
+        repeated = (previous is not None and file_unique_id is not None
+                    and previous.get('file_unique_id') == file_unique_id
+                    and not previous.get('released'))
+        if not repeated:
+            user_media_files.pop(user_id, None)
+    
+    if repeated:
+        metrics.incr('media.session.repeated')
+        media_info = previous
+        media_info['touched'] = time.monotonic()
+    else:
+        # Drop previous unfinished upload of this user
+        if previous:
+            release_media(previous)
+        
+        media_info = user_media_files[user_id] = {
+            'download': download_executor.submit(fetch_file, bot, file_id, suffix),
+            'file_unique_id': file_unique_id,
+            'media_type': media_type,
+            'info': info,  # MediaInfo from message metadata, else probed after download
+            'mezzanine_lock': threading.Lock(),
+            'cancel_event': threading.Event(),
+            'touched': time.monotonic()
+        }
+        
+        if SPECULATIVE_RENDER:
+            media_info['download'].add_done_callback(
+                lambda future: start_speculative_render(user_id, media_info)
+            )
+    user_states[user_id] = 'choosing_effect'
+    media_info['messages'] = messages  # Answers to repeated taps skip the language lookup
+    
+    # Send effect selection menu with inline keyboard; only this one stays live
+    markup = create_effect_keyboard()
+    sent = bot.reply_to(message, messages['choose_effect'], reply_markup=markup)
+    media_info['keyboard'] = sent.message_id
+
+def admit_upload(message, reason=None):
+    """Check flood limit and metadata refusal reason; reply and return False to refuse"""
+    user_id = message.from_user.id
+    delay, warn = upload_limiter.admit(user_id)
+    if delay:
+        # One reply per flood, the rest are dropped silently
+        if warn:
+            messages = get_user_messages(user_id)
+            bot.reply_to(message, messages['upload_flood'].format(seconds=max(1, int(delay + 0.5))))
+        return False
+    if reason is not None:
+        metrics.incr(f'upload.refused.{reason}')
+        messages = get_user_messages(user_id)
+        bot.reply_to(message, messages[f'upload_{reason}'].format(
+            mb=UPLOAD_MAX_BYTES // (1024 * 1024),
+            minutes=UPLOAD_MAX_DURATION // 60,
+            side=UPLOAD_MAX_SIDE
+        ))
+        return False
+    return True
 
-def cleanup_file(file_path):
-    """Safely delete a file"""
+def claim_media_session(user_id, message_id, effect_type):
+    """Mark user's session as rendering effect_type for a tap on message_id
+    
+    Returns (media_info, None), or (None, 'stale') when message_id is not the
+    session's live keyboard (an older upload or an already used keyboard),
+    or (media_info, 'busy') while a render of the session is in flight.
+    """
+    with session_lock:
+        media_info = user_media_files.get(user_id)
+        if media_info is None or media_info.get('keyboard') != message_id:
+            return None, 'stale'
+        if media_info.get('in_flight') is not None:
+            return media_info, 'busy'
+        media_info['in_flight'] = effect_type
+        return media_info, None
+
+_global_favourite = {'effect': None, 'expires': 0.0}
+
+def predict_effect(user_id):
+    """Guess effect: user's most used one, else most used overall (cached)"""
+    effect = get_favourite_effect(user_id)
+    if effect is not None:
+        return effect
+    
+    now = time.monotonic()
+    if now >= _global_favourite['expires']:
+        _global_favourite['effect'] = get_favourite_effect() or 1
+        _global_favourite['expires'] = now + GLOBAL_FAVOURITE_TTL
+    return _global_favourite['effect']
+
+def start_speculative_render(user_id, media_info):
+    """Pre-render the likely effect while the user is still choosing"""
     try:
-        if os.path.exists(file_path):
-            os.unlink(file_path)
-            logger.info(f"Cleaned up file: {file_path}")
+        if media_info['download'].cancelled() or media_info['download'].exception() is not None:
+            return
+        if not render_pool.has_idle_worker() or system_load() >= SPECULATION_MAX_LOAD:
+            metrics.incr('speculation.skipped')
+            return
+        # Probe here (download thread), not on the render worker
+        if not fetch_source(media_info):
+            return
+        
+        effect_type = predict_effect(user_id)
+        speculative = {
+            'effect_type': effect_type,
+            'output_file': create_temp_file(suffix='.mp4'),
+            'cancel_event': threading.Event()
+        }
+        
+        with speculation_lock:
+            if media_info.get('released') or media_info.get('effect_chosen'):
+                cleanup_file(speculative['output_file'])
+                return
+            speculative['future'] = render_pool.submit(
+                render_session, media_info, speculative['output_file'], effect_type,
+                cancel_event=speculative['cancel_event'], nice=SPECULATION_NICE,
+                lane=LANE_BACKGROUND
+            )
+            media_info['speculative'] = speculative
+        
+        metrics.incr('speculation.started')
+        logger.info(f"Speculative render of effect {effect_type} for user {user_id}")
     except Exception as e:
-        logger.error(f"Error cleaning up file {file_path}: {e}")
-
-def get_video_duration(input_path):
-    """Get video duration using ffprobe"""
+        logger.error(f"Error starting speculative render: {e}")
+
+def cancel_speculative_render(speculative):
+    """Stop speculative render and delete its output when it ends"""
+    speculative['cancel_event'].set()
+    speculative['future'].cancel()
+    speculative['future'].add_done_callback(
+        lambda future: cleanup_file(speculative['output_file'])
+    )
+
+def take_speculative_render(media_info, effect_type):
+    """Claim speculative result for chosen effect
+    
+    Returns (success, output_file); (False, None) if there was no usable result.
+    """
+    with speculation_lock:
+        media_info['effect_chosen'] = True
+        speculative = media_info.pop('speculative', None)
+    
+    if speculative is None:
+        return False, None
+    
+    if speculative['effect_type'] != effect_type:
+        metrics.incr('speculation.miss')
+        cancel_speculative_render(speculative)
+        return False, None
+    
+    metrics.incr('speculation.hit')
+    if speculative['future'].cancel():
+        # Not started: the background lane waits for every user job, so
+        # render in the user's own lane instead of waiting on it
+        metrics.incr('speculation.hit_queued')
+        return False, speculative['output_file']
     try:
-        cmd = [
-            'ffprobe', '-v', 'quiet', '-print_format', 'json',
-            '-show_format', '-show_streams', input_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        import json
-        data = json.loads(result.stdout)
-        duration = float(data['format']['duration'])
-        return duration
+        return speculative['future'].result(), speculative['output_file']
     except Exception as e:
-        logger.error(f"Error getting video duration: {e}")
-        return 10.0  # Default fallback
-
-def process_video_to_kruzhok(input_path, output_path, effect_type=1):
-    """Convert video to circular kruzhok format using ffmpeg with effects"""
+        logger.error(f"Speculative render failed: {e}")
+        return False, speculative['output_file']
+
+def wait_for_media(media_info, job=None):
+    """Wait for background download, return local source path"""
+    if 'file_path' not in media_info:
+        started = time.monotonic()
+        with (job or JobTelemetry()).stage('download'):
+            file_path, owned = media_info['download'].result()
+        metrics.observe('media.download_wait', time.monotonic() - started)
+        media_info['file_path'] = file_path
+        media_info['owned'] = owned
+    return media_info['file_path']
+
+def get_media_info(media_info, job=None):
+    """Session's MediaInfo, probing the source unless message metadata was enough"""
+    if media_info['info'] is None:
+        source = wait_for_media(media_info, job)
+        with (job or JobTelemetry()).stage('probe'):
+            media_info['info'] = probe_media(source) or MediaInfo()
+        metrics.incr('media.probe.ran')
+    elif not media_info['info'].probed:
+        metrics.incr('media.probe.skipped')
+    return media_info['info']
+
+def fetch_source(media_info, job=None):
+    """Download and probe session's source in the calling thread
+    
+    Called before render_pool.submit, so no render worker waits on a
+    transfer. False if the download failed or was cancelled.
+    """
     try:
-        # Get video info first
-        duration = get_video_duration(input_path)
-        
-        # Limit duration to 60 seconds for kruzhok
-        duration = min(duration, 60.0)
-        
-        # Define video filter based on effect type
-        if effect_type == 1:  # Oddiy dumaloq video
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,format=yuv420p'
-        elif effect_type == 2:  # Zoom effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,zoompan=z=\'min(zoom+0.0015,1.5)\':d=1:x=iw/2-(iw/zoom/2):y=ih/2-(ih/zoom/2),format=yuv420p'
-        elif effect_type == 3:  # Blur effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,gblur=sigma=2:steps=1,format=yuv420p'
-        elif effect_type == 4:  # Rang o'zgarishi effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,hue=h=sin(2*PI*t)*360:s=1.5,format=yuv420p'
-        elif effect_type == 5:  # Aylanish effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,rotate=PI*t/5,format=yuv420p'
-        else:
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,format=yuv420p'
-        
-        # FFmpeg command to create circular video with effects
-        cmd = [
-            'ffmpeg', '-y',  # Overwrite output file
-            '-i', input_path,
-            '-t', str(duration),  # Limit duration
-            '-vf', video_filter,
-            '-c:v', 'libx264',  # Video codec
-            '-c:a', 'aac',      # Audio codec
-            '-b:a', '128k',     # Audio bitrate
-            '-ar', '44100',     # Audio sample rate
-            '-ac', '2',         # Audio channels
-            '-preset', 'fast',  # Encoding preset
-            '-crf', '23',       # Quality setting
-            output_path
-        ]
-        
-        logger.info(f"Running ffmpeg command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        logger.info("Video processing completed successfully")
+        wait_for_media(media_info, job)
+        get_media_info(media_info, job)
         return True
-        
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFmpeg error: {e.stderr}")
-        return False
     except Exception as e:
-        logger.error(f"Error processing video: {e}")
+        if not media_info['cancel_event'].is_set():
+            logger.error(f"Error downloading source: {e}")
         return False
 
-def process_photo_to_kruzhok(input_path, output_path, effect_type=1):
-    """Convert photo to 5-second circular kruzhok with effects"""
-    try:
-        # Define video filter based on effect type
-        if effect_type == 1:  # Oddiy dumaloq video
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,format=yuv420p'
-        elif effect_type == 2:  # Zoom effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,zoompan=z=\'min(zoom+0.002,1.8)\':d=1:x=iw/2-(iw/zoom/2):y=ih/2-(ih/zoom/2),format=yuv420p'
-        elif effect_type == 3:  # Blur effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,gblur=sigma=3:steps=2,format=yuv420p'
-        elif effect_type == 4:  # Rang o'zgarishi effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,hue=h=sin(2*PI*t/3)*180:s=1.3,format=yuv420p'
-        elif effect_type == 5:  # Aylanish effekti
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,rotate=PI*t/3,format=yuv420p'
+def get_mezzanine(media_info, job=None):
+    """Return session's normalized 480x480 source, building it on first use"""
+    job = job or JobTelemetry()
+    with media_info['mezzanine_lock']:
+        if 'mezzanine' not in media_info:
+            source = wait_for_media(media_info, job)
+            info = get_media_info(media_info, job)
+            started = time.monotonic()
+            with job.stage('mezzanine'):
+                mezzanine = make_mezzanine(
+                    media_info['media_type'], source,
+                    cancel_event=media_info['cancel_event'], info=info
+                )
+            metrics.observe(f"media.mezzanine.{media_info['media_type']}", time.monotonic() - started)
+            with speculation_lock:
+                if media_info.get('released'):
+                    cleanup_file(mezzanine)
+                    raise RenderCancelled()
+                media_info['mezzanine'] = mezzanine
+        return media_info['mezzanine']
+
+def get_audio_settings(media_info, mezzanine):
+    """Session's (kbps, channels) output audio, analyzed once from the mezzanine"""
+    if 'audio' not in media_info:
+        mezzanine_info = probe_media(mezzanine) if media_info['media_type'] == 'video' else None
+        if media_info['media_type'] != 'video':
+            media_info['audio'] = (0, 0)
+        elif mezzanine_info is None:
+            # A failed probe says nothing about the audio: keep the default
+            logger.warning("Mezzanine probe failed, using default audio bitrate")
+            media_info['audio'] = choose_audio(None)
+        elif not mezzanine_info.has_audio:
+            media_info['audio'] = (0, 0)
         else:
-            video_filter = 'scale=480:480:force_original_aspect_ratio=increase,crop=480:480,format=yuv420p'
-        
-        # FFmpeg command to create 5-second circular video from image with effects
-        cmd = [
-            'ffmpeg', '-y',  # Overwrite output file
-            '-loop', '1',    # Loop the input image
-            '-i', input_path,
-            '-t', '5',       # 5 seconds duration
-            '-vf', video_filter,
-            '-c:v', 'libx264',  # Video codec
-            '-pix_fmt', 'yuv420p',
-            '-r', '25',         # Frame rate
-            '-preset', 'fast',  # Encoding preset
-            '-crf', '23',       # Quality setting
-            output_path
-        ]
-        
-        logger.info(f"Running ffmpeg command for photo: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        logger.info("Photo processing completed successfully")
-        return True
-        
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFmpeg error for photo: {e.stderr}")
+            try:
+                media_info['audio'] = choose_audio(audio_levels(mezzanine, media_info['cancel_event']))
+            except RenderCancelled:
+                raise
+            except Exception as e:
+                logger.warning(f"Audio analysis failed, using default bitrate: {e}")
+                media_info['audio'] = choose_audio(None)
+        metrics.incr(f"render.audio.{media_info['audio'][0]}k")
+    return media_info['audio']
+
+def session_output_duration(media_info):
+    """Kruzhok length in seconds, None until the source is probed"""
+    info = media_info['info']
+    return info.output_duration(media_info['media_type']) if info else None
+
+def render_cost_features(media_info):
+    """(duration, pixels, mezzanine_ready) of a session for the cost model"""
+    info = media_info['info']
+    duration = session_output_duration(media_info) or MAX_VIDEO_DURATION
+    pixels = info.width * info.height if info and info.width and info.height else None
+    return duration, pixels, 'mezzanine' in media_info
+
+def estimate_render(media_info, effect_type, lane):
+    """(cost, wait): predicted worker seconds and seconds until a worker is free"""
+    cost = render_cost.predict(media_info['media_type'], effect_type, *render_cost_features(media_info))
+    if render_pool.has_idle_worker():
+        return cost, 0.0
+    return cost, render_pool.backlog(lane) / render_pool.workers
+
+def render_session(media_info, output_file, effect_type, cancel_event=None, nice=0, segments=1,
+                   encoder=None, job=None, progress=None):
+    """Render effect from session's mezzanine; False if it can't be built
+
+    Runs on a render worker: the source must already be fetched
+    (fetch_source), so only CPU work happens here. job (JobTelemetry) gets the stage timings, progress(seconds) the encode
+    progress.
+    """
+    job = job or JobTelemetry()
+    job.stop('queue')
+    try:
+        input_file = get_mezzanine(media_info, job)
+        with media_info['mezzanine_lock'], job.stage('mezzanine'):
+            audio = get_audio_settings(media_info, input_file)
+    except RenderCancelled:
         return False
     except Exception as e:
-        logger.error(f"Error processing photo: {e}")
+        logger.error(f"Error normalizing source: {e}")
         return False
+    duration = media_info['info'].output_duration(media_info['media_type'])
+    with job.stage('encode'):
+        return render_media(
+            media_info['media_type'], input_file, output_file, effect_type, cancel_event, nice,
+            segments, duration=duration,
+            encoder=size_targeted(encoder, duration or MAX_VIDEO_DURATION, audio),
+            progress=progress
+        )
+
+def expire_media_sessions():
+    """Release sessions unused for SESSION_TTL (runs forever)"""
+    while True:
+        time.sleep(SESSION_SWEEP_INTERVAL)
+        now = time.monotonic()
+        expired = []
+        with session_lock:
+            for user_id, media_info in list(user_media_files.items()):
+                if now - media_info['touched'] < SESSION_TTL or media_info.get('in_flight') is not None:
+                    continue
+                del user_media_files[user_id]
+                user_states.pop(user_id, None)
+                expired.append((user_id, media_info))
+        # Cancelling downloads and deleting files can be slow; not under the lock
+        for user_id, media_info in expired:
+            release_media(media_info)
+            logger.info(f"Expired media session of user {user_id}")
+
+def _cleanup_download(future):
+    if not future.cancelled() and future.exception() is None:
+        file_path, owned = future.result()
+        if owned:
+            cleanup_file(file_path)
+
+def release_media(media_info):
+    """Delete user's mezzanine and source (unless it belongs to the Bot API server)"""
+    with speculation_lock:
+        media_info['released'] = True
+        speculative = media_info.pop('speculative', None)
+        mezzanine = media_info.pop('mezzanine', None)
+    media_info['cancel_event'].set()
+    if speculative:
+        cancel_speculative_render(speculative)
+    if mezzanine:
+        cleanup_file(mezzanine)
+    
+    download = media_info.get('download')
+    if download is not None and not download.cancel():
+        # Download running or finished - clean up whenever it's done
+        download.add_done_callback(_cleanup_download)
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -366,11 +707,8 @@ def send_welcome(message):
                         referrer_first_name=message.from_user.first_name
                     ):
                         # Notify referrer about bonus
-                        try:
-                            messages_referrer = get_user_messages(referrer_id)
-                            bot.send_message(referrer_id, messages_referrer['referral_success'])
-                        except:
-                            pass
+                        messages_referrer = get_user_messages(referrer_id)
+                        bot.notify(referrer_id, messages_referrer['referral_success'])
             except:
                 pass
     
@@ -402,24 +740,22 @@ def handle_admin_command(message):
     
     # Admin statistics
     try:
-        from models import SessionLocal, UserHistory, UserLanguage
-        session = SessionLocal()
-        
-        total_users = session.query(UserLanguage).count()
-        total_kruzhoks = session.query(UserHistory).count()
+        counts = get_admin_counts()
         
         admin_text = f"""👑 Admin Panel
 
 📊 Statistika:
-👥 Jami foydalanuvchilar: {total_users}
-🎬 Jami kruzhoklar: {total_kruzhoks}
+👥 Jami foydalanuvchilar: {counts['total_users']}
+🎬 Jami kruzhoklar: {counts['total_kruzhoks']}
 
 🛠 Admin buyruqlari:
 /stats - Batafsil statistika
+/payments - Kutilayotgan to'lovlar
+/export - Ma'lumotlarni CSV yuklab olish
+/metrics - Ichki ko'rsatkichlar
 /broadcast - Xabar yuborish"""
         
         bot.reply_to(message, admin_text)
-        session.close()
         
     except Exception as e:
         logger.error(f"Error in admin command: {e}")
@@ -434,21 +770,9 @@ def handle_stats_command(message):
         return
     
     try:
-        from models import SessionLocal, UserHistory, UserLanguage
-        from sqlalchemy import func
-        session = SessionLocal()
-        
-        # Get user count by language
-        lang_stats = session.query(
-            UserLanguage.language_code, 
-            func.count(UserLanguage.id)
-        ).group_by(UserLanguage.language_code).all()
-        
-        # Get effect usage stats
-        effect_stats = session.query(
-            UserHistory.effect_name,
-            func.count(UserHistory.id)
-        ).group_by(UserHistory.effect_name).all()
+        usage = get_usage_stats()
+        lang_stats = usage['languages']
+        effect_stats = usage['effects']
         
         stats_text = "📊 Batafsil Statistika:\n\n"
         
@@ -462,12 +786,19 @@ def handle_stats_command(message):
             stats_text += f"  {effect}: {count}\n"
         
         bot.reply_to(message, stats_text)
-        session.close()
         
     except Exception as e:
         logger.error(f"Error in stats command: {e}")
         bot.reply_to(message, "❌ Xatolik yuz berdi")
 
+@bot.message_handler(commands=['metrics'])
+def handle_metrics_command(message):
+    """Handle /metrics command - admin only, show internal metrics"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    bot.reply_to(message, f"📈 Metrics:\n\n{metrics.format_metrics()}")
+
 @bot.message_handler(commands=['referral'])
 def handle_referral_command(message):
     """Handle /referral command - show referral info and link"""
@@ -476,7 +807,7 @@ def handle_referral_command(message):
     
     try:
         stats = get_referral_stats(user_id)
-        bot_username = bot.get_me().username
+        bot_username = get_bot_identity().username
         referral_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
         
         referral_text = messages['referral_info'].format(
@@ -535,39 +866,205 @@ def handle_limits_command(message):
         logger.error(f"Error in limits command: {e}")
         bot.reply_to(message, messages['error'])
 
+def render_payment_inbox(state):
+    """Build text and keyboard for current payment inbox page"""
+    payments, has_more = get_pending_payments_page(
+        limit=PAYMENTS_PAGE_SIZE,
+        after=state['anchors'][-1]
+    )
+    state['page'] = payments
+    total = count_pending_payments()
+    
+    if not payments:
+        text = "📭 Kutilayotgan to'lovlar yo'q"
+    else:
+        lines = [f"💳 Kutilayotgan to'lovlar: {total} ta (sahifa {len(state['anchors'])})", ""]
+        for payment in payments:
+            mark = "☑️" if payment.id in state['selected'] else "▫️"
+            lines.append(
+                f"{mark} #{payment.id} | {payment.first_name} (@{payment.username or 'username_yoq'})\n"
+                f"    💰 {payment.payment_amount:,} so'm | 📅 {payment.payment_plan} | "
+                f"🕒 {payment.created_at.strftime('%d.%m.%Y %H:%M')} | /receipt_{payment.id}"
+            )
+        text = "\n".join(lines)
+    
+    markup = types.InlineKeyboardMarkup()
+    for payment in payments:
+        mark = "☑️" if payment.id in state['selected'] else "▫️"
+        markup.row(
+            types.InlineKeyboardButton(f"{mark} #{payment.id}", callback_data=f"pinbox:sel:{payment.id}"),
+            types.InlineKeyboardButton("✅", callback_data=f"pinbox:ok:{payment.id}"),
+            types.InlineKeyboardButton("❌", callback_data=f"pinbox:no:{payment.id}")
+        )
+    
+    nav = []
+    if len(state['anchors']) > 1:
+        nav.append(types.InlineKeyboardButton("⬅️", callback_data="pinbox:prev"))
+    nav.append(types.InlineKeyboardButton("🔄", callback_data="pinbox:refresh"))
+    if has_more:
+        nav.append(types.InlineKeyboardButton("➡️", callback_data="pinbox:next"))
+    markup.row(*nav)
+    
+    if state['selected']:
+        markup.row(types.InlineKeyboardButton(
+            f"✅ Tanlanganlarni tasdiqlash ({len(state['selected'])})",
+            callback_data="pinbox:bulk"
+        ))
+    
+    return text, markup
+
+def remember_payment_inbox(key, state):
+    """Keep inbox state, dropping the least recently used beyond PAYMENT_INBOXES_MAX"""
+    payment_inboxes[key] = state
+    payment_inboxes.move_to_end(key)
+    while len(payment_inboxes) > PAYMENT_INBOXES_MAX:
+        payment_inboxes.popitem(last=False)
+    return state
+
+def notify_payment_approved(payments):
+    """Queue approval notice once per user after payments are committed"""
+    for user_id in dict.fromkeys(payment.user_id for payment in payments):
+        messages = get_user_messages(user_id)
+        bot.notify(user_id, messages['payment_approved'])
+
+def notify_payment_rejected(payment, reason):
+    """Queue rejection notice to payment's user"""
+    messages = get_user_messages(payment.user_id)
+    bot.notify(payment.user_id, messages['payment_rejected'].format(reason=reason))
+
 @bot.message_handler(commands=['payments'])
 def handle_payments_command(message):
-    """Handle /payments command - admin only, show pending payments"""
+    """Handle /payments command - admin only, show paged pending payments inbox"""
     user_id = message.from_user.id
     
     if not is_admin(user_id):
         return
     
     try:
-        pending_payments = get_pending_payments()
-        
-        if not pending_payments:
-            bot.reply_to(message, "📭 Kutilayotgan to'lovlar yo'q")
-            return
+        state = {'anchors': [None], 'selected': set(), 'page': []}
+        text, markup = render_payment_inbox(state)
+        sent = bot.send_message(message.chat.id, text, reply_markup=markup)
+        remember_payment_inbox((sent.chat.id, sent.message_id), state)
+            
+    except Exception as e:
+        logger.error(f"Error in payments command: {e}")
+        bot.reply_to(message, "❌ Xatolik yuz berdi")
+
+@bot.message_handler(commands=['export'])
+def handle_export_command(message):
+    """Handle /export command - admin only, send table as gzip CSV"""
+    user_id = message.from_user.id
+    
+    if not is_admin(user_id):
+        return
+    
+    parts = message.text.split()
+    kind = parts[1] if len(parts) > 1 else None
+    if kind not in EXPORT_MODELS:
+        bot.reply_to(message, "📦 Eksport: /export " + " | ".join(EXPORT_MODELS))
+        return
+    
+    output_file = create_temp_file(suffix='.csv.gz')
+    try:
+        row_count = write_csv_export(kind, output_file)
+        
+        with upload_source(output_file) as f:
+            bot.send_document(
+                message.chat.id,
+                f,
+                visible_file_name=f"{kind}_{time.strftime('%Y%m%d_%H%M')}.csv.gz",
+                caption=f"📦 {kind}: {row_count} ta qator"
+            )
+        logger.info(f"Admin {user_id} exported {kind} ({row_count} rows)")
         
-        for payment in pending_payments:
-            payment_text = f"""💳 To'lov so'rovi #{payment.id}
+    except Exception as e:
+        logger.error(f"Error in export command: {e}")
+        bot.reply_to(message, "❌ Xatolik yuz berdi")
+    finally:
+        cleanup_file(output_file)
 
-👤 Foydalanuvchi: {payment.first_name} (@{payment.username or 'username_yoq'})
-💰 Summa: {payment.payment_amount:,} so'm
-📅 Reja: {payment.payment_plan}
-🕒 Vaqt: {payment.created_at.strftime('%d.%m.%Y %H:%M')}
+@bot.message_handler(commands=['broadcast'])
+def handle_broadcast_command(message):
+    """Handle /broadcast command - admin only, send a message to all users"""
+    user_id = message.from_user.id
+    
+    if not is_admin(user_id):
+        return
+    
+    msg = bot.reply_to(message, "📣 Barcha foydalanuvchilarga yuboriladigan xabarni yuboring (bekor qilish: /cancel):")
+    bot.register_next_step_handler(msg, process_broadcast_message)
 
-Chekni ko'rish uchun /receipt_{payment.id} yuboring
-Tasdiqlash: /approve_{payment.id}
-Rad etish: /reject_{payment.id}"""
-            
-            bot.send_message(message.chat.id, payment_text)
-            
+def process_broadcast_message(message):
+    """Preview admin's message and ask to confirm before sending it to everyone"""
+    if message.text and message.text.startswith('/cancel'):
+        bot.reply_to(message, "❌ Bekor qilindi")
+        return
+    
+    try:
+        chat_id = message.chat.id
+        # Exactly what users will get: copy_message drops the forward header
+        bot.copy_message(chat_id, chat_id, message.message_id, priority=PRIORITY_INTERACTIVE)
+        
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(
+            types.InlineKeyboardButton("✅ Yuborish", callback_data=f"bcast:ok:{message.message_id}"),
+            types.InlineKeyboardButton("❌ Bekor qilish", callback_data=f"bcast:no:{message.message_id}")
+        )
+        pending_broadcasts.add((chat_id, message.message_id))
+        bot.send_message(
+            chat_id,
+            f"📣 Yuqoridagi xabar {get_admin_counts()['total_users']} ta foydalanuvchiga yuborilsinmi?",
+            reply_markup=markup
+        )
+        
     except Exception as e:
-        logger.error(f"Error in payments command: {e}")
+        logger.error(f"Error previewing broadcast: {e}")
         bot.reply_to(message, "❌ Xatolik yuz berdi")
 
+@bot.callback_query_handler(func=lambda call: call.data.startswith('bcast:'))
+def handle_broadcast_confirm_callback(call):
+    """Start or cancel a previewed broadcast"""
+    try:
+        if not is_admin(call.from_user.id):
+            bot.answer_callback_query(call.id, text="❌ Ruxsat yo'q")
+            return
+        
+        _, action, source_message_id = call.data.split(':')
+        chat_id = call.message.chat.id
+        key = (chat_id, int(source_message_id))
+        # set.remove is atomic, so of two quick taps only one gets through;
+        # also refuses a preview from before a restart
+        try:
+            pending_broadcasts.remove(key)
+        except KeyError:
+            bot.answer_callback_query(call.id, text="⚠️ Allaqachon ko'rib chiqilgan")
+            return
+        bot.answer_callback_query(call.id)
+        
+        if action == 'no':
+            bot.edit_message_text("❌ Bekor qilindi", chat_id, call.message.message_id)
+            return
+        
+        job = create_broadcast_job(chat_id, chat_id, key[1])
+        if not job:
+            bot.edit_message_text("❌ Xatolik yuz berdi", chat_id, call.message.message_id)
+            return
+        
+        # The confirm message becomes the progress message
+        bot.edit_message_text(
+            f"📣 Xabar yuborish #{job.id} boshlandi: {job.total_count} ta foydalanuvchi",
+            chat_id, call.message.message_id
+        )
+        job.status_message_id = call.message.message_id
+        update_broadcast_job(job.id, status_message_id=job.status_message_id)
+        
+        logger.info(f"Admin {call.from_user.id} started broadcast #{job.id}")
+        broadcaster.start(job)
+        
+    except Exception as e:
+        logger.error(f"Error starting broadcast: {e}")
+        bot.answer_callback_query(call.id, text="❌ Xatolik yuz berdi")
+
 @bot.message_handler(commands=['history'])
 def send_history(message):
     """Handle /history command - show user's recent kruzhok videos"""
@@ -649,11 +1146,8 @@ def handle_photo_and_receipts(message):
                 btn_reject = types.InlineKeyboardButton("❌ Rad etish", callback_data=f"reject_payment_{payment.id}")
                 markup.add(btn_approve, btn_reject)
                 
-                try:
-                    bot.send_message(ADMIN_ID, admin_text)
-                    bot.send_photo(ADMIN_ID, photo.file_id, caption=f"To'lov cheki #{payment.id}", reply_markup=markup)
-                except:
-                    pass
+                bot.notify(ADMIN_ID, admin_text)
+                bot.send_later('send_photo', ADMIN_ID, photo.file_id, caption=f"To'lov cheki #{payment.id}", reply_markup=markup)
                 
                 # Clear payment state
                 del user_payment_plans[user_id]
@@ -664,6 +1158,11 @@ def handle_photo_and_receipts(message):
             return
         
         # Regular photo processing for kruzhok
+        # The size closest to the kruzhok is enough; checked before downloading
+        photo = pick_photo_size(message.photo)
+        if not admit_upload(message, check_photo(photo)):
+            return
+        
         # Check if user can create kruzhok
         if not can_create_kruzhok(user_id):
             messages = get_user_messages(user_id)
@@ -671,30 +1170,12 @@ def handle_photo_and_receipts(message):
             bot.reply_to(message, messages['daily_limit_reached'])
             return
         
-        # Get the largest photo size
-        photo = message.photo[-1]
-        file_info = bot.get_file(photo.file_id)
-        
-        # Create temporary file
-        input_file = create_temp_file(suffix='.jpg')
-        
-        # Download the photo
-        downloaded_file = bot.download_file(file_info.file_path)
-        with open(input_file, 'wb') as f:
-            f.write(downloaded_file)
-        
-        # Store user media file and set state
-        user_media_files[user_id] = {
-            'file_path': input_file,
-            'media_type': 'photo',
-            'duration': 5
-        }
-        user_states[user_id] = 'choosing_effect'
-        
-        # Send effect selection menu with inline keyboard
-        messages = get_user_messages(user_id)
-        markup = create_effect_keyboard()
-        bot.reply_to(message, messages['choose_effect'], reply_markup=markup)
+        # Show effects right away, download in background
+        start_media_session(
+            message, photo.file_id, 'photo', '.jpg',
+            info=MediaInfo.from_telegram('photo', photo),
+            file_unique_id=photo.file_unique_id
+        )
             
     except Exception as e:
         logger.error(f"Error handling photo: {e}")
@@ -707,6 +1188,10 @@ def handle_video(message):
     try:
         user_id = message.from_user.id
         
+        # Size, length, resolution and type come with the message; refuse before downloading
+        if not admit_upload(message, check_video(message.video)):
+            return
+        
         # Check if user can create kruzhok
         if not can_create_kruzhok(user_id):
             messages = get_user_messages(user_id)
@@ -714,29 +1199,12 @@ def handle_video(message):
             bot.reply_to(message, messages['daily_limit_reached'])
             return
         
-        # Get file info
-        file_info = bot.get_file(message.video.file_id)
-        
-        # Create temporary file
-        input_file = create_temp_file(suffix='.mp4')
-        
-        # Download the video
-        downloaded_file = bot.download_file(file_info.file_path)
-        with open(input_file, 'wb') as f:
-            f.write(downloaded_file)
-        
-        # Store user media file and set state
-        user_media_files[user_id] = {
-            'file_path': input_file,
-            'media_type': 'video',
-            'duration': message.video.duration or 10
-        }
-        user_states[user_id] = 'choosing_effect'
-        
-        # Send effect selection menu with inline keyboard
-        messages = get_user_messages(user_id)
-        markup = create_effect_keyboard()
-        bot.reply_to(message, messages['choose_effect'], reply_markup=markup)
+        # Show effects right away, download in background
+        start_media_session(
+            message, message.video.file_id, 'video', '.mp4',
+            info=MediaInfo.from_telegram('video', message.video),
+            file_unique_id=message.video.file_unique_id
+        )
             
     except Exception as e:
         logger.error(f"Error handling video: {e}")
@@ -755,9 +1223,9 @@ def handle_receipt_command(message):
     
     try:
         payment_id = int(message.text.split('_')[1])
-        from models import SessionLocal, PaymentRequest
+        from models import PaymentRequest
         
-        session = SessionLocal()
+        session = get_db_session()
         payment = session.query(PaymentRequest).filter(
             PaymentRequest.id == payment_id
         ).first()
@@ -797,13 +1265,11 @@ def handle_approve_command(message):
         
         if payment:
             # Notify user about approval
-            try:
-                messages = get_user_messages(payment.user_id)
-                bot.send_message(payment.user_id, messages['payment_approved'])
-            except:
-                pass
+            notify_payment_approved([payment])
             
             bot.reply_to(message, f"✅ To'lov #{payment_id} tasdiqlandi!")
+        elif payment is None:
+            bot.reply_to(message, f"⚠️ To'lov #{payment_id} topilmadi yoki allaqachon ko'rib chiqilgan")
         else:
             bot.reply_to(message, "❌ To'lov topilmadi yoki xatolik")
         
@@ -840,12 +1306,7 @@ def process_rejection_reason(message, payment_id):
     
     if payment:
         # Notify user about rejection
-        try:
-            messages = get_user_messages(payment.user_id)
-            rejection_msg = messages['payment_rejected'].format(reason=reason)
-            bot.send_message(payment.user_id, rejection_msg)
-        except:
-            pass
+        notify_payment_rejected(payment, reason)
         
         bot.reply_to(message, f"❌ To'lov #{payment_id} rad etildi!")
     else:
@@ -864,11 +1325,26 @@ def handle_effect_callback(call):
         user_id = call.from_user.id
         effect_type = int(call.data.split('_')[1])
         
+        # Single flight: one render per session, taps on old keyboards do nothing
+        media_info, skip = claim_media_session(user_id, call.message.message_id, effect_type)
+        if skip == 'stale':
+            metrics.incr('effect_tap.stale')
+            bot.answer_callback_query(call.id)
+            return
+        if skip == 'busy':
+            # Duplicate tap: the running render answers for it
+            metrics.incr('effect_tap.coalesced')
+            bot.answer_callback_query(call.id, text=media_info['messages']['effect_in_flight'])
+            return
+        
         # Answer callback to remove loading state
         bot.answer_callback_query(call.id)
         
         # Process media with selected effect
-        process_media_with_effect_callback(call, effect_type)
+        try:
+            process_media_with_effect_callback(call, effect_type, media_info)
+        finally:
+            media_info.pop('in_flight', None)
         
     except Exception as e:
         logger.error(f"Error handling effect callback: {e}")
@@ -938,11 +1414,7 @@ def handle_approve_payment_callback(call):
             )
             
             # Notify user about approval
-            try:
-                messages = get_user_messages(payment.user_id)
-                bot.send_message(payment.user_id, messages['payment_approved'])
-            except:
-                pass
+            notify_payment_approved([payment])
             
             bot.answer_callback_query(call.id, text="✅ To'lov tasdiqlandi!")
         else:
@@ -998,12 +1470,7 @@ def process_rejection_callback(message, payment_id, original_chat_id, original_m
             pass
         
         # Notify user about rejection
-        try:
-            messages = get_user_messages(payment.user_id)
-            rejection_msg = messages['payment_rejected'].format(reason=reason)
-            bot.send_message(payment.user_id, rejection_msg)
-        except:
-            pass
+        notify_payment_rejected(payment, reason)
         
         bot.reply_to(message, f"❌ To'lov #{payment_id} rad etildi!")
         
@@ -1015,6 +1482,95 @@ def process_rejection_callback(message, payment_id, original_chat_id, original_m
     else:
         bot.reply_to(message, "❌ To'lov topilmadi yoki xatolik")
 
+@bot.callback_query_handler(func=lambda call: call.data.startswith('pinbox:'))
+def handle_payment_inbox_callback(call):
+    """Handle admin payment inbox navigation, selection and actions"""
+    try:
+        if not is_admin(call.from_user.id):
+            bot.answer_callback_query(call.id, text="❌ Ruxsat yo'q")
+            return
+        
+        chat_id = call.message.chat.id
+        message_id = call.message.message_id
+        state = remember_payment_inbox(
+            (chat_id, message_id),
+            payment_inboxes.get((chat_id, message_id)) or {'anchors': [None], 'selected': set(), 'page': []}
+        )
+        parts = call.data.split(':')
+        action = parts[1]
+        payment_id = int(parts[2]) if len(parts) > 2 else None
+        answer_text = None
+        
+        if action == 'next' and state['page']:
+            last = state['page'][-1]
+            state['anchors'].append((last.created_at, last.id))
+        elif action == 'prev' and len(state['anchors']) > 1:
+            state['anchors'].pop()
+        elif action == 'sel':
+            state['selected'].symmetric_difference_update({payment_id})
+        elif action == 'ok':
+            payment = approve_payment(payment_id, "Admin tomonidan tasdiqlandi")
+            state['selected'].discard(payment_id)
+            if payment:
+                notify_payment_approved([payment])
+                answer_text = f"✅ #{payment_id} tasdiqlandi"
+            elif payment is None:
+                answer_text = f"⚠️ #{payment_id} allaqachon ko'rib chiqilgan"
+            else:
+                answer_text = "❌ To'lov topilmadi yoki xatolik"
+        elif action == 'no':
+            state['selected'].discard(payment_id)
+            bot.answer_callback_query(call.id)
+            msg = bot.send_message(chat_id, f"❌ #{payment_id} rad etish sababini yozing:")
+            bot.register_next_step_handler(msg, process_inbox_rejection, payment_id, chat_id, message_id)
+            return
+        elif action == 'bulk':
+            approved = approve_payments(sorted(state['selected']), "Admin tomonidan tasdiqlandi")
+            state['selected'].clear()
+            notify_payment_approved(approved)
+            answer_text = f"✅ {len(approved)} ta to'lov tasdiqlandi"
+        
+        # Going back to an emptied page: step back until something shows up
+        text, markup = render_payment_inbox(state)
+        while not state['page'] and len(state['anchors']) > 1:
+            state['anchors'].pop()
+            text, markup = render_payment_inbox(state)
+        
+        bot.answer_callback_query(call.id, text=answer_text)
+        try:
+            bot.edit_message_text(text, chat_id, message_id, reply_markup=markup)
+        except telebot.apihelper.ApiTelegramException as e:
+            # "message is not modified" when nothing changed on the page
+            logger.debug(f"Inbox edit skipped: {e}")
+        
+    except Exception as e:
+        logger.error(f"Error handling payment inbox callback: {e}")
+        bot.answer_callback_query(call.id, text="❌ Xatolik yuz berdi")
+
+def process_inbox_rejection(message, payment_id, inbox_chat_id, inbox_message_id):
+    """Process rejection reason entered from payment inbox"""
+    reason = message.text
+    payment = reject_payment(payment_id, reason)
+    
+    if payment is None:
+        bot.reply_to(message, f"⚠️ To'lov #{payment_id} allaqachon ko'rib chiqilgan")
+        return
+    if not payment:
+        bot.reply_to(message, "❌ To'lov topilmadi yoki xatolik")
+        return
+    
+    notify_payment_rejected(payment, reason)
+    
+    bot.reply_to(message, f"❌ To'lov #{payment_id} rad etildi!")
+    
+    state = payment_inboxes.get((inbox_chat_id, inbox_message_id))
+    if state:
+        try:
+            text, markup = render_payment_inbox(state)
+            bot.edit_message_text(text, inbox_chat_id, inbox_message_id, reply_markup=markup)
+        except Exception as e:
+            logger.debug(f"Inbox refresh skipped: {e}")
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith('lang_'))
 def handle_language_callback(call):
     """Handle language selection callbacks"""
@@ -1062,68 +1618,146 @@ def handle_text_messages(message):
     welcome_text = messages['welcome'].format(user_name)
     bot.reply_to(message, welcome_text)
 
-def process_media_with_effect_callback(call, effect_type):
-    """Process stored media with selected effect from callback"""
+def process_media_with_effect_callback(call, effect_type, media_info):
+    """Process session's media with selected effect from callback"""
     user_id = call.from_user.id
+    job = None  # Stage timings, saved once a render was attempted
+    job_status = 'failed'
+    job_fields = {}
     
     try:
         messages = get_user_messages(user_id)
         
-        if user_id not in user_media_files:
-            bot.edit_message_text(messages['error'], call.message.chat.id, call.message.message_id)
+        # Session is kept after a render, so each effect has to be within limits
+        if not can_create_kruzhok(user_id):
+            bot.edit_message_text(messages['daily_limit_reached'], call.message.chat.id, call.message.message_id)
             return
         
         # Edit message to show processing
         bot.edit_message_text(messages['effect_processing'], call.message.chat.id, call.message.message_id)
         
-        media_info = user_media_files[user_id]
-        input_file = media_info['file_path']
-        output_file = create_temp_file(suffix='.mp4')
-        
-        # Process based on media type
-        success = False
-        if media_info['media_type'] == 'video':
-            success = process_video_to_kruzhok(input_file, output_file, effect_type)
-        elif media_info['media_type'] == 'photo':
-            success = process_photo_to_kruzhok(input_file, output_file, effect_type)
+        media_info['touched'] = time.monotonic()
+        job = JobTelemetry(user_id, media_info['media_type'], effect_type)
+        
+        # Use speculative render if it guessed this effect, else render now
+        success, output_file = take_speculative_render(media_info, effect_type)
+        job_fields['speculative'] = success
+        if not success and output_file:
+            cleanup_file(output_file)
+            output_file = None
+        
+        # Render workers only do CPU work: download and probe are awaited here
+        if not success and fetch_source(media_info, job):
+            # Admission: refuse while the predicted wait is too long, instead
+            # of letting every queued user's latency grow
+            lane = LANE_PREMIUM if get_user_limits(user_id)['is_premium'] else LANE_FREE
+            mezzanine_ready = 'mezzanine' in media_info
+            cost, wait = estimate_render(media_info, effect_type, lane)
+            metrics.observe('render.predicted_wait', wait)
+            if wait > RENDER_MAX_BACKLOG:
+                metrics.incr(f'render.refused.{lane}')
+                job_status = 'refused'
+                bot.edit_message_text(
+                    messages['render_busy'].format(eta=format_eta(wait)),
+                    call.message.chat.id,
+                    call.message.message_id,
+                    reply_markup=create_effect_keyboard()
+                )
+                return
+            # Queue ETA, then percent/ETA edits of the processing message while
+            # ffmpeg runs. They are queued sends; close() drops one not sent
+            # yet so it can't overwrite the final status edited below
+            progress = ProgressReporter(
+                lambda text: bot.send_later(
+                    'edit_message_text', text, call.message.chat.id, call.message.message_id
+                ),
+                total=lambda: session_output_duration(media_info),
+                template=messages['effect_progress']
+            )
+            try:
+                progress.show(messages['effect_eta'].format(eta=format_eta(wait + cost)))
+                
+                output_file = create_temp_file(suffix='.mp4')
+                # Split long videos across cores only while nothing else is rendering
+                segments = SPLIT_SEGMENTS if render_pool.pending() == 0 else 1
+                encoder = encoder_governor.choose(job=f"user {user_id} effect {effect_type}")
+                job_fields['preset'] = encoder['preset']
+                submitted = time.monotonic()
+                job.start('queue')
+                # A new upload releases this session and kills the render.
+                # Premium users get the weighted lane; one render per user at a time
+                success = render_pool.submit(
+                    render_session, media_info, output_file, effect_type, media_info['cancel_event'],
+                    segments=segments, encoder=encoder, job=job, progress=progress,
+                    lane=lane, user_id=user_id, cost=cost
+                ).result()
+            finally:
+                progress.close()
+            encoder_governor.record(time.monotonic() - submitted)
+            if success:
+                # Calibrate with what is known now (probed length and size)
+                duration, pixels, _ = render_cost_features(media_info)
+                render_cost.record(
+                    media_info['media_type'], effect_type, duration, pixels, mezzanine_ready,
+                    job.stages.get('mezzanine', 0.0) + job.stages.get('encode', 0.0)
+                )
         
         if success:
             # Use kruzhok count
-            use_kruzhok(
-                user_id=user_id,
-                username=call.from_user.username,
-                first_name=call.from_user.first_name
-            )
+            with job.stage('db'):
+                use_kruzhok(
+                    user_id=user_id,
+                    username=call.from_user.username,
+                    first_name=call.from_user.first_name
+                )
+            
+            # Real kruzhok length; probe the output only if the source length is unknown
+            output_duration = media_info['info'].output_duration(media_info['media_type'])
+            if output_duration is None:
+                output_info = probe_media(output_file)
+                output_duration = output_info.duration if output_info else None
+            output_duration = int(round(output_duration)) if output_duration else None
+            
+            # Output size vs its byte budget; upload time is what the budget saves
+            file_size = os.path.getsize(output_file) if os.path.exists(output_file) else None
+            if file_size:
+                metrics.observe('render.output_budget_used', file_size / output_budget(output_duration or MAX_VIDEO_DURATION))
+            
+            job_fields['output_size'] = file_size
             
             # Send the kruzhok
-            with open(output_file, 'rb') as video:
+            upload_started = time.monotonic()
+            with job.stage('upload'), upload_source(output_file) as video:
                 sent_message = bot.send_video_note(
                     call.message.chat.id,
                     video,
-                    duration=media_info['duration'],
+                    duration=output_duration,
                     length=480  # Circular video diameter
                 )
+            metrics.observe('media.upload', time.monotonic() - upload_started)
             
             # Save to history
             effect_name = EFFECT_NAMES.get(effect_type, f"Effekt {effect_type}")
-            file_size = os.path.getsize(output_file) if os.path.exists(output_file) else None
             
-            save_user_history(
-                user_id=user_id,
-                username=call.from_user.username,
-                first_name=call.from_user.first_name,
-                file_id=sent_message.video_note.file_id,
-                original_media_type=media_info['media_type'],
-                effect_type=effect_type,
-                effect_name=effect_name,
-                file_size=file_size
-            )
+            with job.stage('db'):
+                save_user_history(
+                    user_id=user_id,
+                    username=call.from_user.username,
+                    first_name=call.from_user.first_name,
+                    file_id=sent_message.video_note.file_id,
+                    original_media_type=media_info['media_type'],
+                    effect_type=effect_type,
+                    effect_name=effect_name,
+                    file_size=file_size
+                )
+            job_status = 'done'
             
             # Delete processing message and show success message
             bot.delete_message(call.message.chat.id, call.message.message_id)
             
             # Show remaining limits
-            limits = get_user_limits(user_id)
+            with job.stage('db'):
+                limits = get_user_limits(user_id)
             remaining = (limits['daily_limit'] + limits['bonus_kruzhoks']) - limits['daily_used']
             
             if limits['is_premium']:
@@ -1131,55 +1765,87 @@ def process_media_with_effect_callback(call, effect_type):
             else:
                 status_msg = f"🆓 Qolgan: {remaining}/{limits['daily_limit'] + limits['bonus_kruzhoks']}"
             
-            bot.send_message(call.message.chat.id, f"✅ Tayyor!\n{status_msg}")
+            # Offer other effects for the same upload (rendered from its mezzanine)
+            media_info['touched'] = time.monotonic()
+            sent = bot.send_message(
+                call.message.chat.id,
+                f"✅ Tayyor!\n{status_msg}",
+                reply_markup=create_effect_keyboard()
+            )
+            media_info['keyboard'] = sent.message_id
+        elif media_info['cancel_event'].is_set():
+            job_status = 'cancelled'
+            bot.edit_message_text(
+                messages['effect_cancelled'],
+                call.message.chat.id,
+                call.message.message_id
+            )
         else:
             bot.edit_message_text(
                 messages['error'],
                 call.message.chat.id,
                 call.message.message_id
             )
+            
+            # Source is likely broken - drop the session
+            release_media(media_info)
+            if user_media_files.get(user_id) is media_info:
+                del user_media_files[user_id]
+                user_states.pop(user_id, None)
         
         # Clean up
-        cleanup_file(input_file)
-        cleanup_file(output_file)
-        
-        # Clear user state
-        if user_id in user_states:
-            del user_states[user_id]
-        if user_id in user_media_files:
-            del user_media_files[user_id]
+        if output_file:
+            cleanup_file(output_file)
             
     except Exception as e:
         logger.error(f"Error processing media with effect: {e}")
+        job_status = 'error'
         messages = get_user_messages(user_id)
         bot.edit_message_text(messages['error'], call.message.chat.id, call.message.message_id)
         
-        # Clear user state on error
-        if user_id in user_states:
-            del user_states[user_id]
-        if user_id in user_media_files:
-            cleanup_file(user_media_files[user_id]['file_path'])
+        # Clear user state on error, unless a newer upload replaced this session
+        release_media(media_info)
+        if user_media_files.get(user_id) is media_info:
             del user_media_files[user_id]
+            user_states.pop(user_id, None)
+    finally:
+        if job is not None:
+            job.save(job_status, **job_fields)
 
 def main():
     """Main function to start the bot"""
     logger.info("Starting Kruzhok Bot...")
     
-    # Initialize database
+    # Initialize database (create_all only runs when schema version changed)
     try:
-        create_tables()
-        logger.info("Database tables initialized successfully")
+        if ensure_schema():
+            logger.info("Database schema created/updated")
+        else:
+            logger.info("Database schema is up to date")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
         return
     
-    # Check if ffmpeg is available
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        logger.info("FFmpeg is available")
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    # Check if ffmpeg is available (cached per ffmpeg binary)
+    if not get_ffmpeg_capabilities().get('available'):
         logger.error("FFmpeg is not available. Please install ffmpeg.")
         return
+    logger.info("FFmpeg is available")
+    
+    # Fetch bot identity once (used for referral links)
+    try:
+        logger.info(f"Running as @{get_bot_identity().username}")
+    except Exception as e:
+        logger.error(f"Error getting bot identity: {e}")
+        return
+    
+    # Release uploads nobody has used for a while
+    threading.Thread(target=expire_media_sessions, name='media-sessions', daemon=True).start()
+    
+    # Resume broadcasts interrupted by a restart
+    resumed = broadcaster.resume_all()
+    if resumed:
+        logger.info(f"Resumed {resumed} broadcast job(s)")
     
     # Start polling
     try:
@@ -1187,6 +1853,10 @@ def main():
         bot.infinity_polling(timeout=30, long_polling_timeout=30)
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
+    finally:
+        broadcaster.stop()
+        kill_all()  # ffmpeg processes still running
+        send_queue.shutdown()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,794 @@
+"""FFmpeg media processing for kruzhok rendering"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import frame_render
+from ffmpeg_caps import has_filter
+from process_runner import (
+    PROCESS_TIMEOUT, ProcessCancelled, ProcessTimeout, SupervisedProcess, run_supervised
+)
+
+logger = logging.getLogger(__name__)
+
+# Kruzhok output size and frame rate cap of the normalized intermediate
+KRUZHOK_SIZE = 480
+MEZZANINE_FPS = 30
+MAX_VIDEO_DURATION = 60.0
+PHOTO_DURATION = 5
+PHOTO_FPS = 25
+
+# Photo effects: 'frames' computes them with NumPy/Pillow and pipes raw frames
+# to one encoder, 'ffmpeg' uses filters. 'auto' uses frames (when installed)
+# for static effects, where it measured faster (benchmarks/bench_photo.py)
+PHOTO_RENDERER = os.environ.get('PHOTO_RENDERER', 'auto')
+AUTO_FRAME_EFFECTS = (1, 3)
+
+# Split encoding: sources at least this long are cut into segments that are
+# encoded by parallel ffmpeg processes and joined without re-encoding
+SPLIT_MIN_DURATION = float(os.environ.get('SPLIT_MIN_DURATION', '20'))
+SPLIT_SEGMENTS = int(os.environ.get('SPLIT_SEGMENTS', str(min(4, os.cpu_count() or 1))))
+
+# Source -> 480x480 square; done once per upload when building the mezzanine
+NORMALIZE_FILTER = (
+    f'scale={KRUZHOK_SIZE}:{KRUZHOK_SIZE}:force_original_aspect_ratio=increase,'
+    f'crop={KRUZHOK_SIZE}:{KRUZHOK_SIZE}'
+)
+
+# Decoders that can downscale while decoding (-lowres), with their max factor
+LOWRES_DECODERS = {'mjpeg': 3, 'mpeg4': 3, 'mpeg2video': 3, 'mpeg1video': 3, 'h263': 3}
+
+# Sources with a shorter side this many times the kruzhok size skip deblocking
+# when decoding; its artifacts disappear in the downscale
+SKIP_LOOP_FILTER_CODECS = ('h264',)
+SKIP_LOOP_FILTER_RATIO = 3
+
+HDR_TRANSFERS = ('smpte2084', 'arib-std-b67')  # PQ and HLG
+TONEMAP_FILTER = (
+    'zscale=t=linear:npl=100,format=gbrpf32le,zscale=p=bt709,'
+    'tonemap=hable:desat=0,zscale=t=bt709:m=bt709:r=tv'
+)
+
+# Effect filters applied to the already normalized 480x480 mezzanine
+VIDEO_EFFECT_FILTERS = {
+    1: None,  # Oddiy dumaloq video
+    # Time-dependent effects take the segment's start ({t0} seconds, {n0}
+    # frames) so split encodes continue where the previous segment stopped
+    2: "zoompan=z='min(1+0.0015*({n0}+in),1.5)':d=1:x=iw/2-(iw/zoom/2):y=ih/2-(ih/zoom/2)"
+       f":s={KRUZHOK_SIZE}x{KRUZHOK_SIZE}:fps={MEZZANINE_FPS}",  # Zoom effekti
+    3: 'gblur=sigma=2:steps=1',  # Blur effekti
+    4: 'hue=h=sin(2*PI*(t+{t0}))*360:s=1.5',  # Rang o'zgarishi effekti
+    5: 'rotate=PI*(t+{t0})/5',  # Aylanish effekti
+}
+
+PHOTO_EFFECT_FILTERS = {
+    1: None,
+    # Looped image: zoom comes from the frame number, `zoom` restarts each frame
+    2: f"zoompan=z='min(1+0.002*in,1.8)':d=1:x=iw/2-(iw/zoom/2):y=ih/2-(ih/zoom/2)"
+       f":s={KRUZHOK_SIZE}x{KRUZHOK_SIZE}:fps={PHOTO_FPS}",
+    3: 'gblur=sigma=3:steps=2',
+    4: 'hue=h=sin(2*PI*t/3)*180:s=1.3',
+    5: 'rotate=PI*t/3',
+}
+
+class RenderCancelled(Exception):
+    """Raised when a render is cancelled before ffmpeg finished"""
+
+def create_temp_file(suffix=""):
+    """Create a temporary file and return its path"""
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    temp_file.close()
+    return temp_file.name
+
+def cleanup_file(file_path):
+    """Safely delete a file"""
+    try:
+        if os.path.exists(file_path):
+            os.unlink(file_path)
+            logger.info(f"Cleaned up file: {file_path}")
+    except Exception as e:
+        logger.error(f"Error cleaning up file {file_path}: {e}")
+
+def _parse_rate(rate):
+    try:
+        num, _, den = rate.partition('/')
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError, AttributeError):
+        return None
+    return value or None
+
+class MediaInfo:
+    """What is known about a source; fields are None when unknown
+
+    Comes from ffprobe (probed=True) or from Telegram message metadata.
+    """
+
+    __slots__ = ('codec', 'width', 'height', 'fps', 'rotation', 'has_audio',
+                 'duration', 'color_transfer', 'probed')
+
+    def __init__(self, codec=None, width=None, height=None, fps=None, rotation=0,
+                 has_audio=None, duration=None, color_transfer=None, probed=False):
+        self.codec = codec
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.rotation = rotation
+        self.has_audio = has_audio
+        self.duration = duration
+        self.color_transfer = color_transfer
+        self.probed = probed
+
+    @classmethod
+    def from_ffprobe(cls, data):
+        """Build from `ffprobe -print_format json -show_format -show_streams`"""
+        streams = data.get('streams', [])
+        video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+        rotation = video.get('tags', {}).get('rotate')
+        for side_data in video.get('side_data_list', []):
+            if 'rotation' in side_data:
+                rotation = side_data['rotation']
+        duration = data.get('format', {}).get('duration') or video.get('duration')
+        return cls(
+            codec=video.get('codec_name'),
+            width=video.get('width'),
+            height=video.get('height'),
+            fps=_parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate')),
+            rotation=int(float(rotation or 0)) % 360,
+            has_audio=any(s.get('codec_type') == 'audio' for s in streams),
+            duration=float(duration) if duration else None,
+            color_transfer=video.get('color_transfer'),
+            probed=True
+        )
+
+    @classmethod
+    def from_telegram(cls, media_type, media):
+        """Build from Telegram's PhotoSize/Video, or None if a probe is needed
+
+        Photos are always JPEG. Videos the client compressed (mp4 up to
+        TELEGRAM_COMPRESSED_MAX px) are SDR H.264 the decode plan needs
+        nothing more about; anything else may be 4K, HDR or high fps.
+        """
+        if media_type == 'photo':
+            return cls(codec='mjpeg', width=media.width, height=media.height, has_audio=False)
+        if (getattr(media, 'mime_type', None) == 'video/mp4' and media.duration
+                and media.width and media.height
+                and max(media.width, media.height) <= TELEGRAM_COMPRESSED_MAX):
+            return cls(width=media.width, height=media.height, duration=float(media.duration))
+        return None
+
+    @property
+    def short_side(self):
+        return min(self.width or 0, self.height or 0)
+
+    @property
+    def display_size(self):
+        """(width, height) as shown, i.e. after applying rotation"""
+        if self.rotation in (90, 270):
+            return self.height, self.width
+        return self.width, self.height
+
+    def output_duration(self, media_type):
+        """Length of the kruzhok rendered from this source, in seconds"""
+        if media_type != 'video':
+            return PHOTO_DURATION
+        if self.duration is None:
+            return None
+        return min(self.duration, MAX_VIDEO_DURATION)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'MediaInfo({fields})'
+
+# Longest side of videos compressed by Telegram clients
+TELEGRAM_COMPRESSED_MAX = 1280
+
+# Probe results per source file, keyed by (path, size, mtime)
+PROBE_CACHE_SIZE = 256
+PROBE_TIMEOUT = 30  # ffprobe only reads headers; a hang means a hostile file
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+def probe_media(input_path):
+    """ffprobe source into MediaInfo (cached per file); None if it fails"""
+    try:
+        stat = os.stat(input_path)
+    except OSError as e:
+        logger.error(f"Error probing {input_path}: {e}")
+        return None
+    key = (input_path, stat.st_size, stat.st_mtime_ns)
+    with _probe_cache_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return _probe_cache[key]
+
+    try:
+        cmd = [
+            'ffprobe', '-v', 'quiet', '-print_format', 'json',
+            '-show_format', '-show_streams', input_path
+        ]
+        result = run_supervised(cmd, timeout=PROBE_TIMEOUT, capture_stdout=True)
+        info = MediaInfo.from_ffprobe(json.loads(result.stdout))
+    except Exception as e:
+        logger.error(f"Error probing {input_path}: {e}")
+        return None
+
+    with _probe_cache_lock:
+        _probe_cache[key] = info
+        if len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return info
+
+def lowres_factor(info):
+    """Largest -lowres keeping the shorter side at least KRUZHOK_SIZE"""
+    max_lowres = LOWRES_DECODERS.get(info.codec, 0)
+    factor = 0
+    while factor < max_lowres and info.short_side >> (factor + 1) >= KRUZHOK_SIZE:
+        factor += 1
+    return factor
+
+def plan_decode(info, fps=None):
+    """Input options and leading/trailing filters for decoding a source
+
+    Every step is only used when info shows the input needs it:
+    decoder downscale (-lowres) or skipped deblocking for large sources,
+    fps decimation before scaling for high frame rates, input-side trim
+    for long videos and tone mapping for HDR. fps is the rate to
+    normalize to (None for a still image).
+    """
+    info = info or MediaInfo()
+    input_args = []
+    pre_filters = []
+    post_filters = []
+
+    factor = lowres_factor(info)
+    if factor:
+        input_args += ['-lowres', str(factor)]
+    elif info.codec in SKIP_LOOP_FILTER_CODECS and info.short_side >= KRUZHOK_SIZE * SKIP_LOOP_FILTER_RATIO:
+        input_args += ['-skip_loop_filter', 'all']
+
+    if fps is not None:
+        if info.duration is None or info.duration > MAX_VIDEO_DURATION:
+            input_args += ['-t', str(MAX_VIDEO_DURATION)]
+
+        if info.fps is not None and info.fps > fps:
+            pre_filters.append(f'fps={fps}')   # Drop frames before scaling them
+        else:
+            post_filters.append(f'fps={fps}')  # Constant rate; duplicates are cheap at 480
+
+    if info.color_transfer in HDR_TRANSFERS:
+        if has_filter('zscale') and has_filter('tonemap'):
+            post_filters.append(TONEMAP_FILTER)  # At 480x480, after the downscale
+        else:
+            logger.warning("HDR source but ffmpeg lacks zscale/tonemap; colors will look washed out")
+
+    return input_args, pre_filters + [NORMALIZE_FILTER] + post_filters
+
+def _read_progress(fd, progress):
+    """Call progress(seconds of output written) for each ffmpeg -progress block"""
+    out_time = 0.0
+    with os.fdopen(fd, 'r') as f:
+        for line in f:
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us' and value.isdigit():  # N/A before the first frame
+                out_time = int(value) / 1_000_000
+            elif key == 'progress':
+                try:
+                    progress(out_time)
+                except Exception as e:
+                    # Keep draining the pipe, or ffmpeg would block on it
+                    logger.warning(f"Progress callback failed: {e}")
+
+def run_ffmpeg(cmd, cancel_event=None, nice=0, progress=None, timeout=PROCESS_TIMEOUT):
+    """Run ffmpeg under the process supervisor, killing it if cancel_event gets set
+
+    progress(seconds) is called from a reader thread with the output time
+    ffmpeg reports on a -progress pipe (about twice a second). Niced runs
+    also get idle I/O priority. Returns ffmpeg's log (tail of stderr).
+    Raises subprocess.CalledProcessError on failure, ProcessTimeout past
+    the wall-clock/CPU limits, RenderCancelled on cancel.
+    """
+    pass_fds = ()
+    if progress is not None:
+        read_fd, write_fd = os.pipe()
+        pass_fds = (write_fd,)
+        cmd = [cmd[0], '-progress', f'pipe:{write_fd}', '-nostats', *cmd[1:]]
+    try:
+        process = SupervisedProcess(
+            cmd, cancel_event=cancel_event, nice=nice, ionice_idle=bool(nice),
+            timeout=timeout, pass_fds=pass_fds
+        )
+    except BaseException:
+        if progress is not None:
+            os.close(read_fd)
+        raise
+    finally:
+        for fd in pass_fds:
+            os.close(fd)  # The child has its copy; EOF comes when it exits
+
+    reader = None
+    if progress is not None:
+        reader = threading.Thread(target=_read_progress, args=(read_fd, progress),
+                                  name='ffmpeg-progress', daemon=True)
+        reader.start()
+    try:
+        return process.wait().stderr
+    except ProcessCancelled:
+        raise RenderCancelled()
+    finally:
+        if reader is not None:
+            reader.join(timeout=1)
+
+def effect_filter_nodes(effect_filters, effect_type, t0=0, n0=0):
+    """Filter chain for effect on a normalized input as [(name, args)]"""
+    effect = effect_filters.get(effect_type, effect_filters[1])
+    nodes = []
+    if effect:
+        name, _, args = effect.format(t0=t0, n0=n0).partition('=')
+        nodes.append((name, args))
+    nodes.append(('format', 'yuv420p'))
+    return nodes
+
+def effect_filter(effect_filters, effect_type, t0=0, n0=0):
+    """Full filter chain for effect on a normalized input starting at t0/n0"""
+    return ','.join(f'{name}={args}' for name, args in effect_filter_nodes(effect_filters, effect_type, t0, n0))
+
+def make_video_mezzanine(input_path, output_path, cancel_event=None, info=None):
+    """Normalize video once: 480x480, constant fps, all-intra, trimmed to 60s
+
+    Every effect render of this upload then starts from this small file
+    instead of decoding and scaling the full-resolution source again.
+    """
+    if info is None:
+        info = probe_media(input_path)
+    input_args, filters = plan_decode(info, fps=MEZZANINE_FPS)
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-nostats',
+        *input_args,
+        '-i', input_path,
+        '-t', str(MAX_VIDEO_DURATION),
+        '-vf', ','.join(filters),
+        '-c:v', 'libx264',
+        '-preset', 'ultrafast',
+        '-tune', 'fastdecode',
+        '-g', '1',          # All-intra: cheap to decode and to cut anywhere
+        '-crf', '12',       # Near-lossless
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'pcm_s16le',  # Lossless, no decode cost
+        '-ar', '44100',
+        '-ac', '2',
+        output_path
+    ]
+    logger.info(f"Building video mezzanine: {' '.join(cmd)}")
+    run_ffmpeg(cmd, cancel_event=cancel_event)
+
+def make_photo_mezzanine(input_path, output_path, cancel_event=None, info=None):
+    """Normalize photo once into an uncompressed 480x480 image"""
+    if info is None:
+        info = probe_media(input_path)
+    input_args, filters = plan_decode(info)
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-nostats',
+        *input_args,
+        '-i', input_path,
+        '-vf', ','.join(filters),
+        '-frames:v', '1',
+        output_path
+    ]
+    logger.info(f"Building photo mezzanine: {' '.join(cmd)}")
+    run_ffmpeg(cmd, cancel_event=cancel_event)
+
+def make_mezzanine(media_type, input_path, cancel_event=None, info=None):
+    """Build mezzanine for source (probed unless info is given), return its path"""
+    if media_type == 'video':
+        output_path = create_temp_file(suffix='.mkv')
+        builder = make_video_mezzanine
+    else:
+        output_path = create_temp_file(suffix='.bmp')
+        builder = make_photo_mezzanine
+    try:
+        builder(input_path, output_path, cancel_event=cancel_event, info=info)
+    except Exception:
+        cleanup_file(output_path)
+        raise
+    return output_path
+
+# x264 settings of a render; encoder_governor picks them per job under load.
+# size_targeted adds a bitrate cap (maxrate/bufsize, kbps) and audio settings
+DEFAULT_ENCODER = {'preset': 'fast', 'crf': 23, 'threads': 0}
+
+# Output size: every kruzhok is uploaded, and on our uplink that takes longer
+# than the encode. Outputs get OUTPUT_KBPS (video + audio) over their
+# duration, at most OUTPUT_MAX_BYTES; CRF still decides below the cap
+OUTPUT_KBPS = int(os.environ.get('OUTPUT_KBPS', '1000'))
+OUTPUT_MAX_BYTES = int(os.environ.get('OUTPUT_MAX_BYTES', str(8 * 1024 * 1024)))
+MUX_OVERHEAD = 0.03
+MIN_VIDEO_KBPS = 300
+VBV_BUFFER_SECONDS = 1
+
+# Audio by content: silent tracks are dropped, tracks whose side (L-R) signal
+# is far below the mid (L+R) are encoded mono
+DEFAULT_AUDIO = (128, 2)  # (kbps, channels) when the track was not analyzed
+SILENCE_DB = -60.0
+MONO_SIDE_DB = 30.0
+AUDIO_KBPS = {1: 64, 2: 96}
+
+def x264_args(encoder=None, threads=None):
+    """ffmpeg arguments for encoder settings; threads overrides encoder's"""
+    encoder = encoder or DEFAULT_ENCODER
+    args = ['-preset', encoder['preset'], '-crf', str(encoder['crf'])]
+    if encoder.get('maxrate'):
+        args += ['-maxrate', f"{encoder['maxrate']}k", '-bufsize', f"{encoder['bufsize']}k"]
+    threads = threads or encoder.get('threads')
+    if threads:
+        args += ['-threads', str(threads)]
+    return args
+
+def audio_args(encoder=None):
+    """ffmpeg audio arguments for encoder settings; -an when audio is dropped"""
+    encoder = encoder or DEFAULT_ENCODER
+    kbps = encoder.get('audio_kbps', DEFAULT_AUDIO[0])
+    if not kbps:
+        return ['-an']
+    return ['-c:a', 'aac', '-b:a', f'{kbps}k', '-ar', '44100',
+            '-ac', str(encoder.get('audio_channels', DEFAULT_AUDIO[1]))]
+
+def output_budget(duration):
+    """Byte budget for a kruzhok of duration seconds"""
+    return min(OUTPUT_MAX_BYTES, int(duration * OUTPUT_KBPS * 1000 / 8))
+
+def audio_levels(input_path, cancel_event=None):
+    """Peak dB of the mid (L+R) and side (L-R) signal of input's stereo audio"""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostats', '-i', input_path,
+        '-map', '0:a:0',
+        '-af', 'pan=stereo|c0=0.5*c0+0.5*c1|c1=0.5*c0-0.5*c1,astats',
+        '-f', 'null', '-'
+    ]
+    log = run_ffmpeg(cmd, cancel_event=cancel_event)
+    peaks = []
+    for line in log.splitlines():
+        if '] Overall' in line:
+            break
+        if 'Peak level dB:' in line:
+            peaks.append(float(line.rsplit(':', 1)[1]))
+    if len(peaks) != 2:
+        raise ValueError(f"Unexpected astats output for {input_path}")
+    return peaks[0], peaks[1]
+
+def choose_audio(levels):
+    """(kbps, channels) for a track's (mid, side) peak dB; kbps 0 drops it"""
+    if levels is None:
+        return DEFAULT_AUDIO
+    mid, side = levels
+    if max(mid, side) <= SILENCE_DB:
+        return 0, 0
+    channels = 1 if mid - side >= MONO_SIDE_DB else 2
+    return AUDIO_KBPS[channels], channels
+
+def size_targeted(encoder, duration, audio=DEFAULT_AUDIO):
+    """encoder with a VBV cap keeping the output within output_budget
+
+    audio is (kbps, channels) from choose_audio, (0, 0) without audio.
+    """
+    encoder = dict(encoder or DEFAULT_ENCODER)
+    audio_kbps, channels = audio
+    video_kbits = output_budget(duration) * 8 / 1000 * (1 - MUX_OVERHEAD) - audio_kbps * duration
+    # The encoder may spend up to maxrate * duration + bufsize
+    video_kbps = max(MIN_VIDEO_KBPS, int(video_kbits / (duration + VBV_BUFFER_SECONDS)))
+    encoder.update(
+        maxrate=video_kbps,
+        bufsize=video_kbps * VBV_BUFFER_SECONDS,
+        audio_kbps=audio_kbps,
+        audio_channels=channels
+    )
+    return encoder
+
+class _CancelScope:
+    """Cancel event that is also set when its parent event is"""
+
+    def __init__(self, parent=None):
+        self._parent = parent
+        self._event = threading.Event()
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        return self._event.is_set() or (self._parent is not None and self._parent.is_set())
+
+def split_points(frame_count, segments):
+    """Split frame_count frames into (start_frame, frames) parts"""
+    size = -(-frame_count // segments)
+    return [(start, min(size, frame_count - start)) for start in range(0, frame_count, size)]
+
+def encode_video_segment(input_path, output_path, effect_type, start_frame, frames,
+                         threads, cancel_event=None, nice=0, encoder=None, progress=None):
+    """Encode frames [start_frame, start_frame + frames) of mezzanine, video only"""
+    t0 = start_frame / MEZZANINE_FPS
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-nostats',
+        '-ss', f'{t0:.6f}',  # Every mezzanine frame is a keyframe: exact cut
+        '-i', input_path,
+        '-frames:v', str(frames),
+        '-an',
+        '-vf', effect_filter(VIDEO_EFFECT_FILTERS, effect_type, t0=f'{t0:.6f}', n0=start_frame),
+        '-c:v', 'libx264',
+        *x264_args(encoder, threads=threads),
+        output_path
+    ]
+    logger.info(f"Running ffmpeg segment command: {' '.join(cmd)}")
+    run_ffmpeg(cmd, cancel_event=cancel_event, nice=nice, progress=progress)
+
+def encode_video_split(input_path, output_path, effect_type, segments, cancel_event=None, nice=0,
+                       duration=None, encoder=None, progress=None):
+    """Encode mezzanine in parallel segments, then concat them losslessly
+
+    duration of the mezzanine is probed unless given. progress gets the
+    seconds encoded over all segments. Returns False when it is too short
+    to split (caller encodes it in one piece); raises on ffmpeg errors or
+    RenderCancelled.
+    """
+    if duration is None:
+        info = probe_media(input_path)
+        duration = info.duration if info else None
+    if duration is None or duration < SPLIT_MIN_DURATION:
+        return False
+
+    frame_count = int(round(min(duration, MAX_VIDEO_DURATION) * MEZZANINE_FPS))
+    parts = split_points(frame_count, segments)
+    threads = max(1, (os.cpu_count() or 1) // len(parts))
+    if encoder and encoder.get('threads'):
+        threads = min(threads, encoder['threads'])
+    scope = _CancelScope(cancel_event)
+    done = [0.0] * len(parts)
+
+    def segment_progress(index):
+        if progress is None:
+            return None
+
+        def report(seconds):
+            done[index] = seconds
+            progress(sum(done))
+        return report
+
+    work_dir = tempfile.mkdtemp(prefix='kruzhok-split-')
+    try:
+        segment_paths = [os.path.join(work_dir, f'{i:03d}.mp4') for i in range(len(parts))]
+        with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix='segment') as executor:
+            futures = [
+                executor.submit(
+                    encode_video_segment, input_path, path, effect_type,
+                    start, frames, threads, scope, nice, encoder, segment_progress(i)
+                )
+                for i, (path, (start, frames)) in enumerate(zip(segment_paths, parts))
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                scope.set()  # Stop the other segments
+                raise
+
+        list_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            for path in segment_paths:
+                f.write(f"file '{path}'\n")
+
+        # Join video without re-encoding, audio is encoded once from the mezzanine
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-nostats',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-i', input_path,
+            '-map', '0:v', '-map', '1:a?',
+            '-c:v', 'copy',
+            *audio_args(encoder),
+            '-t', str(MAX_VIDEO_DURATION),
+            output_path
+        ]
+        logger.info(f"Running ffmpeg concat command: {' '.join(cmd)}")
+        run_ffmpeg(cmd, cancel_event=cancel_event, nice=nice)
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def use_frame_renderer(effect_type):
+    if PHOTO_RENDERER == 'ffmpeg' or not frame_render.AVAILABLE:
+        return False
+    return PHOTO_RENDERER == 'frames' or effect_type in AUTO_FRAME_EFFECTS
+
+class RenderEngine:
+    """Backend that renders kruzhoks from mezzanines
+
+    Methods return True when done, False when cancelled, and raise on errors.
+    progress, if given, is called with the seconds of output encoded so far.
+    """
+
+    name = None
+
+    def render_video(self, input_path, output_path, effect_type, cancel_event=None, nice=0,
+                     segments=1, duration=None, encoder=None, progress=None):
+        raise NotImplementedError
+
+    def render_photo(self, input_path, output_path, effect_type, cancel_event=None, nice=0,
+                     encoder=None, progress=None):
+        raise NotImplementedError
+
+class CliEngine(RenderEngine):
+    """ffmpeg subprocesses (and the NumPy/Pillow frame renderer for photos)"""
+
+    name = 'cli'
+
+    def render_video(self, input_path, output_path, effect_type, cancel_event=None, nice=0,
+                     segments=1, duration=None, encoder=None, progress=None):
+        if segments > 1 and encode_video_split(
+            input_path, output_path, effect_type, segments, cancel_event, nice, duration, encoder,
+            progress
+        ):
+            logger.info(f"Video split into {segments} segments")
+            return True
+
+        video_filter = effect_filter(VIDEO_EFFECT_FILTERS, effect_type)
+
+        # FFmpeg command to create circular video with effects
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-nostats',  # Overwrite output file
+            '-i', input_path,
+            '-t', str(MAX_VIDEO_DURATION),  # Limit duration
+            '-vf', video_filter,
+            '-c:v', 'libx264',  # Video codec
+            *audio_args(encoder),  # AAC bitrate/channels, or no audio
+            *x264_args(encoder),  # Preset, quality, bitrate cap and threads
+            output_path
+        ]
+
+        logger.info(f"Running ffmpeg command: {' '.join(cmd)}")
+        run_ffmpeg(cmd, cancel_event=cancel_event, nice=nice, progress=progress)
+        return True
+
+    def render_photo(self, input_path, output_path, effect_type, cancel_event=None, nice=0,
+                     encoder=None, progress=None):
+        if use_frame_renderer(effect_type):
+            try:
+                return frame_render.render_photo(
+                    input_path, output_path, effect_type, PHOTO_DURATION, PHOTO_FPS,
+                    cancel_event=cancel_event, nice=nice,
+                    encoder_args=x264_args(encoder), progress=progress
+                )
+            except Exception as e:
+                logger.warning(f"Frame renderer failed, using ffmpeg filters: {e}")
+
+        video_filter = effect_filter(PHOTO_EFFECT_FILTERS, effect_type)
+
+        # FFmpeg command to create 5-second circular video from image with effects
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-nostats',  # Overwrite output file
+            '-loop', '1',    # Loop the input image
+            '-framerate', str(PHOTO_FPS),
+            '-i', input_path,
+            '-t', str(PHOTO_DURATION),  # 5 seconds duration
+            '-vf', video_filter,
+            '-c:v', 'libx264',  # Video codec
+            '-pix_fmt', 'yuv420p',
+            '-r', str(PHOTO_FPS),  # Frame rate
+            *x264_args(encoder),  # Preset, quality, bitrate cap and threads
+            output_path
+        ]
+
+        logger.info(f"Running ffmpeg command for photo: {' '.join(cmd)}")
+        run_ffmpeg(cmd, cancel_event=cancel_event, nice=nice, progress=progress)
+        return True
+
+class PyAVEngine(RenderEngine):
+    """In-process decode/filter/encode with PyAV (optional dependency)"""
+
+    name = 'pyav'
+
+    def __init__(self):
+        import pyav_engine  # Imports media; loaded only when this engine is used
+        if not pyav_engine.AVAILABLE:
+            raise ImportError('PyAV is not installed')
+        self._engine = pyav_engine
+
+    def render_video(self, input_path, output_path, effect_type, cancel_event=None, nice=0,
+                     segments=1, duration=None, encoder=None, progress=None):
+        return self._engine.render_video(input_path, output_path, effect_type, cancel_event, encoder, progress)
+
+    def render_photo(self, input_path, output_path, effect_type, cancel_event=None, nice=0,
+                     encoder=None, progress=None):
+        return self._engine.render_photo(input_path, output_path, effect_type, cancel_event, encoder, progress)
+
+RENDER_ENGINES = {'cli': CliEngine, 'pyav': PyAVEngine}
+RENDER_ENGINE = os.environ.get('RENDER_ENGINE', 'cli')
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_render_engine(name=None):
+    """Engine instance by name (default RENDER_ENGINE); falls back to cli"""
+    name = name or RENDER_ENGINE
+    with _engines_lock:
+        if name not in _engines:
+            try:
+                _engines[name] = RENDER_ENGINES[name]()
+            except (KeyError, ImportError) as e:
+                logger.warning(f"Render engine {name!r} unavailable ({e}), using cli")
+                _engines[name] = _engines.get('cli') or CliEngine()
+        return _engines[name]
+
+def process_video_to_kruzhok(input_path, output_path, effect_type=1, cancel_event=None, nice=0,
+                             segments=1, duration=None, engine=None, encoder=None, progress=None):
+    """Convert normalized video (mezzanine) to kruzhok with effect
+
+    segments > 1 encodes long videos (duration seconds, if known) in that
+    many parallel parts where the engine supports it.
+    """
+    engine = engine or get_render_engine()
+    try:
+        if not engine.render_video(input_path, output_path, effect_type, cancel_event, nice,
+                                   segments, duration, encoder, progress):
+            logger.info("Video processing cancelled")
+            return False
+        logger.info(f"Video processing completed successfully ({engine.name})")
+        return True
+
+    except RenderCancelled:
+        logger.info("Video processing cancelled")
+        return False
+    except ProcessTimeout as e:
+        logger.error(f"FFmpeg killed: {e}\n{e.stderr}")
+        return False
+    except subprocess.CalledProcessError as e:
+        logger.error(f"FFmpeg error: {e.stderr}")
+        return False
+    except Exception as e:
+        logger.error(f"Error processing video: {e}")
+        return False
+
+def process_photo_to_kruzhok(input_path, output_path, effect_type=1, cancel_event=None, nice=0,
+                             engine=None, encoder=None, progress=None):
+    """Convert normalized photo (mezzanine) to 5-second kruzhok with effect"""
+    engine = engine or get_render_engine()
+    try:
+        if not engine.render_photo(input_path, output_path, effect_type, cancel_event, nice, encoder,
+                                   progress):
+            logger.info("Photo processing cancelled")
+            return False
+        logger.info(f"Photo processing completed successfully ({engine.name})")
+        return True
+
+    except RenderCancelled:
+        logger.info("Photo processing cancelled")
+        return False
+    except ProcessTimeout as e:
+        logger.error(f"FFmpeg killed for photo: {e}\n{e.stderr}")
+        return False
+    except subprocess.CalledProcessError as e:
+        logger.error(f"FFmpeg error for photo: {e.stderr}")
+        return False
+    except Exception as e:
+        logger.error(f"Error processing photo: {e}")
+        return False
+
+def render_media(media_type, input_file, output_file, effect_type, cancel_event=None, nice=0,
+                 segments=1, duration=None, engine=None, encoder=None, progress=None):
+    """Render kruzhok for photo or video mezzanine
+
+    encoder: x264 settings (DEFAULT_ENCODER shape, optionally size_targeted),
+    default preset fast, crf 23, no bitrate cap. progress(seconds) reports
+    output encoded so far.
+    """
+    if media_type == 'video':
+        return process_video_to_kruzhok(
+            input_file, output_file, effect_type, cancel_event, nice, segments, duration, engine,
+            encoder, progress
+        )
+    return process_photo_to_kruzhok(
+        input_file, output_file, effect_type, cancel_event, nice, engine, encoder, progress
+    )
@@ -0,0 +1,97 @@
+"""In-process metrics: counters, gauges and timing summaries"""
+
+import threading
+from collections import defaultdict, deque
+
+# Samples kept per timing for percentiles
+TIMING_WINDOW = 500
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+def incr(name, value=1):
+    """Increase counter"""
+    with _lock:
+        _counters[name] += value
+
+def get_counter(name):
+    """Get current counter value"""
+    with _lock:
+        return _counters.get(name, 0)
+
+def set_gauge(name, value_or_callable):
+    """Set gauge to a value, or to a callable evaluated on snapshot"""
+    with _lock:
+        _gauges[name] = value_or_callable
+
+def observe(name, seconds):
+    """Record a duration sample"""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0,
+                                       'samples': deque(maxlen=TIMING_WINDOW)}
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+        timing['samples'].append(seconds)
+
+def _percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+def snapshot():
+    """Get copy of all metrics"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {name: (t['count'], t['total'], t['max'], sorted(t['samples']))
+                   for name, t in _timings.items()}
+    
+    for name, value in gauges.items():
+        if callable(value):
+            try:
+                gauges[name] = value()
+            except Exception:
+                gauges[name] = None
+    
+    return {
+        'counters': counters,
+        'gauges': gauges,
+        'timings': {
+            name: {
+                'count': count,
+                'avg': total / count if count else 0.0,
+                'p50': _percentile(samples, 0.5),
+                'p95': _percentile(samples, 0.95),
+                'max': max_value
+            }
+            for name, (count, total, max_value, samples) in timings.items()
+        }
+    }
+
+def format_metrics():
+    """Format metrics as plain text for admin"""
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data['gauges'].items()):
+        lines.append(f"{name}: {value}")
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"{name}: {value}")
+    for name, t in sorted(data['timings'].items()):
+        lines.append(
+            f"{name}: n={t['count']} avg={t['avg'] * 1000:.0f}ms "
+            f"p50={t['p50'] * 1000:.0f}ms p95={t['p95'] * 1000:.0f}ms max={t['max'] * 1000:.0f}ms"
+        )
+    return "\n".join(lines) or "—"
+
+def reset():
+    """Clear all metrics (tests)"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
@@ -1,11 +1,16 @@
 """Database models for Kruzhok Bot"""
 
 import os
-from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, Text, Boolean
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, func, and_, or_, Index, Column, Integer, BigInteger, String, DateTime, Text, Boolean, Float, select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from disk_cache import read_cache, write_cache
+
 Base = declarative_base()
 
 class UserHistory(Base):
@@ -92,31 +97,214 @@ class PaymentRequest(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     processed_at = Column(DateTime, nullable=True)
     
+    # Admin inbox pages pending payments by (created_at, id)
+    __table_args__ = (
+        Index('ix_payment_requests_status_created_at', 'status', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f"<PaymentRequest(user_id={self.user_id}, amount={self.payment_amount}, status={self.status})>"
 
+class BroadcastJob(Base):
+    """Model to track admin broadcast progress (resumable after restart)"""
+    __tablename__ = 'broadcast_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    admin_chat_id = Column(BigInteger, nullable=False)
+    source_chat_id = Column(BigInteger, nullable=False)  # Message to copy to users
+    source_message_id = Column(Integer, nullable=False)
+    status_message_id = Column(Integer, nullable=True)  # Admin progress message
+    status = Column(String(20), default='running')  # running, done, cancelled
+    last_user_id = Column(BigInteger, default=0)  # Keyset cursor over user_language.user_id
+    total_count = Column(Integer, default=0)
+    sent_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<BroadcastJob(id={self.id}, status={self.status}, sent={self.sent_count}/{self.total_count})>"
+
+class RenderJob(Base):
+    """Model to store per-stage timings of a kruzhok render (seconds)"""
+    __tablename__ = 'render_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False, index=True)
+    media_type = Column(String(20), nullable=False)
+    effect_type = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False)  # done, failed, cancelled, error, refused (queue too long)
+    speculative = Column(Boolean, default=False)  # Served by a pre-render
+    preset = Column(String(20), nullable=True)  # x264 preset used
+    output_size = Column(Integer, nullable=True)  # Bytes
+    download_seconds = Column(Float, nullable=True)  # Waiting for the source download
+    probe_seconds = Column(Float, nullable=True)
+    mezzanine_seconds = Column(Float, nullable=True)
+    queue_seconds = Column(Float, nullable=True)  # Waiting for a render worker
+    encode_seconds = Column(Float, nullable=True)
+    upload_seconds = Column(Float, nullable=True)
+    db_seconds = Column(Float, nullable=True)
+    total_seconds = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<RenderJob(user_id={self.user_id}, status={self.status}, total={self.total_seconds})>"
+
+class SchemaVersion(Base):
+    """Model to store applied schema version"""
+    __tablename__ = 'schema_version'
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+# Bump when tables or indexes change so ensure_schema() runs create_all once
+SCHEMA_VERSION = 4
+
 # Database setup
-DATABASE_URL = os.environ.get('DATABASE_URL')
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable is required")
-
-engine = create_engine(
-    DATABASE_URL, 
-    echo=False,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    connect_args={"sslmode": "require"}
+# Without DATABASE_URL the bot runs on an embedded SQLite file (single-node mode)
+DEFAULT_SQLITE_PATH = os.environ.get('SQLITE_PATH', 'kruzhok.db')
+DATABASE_URL = os.environ.get('DATABASE_URL') or f"sqlite:///{DEFAULT_SQLITE_PATH}"
+
+# Tuned for a single writer with many readers; applied on every new connection
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", "5000"),
+    ("cache_size", "-20000"),  # ~20 MB page cache
+    ("temp_store", "MEMORY"),
+    ("mmap_size", "268435456"),
+    ("foreign_keys", "ON"),
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def is_sqlite_url(url):
+    """Check if database URL points to SQLite"""
+    return url.startswith('sqlite')
+
+def build_engine(url):
+    """Create engine with dialect-specific connect args"""
+    if is_sqlite_url(url):
+        engine = create_engine(
+            url,
+            echo=False,
+            connect_args={"check_same_thread": False, "timeout": 30}
+        )
+
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in SQLITE_PRAGMAS:
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+        return engine
+
+    return create_engine(
+        url,
+        echo=False,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        connect_args={"sslmode": os.environ.get('DATABASE_SSLMODE', 'require')}
+    )
+
+# Engine is created on first use so importing models needs no connection
+_engine = None
+_engine_lock = threading.Lock()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+def get_engine():
+    """Get database engine, creating it on first call"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = build_engine(DATABASE_URL)
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+def __getattr__(name):
+    # Keep `models.engine` working for existing callers
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_tables():
-    """Create all tables"""
+    """Create all tables and any indexes missing on existing tables"""
+    engine = get_engine()
     Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+def _schema_cache_key():
+    """Cache key for the current SQLite file (path and inode), else None
+    
+    Server databases are not cached: one recreated or restored behind the
+    same URL would never get its tables back. They pay the single version
+    query on every start instead.
+    """
+    if not is_sqlite_url(DATABASE_URL):
+        return None
+    db_path = DATABASE_URL.split(':///', 1)[-1]
+    if not os.path.exists(db_path):
+        return None
+    key = f"{DATABASE_URL}:{os.stat(db_path).st_ino}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def ensure_schema():
+    """Create or upgrade tables only when schema version changed
+    
+    Returns True if create_all was run.
+    """
+    cache_key = _schema_cache_key()
+    if cache_key and read_cache(f"schema_{cache_key}") == SCHEMA_VERSION:
+        return False
+    
+    session = get_db_session()
+    try:
+        try:
+            current = session.query(func.max(SchemaVersion.version)).scalar()
+        except Exception:
+            session.rollback()
+            current = None
+        
+        migrated = current != SCHEMA_VERSION
+        if migrated:
+            create_tables()
+            session.add(SchemaVersion(version=SCHEMA_VERSION))
+            session.commit()
+    finally:
+        session.close()
+    
+    cache_key = _schema_cache_key()
+    if cache_key:
+        write_cache(f"schema_{cache_key}", SCHEMA_VERSION)
+    return migrated
 
 def get_db_session():
     """Get database session"""
+    get_engine()
     return SessionLocal()
 
+def dialect_insert(session, model):
+    """Get INSERT construct with ON CONFLICT support for current dialect"""
+    if session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+def upsert(session, model, values, index_elements, update_fields=None):
+    """INSERT ... ON CONFLICT DO UPDATE (or DO NOTHING) in one round trip"""
+    stmt = dialect_insert(session, model).values(**values)
+    if update_fields:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={field: stmt.excluded[field] for field in update_fields}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    session.execute(stmt)
+
 def save_user_history(user_id, username, first_name, file_id, original_media_type, effect_type, effect_name, file_size=None):
     """Save user's kruzhok to history"""
     session = get_db_session()
@@ -141,6 +329,20 @@ def save_user_history(user_id, username, first_name, file_id, original_media_typ
     finally:
         session.close()
 
+def save_render_job(**fields):
+    """Save render job telemetry (RenderJob columns)"""
+    session = get_db_session()
+    try:
+        session.add(RenderJob(**fields))
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        print(f"Error saving render job: {e}")
+        return False
+    finally:
+        session.close()
+
 def get_user_history(user_id, limit=10):
     """Get user's recent kruzhok history"""
     session = get_db_session()
@@ -161,41 +363,85 @@ def get_total_user_kruzhoks(user_id):
     """Get total count of user's kruzhoks"""
     session = get_db_session()
     try:
-        count = session.query(UserHistory).filter(
+        count = session.query(func.count(UserHistory.id)).filter(
             UserHistory.user_id == user_id
-        ).count()
-        return count
+        ).scalar()
+        return count or 0
     except Exception as e:
         print(f"Error getting count: {e}")
         return 0
     finally:
         session.close()
 
-def set_user_language(user_id, username, first_name, language_code):
-    """Set or update user's preferred language"""
+def get_admin_counts():
+    """Get total users and kruzhoks for admin panel"""
     session = get_db_session()
     try:
-        # Check if user language record exists
-        user_lang = session.query(UserLanguage).filter(
-            UserLanguage.user_id == user_id
-        ).first()
+        total_users = session.query(func.count(UserLanguage.id)).scalar() or 0
+        total_kruzhoks = session.query(func.count(UserHistory.id)).scalar() or 0
+        return {'total_users': total_users, 'total_kruzhoks': total_kruzhoks}
+    except Exception as e:
+        print(f"Error getting admin counts: {e}")
+        return {'total_users': 0, 'total_kruzhoks': 0}
+    finally:
+        session.close()
+
+def get_usage_stats():
+    """Get user count per language and kruzhok count per effect"""
+    session = get_db_session()
+    try:
+        lang_stats = session.query(
+            UserLanguage.language_code,
+            func.count(UserLanguage.id)
+        ).group_by(UserLanguage.language_code).all()
         
-        if user_lang:
-            # Update existing record
-            user_lang.language_code = language_code
-            user_lang.username = username
-            user_lang.first_name = first_name
-            user_lang.updated_at = datetime.utcnow()
-        else:
-            # Create new record
-            user_lang = UserLanguage(
-                user_id=user_id,
-                username=username,
-                first_name=first_name,
-                language_code=language_code
-            )
-            session.add(user_lang)
+        effect_stats = session.query(
+            UserHistory.effect_name,
+            func.count(UserHistory.id)
+        ).group_by(UserHistory.effect_name).all()
         
+        return {'languages': lang_stats, 'effects': effect_stats}
+    except Exception as e:
+        print(f"Error getting usage stats: {e}")
+        return {'languages': [], 'effects': []}
+    finally:
+        session.close()
+
+def get_favourite_effect(user_id=None):
+    """Get most used effect type of a user, or of all users if user_id is None"""
+    session = get_db_session()
+    try:
+        uses = func.count(UserHistory.id)
+        query = session.query(UserHistory.effect_type, uses)
+        if user_id is not None:
+            query = query.filter(UserHistory.user_id == user_id)
+        row = query.group_by(UserHistory.effect_type).order_by(uses.desc()).first()
+        return row.effect_type if row else None
+    except Exception as e:
+        print(f"Error getting favourite effect: {e}")
+        return None
+    finally:
+        session.close()
+
+def set_user_language(user_id, username, first_name, language_code):
+    """Set or update user's preferred language"""
+    session = get_db_session()
+    try:
+        now = datetime.utcnow()
+        upsert(
+            session,
+            UserLanguage,
+            values={
+                'user_id': user_id,
+                'username': username,
+                'first_name': first_name,
+                'language_code': language_code,
+                'created_at': now,
+                'updated_at': now
+            },
+            index_elements=['user_id'],
+            update_fields=['username', 'first_name', 'language_code', 'updated_at']
+        )
         session.commit()
         return True
     except Exception as e:
@@ -227,21 +473,17 @@ def get_or_create_user_subscription(user_id, username=None, first_name=None):
     """Get or create user subscription record"""
     session = get_db_session()
     try:
-        user_sub = session.query(UserSubscription).filter(
+        upsert(
+            session,
+            UserSubscription,
+            values={'user_id': user_id, 'username': username, 'first_name': first_name},
+            index_elements=['user_id']
+        )
+        session.commit()
+        
+        return session.query(UserSubscription).filter(
             UserSubscription.user_id == user_id
         ).first()
-        
-        if not user_sub:
-            user_sub = UserSubscription(
-                user_id=user_id,
-                username=username,
-                first_name=first_name
-            )
-            session.add(user_sub)
-            session.commit()
-            session.refresh(user_sub)
-        
-        return user_sub
     except Exception as e:
         session.rollback()
         print(f"Error getting user subscription: {e}")
@@ -378,7 +620,9 @@ def add_referral(referrer_id, referred_id, referrer_username=None, referrer_firs
             referrer_sub = UserSubscription(
                 user_id=referrer_id,
                 username=referrer_username,
-                first_name=referrer_first_name
+                first_name=referrer_first_name,
+                referral_count=0,
+                bonus_kruzhoks=0
             )
             session.add(referrer_sub)
         
@@ -412,14 +656,15 @@ def get_referral_stats(user_id):
     """Get referral statistics for user"""
     session = get_db_session()
     try:
-        referrals = session.query(ReferralHistory).filter(
+        total_referrals, total_bonus = session.query(
+            func.count(ReferralHistory.id),
+            func.coalesce(func.sum(ReferralHistory.bonus_kruzhoks_given), 0)
+        ).filter(
             ReferralHistory.referrer_id == user_id
-        ).all()
-        
-        total_bonus = sum(r.bonus_kruzhoks_given for r in referrals)
+        ).one()
         
         return {
-            'total_referrals': len(referrals),
+            'total_referrals': total_referrals,
             'total_bonus_kruzhoks': total_bonus
         }
     except Exception as e:
@@ -465,46 +710,96 @@ def get_pending_payments():
     finally:
         session.close()
 
+def get_pending_payments_page(limit=5, after=None):
+    """Get one page of pending payments, newest first (keyset pagination)
+    
+    after is the (created_at, id) of the last payment on the previous page.
+    Returns (payments, has_more).
+    """
+    session = get_db_session()
+    try:
+        query = session.query(PaymentRequest).filter(
+            PaymentRequest.status == 'pending'
+        )
+        if after:
+            created_at, payment_id = after
+            query = query.filter(or_(
+                PaymentRequest.created_at < created_at,
+                and_(PaymentRequest.created_at == created_at, PaymentRequest.id < payment_id)
+            ))
+        payments = query.order_by(
+            PaymentRequest.created_at.desc(),
+            PaymentRequest.id.desc()
+        ).limit(limit + 1).all()
+        return payments[:limit], len(payments) > limit
+    except Exception as e:
+        print(f"Error getting pending payments page: {e}")
+        return [], False
+    finally:
+        session.close()
+
+def count_pending_payments():
+    """Count pending payment requests"""
+    session = get_db_session()
+    try:
+        return session.query(func.count(PaymentRequest.id)).filter(
+            PaymentRequest.status == 'pending'
+        ).scalar() or 0
+    except Exception as e:
+        print(f"Error counting pending payments: {e}")
+        return 0
+    finally:
+        session.close()
+
+def _grant_premium(session, payment, admin_response=None):
+    """Mark payment approved and extend user's premium (no commit)"""
+    payment.status = 'approved'
+    payment.admin_response = admin_response
+    payment.processed_at = datetime.utcnow()
+    
+    user_sub = session.query(UserSubscription).filter(
+        UserSubscription.user_id == payment.user_id
+    ).first()
+    
+    if not user_sub:
+        user_sub = UserSubscription(
+            user_id=payment.user_id,
+            username=payment.username,
+            first_name=payment.first_name
+        )
+        session.add(user_sub)
+        # Autoflush is off: flush so a second payment of this user in the
+        # same transaction finds the row instead of adding another one
+        session.flush()
+    
+    user_sub.is_premium = True
+    
+    # Set premium expiry based on plan
+    if payment.payment_plan == 'weekly':
+        user_sub.premium_expires_at = datetime.utcnow() + timedelta(days=7)
+    elif payment.payment_plan == 'monthly':
+        user_sub.premium_expires_at = datetime.utcnow() + timedelta(days=30)
+
 def approve_payment(payment_id, admin_response=None):
-    """Approve payment and grant premium"""
+    """Approve pending payment and grant premium
+    
+    Returns the payment, None if it doesn't exist or was already processed
+    (approving again would reset the expiry), False on error.
+    """
     session = get_db_session()
     try:
         payment = session.query(PaymentRequest).filter(
-            PaymentRequest.id == payment_id
+            PaymentRequest.id == payment_id,
+            PaymentRequest.status == 'pending'
         ).first()
         
         if not payment:
-            return False
+            return None
         
-        # Update payment status
-        payment.status = 'approved'
-        payment.admin_response = admin_response
-        payment.processed_at = datetime.utcnow()
-        
-        # Grant premium to user
-        user_sub = session.query(UserSubscription).filter(
-            UserSubscription.user_id == payment.user_id
-        ).first()
-        
-        if not user_sub:
-            user_sub = UserSubscription(
-                user_id=payment.user_id,
-                username=payment.username,
-                first_name=payment.first_name
-            )
-            session.add(user_sub)
-        
-        user_sub.is_premium = True
-        
-        # Set premium expiry based on plan
-        if payment.payment_plan == 'weekly':
-            from datetime import timedelta
-            user_sub.premium_expires_at = datetime.utcnow() + timedelta(days=7)
-        elif payment.payment_plan == 'monthly':
-            from datetime import timedelta
-            user_sub.premium_expires_at = datetime.utcnow() + timedelta(days=30)
+        _grant_premium(session, payment, admin_response)
         
         session.commit()
+        session.refresh(payment)
         return payment
     except Exception as e:
         session.rollback()
@@ -513,26 +808,155 @@ def approve_payment(payment_id, admin_response=None):
     finally:
         session.close()
 
+def approve_payments(payment_ids, admin_response=None):
+    """Approve several pending payments in one transaction
+    
+    Returns list of approved payments (already processed ones are skipped).
+    """
+    if not payment_ids:
+        return []
+    
+    session = get_db_session()
+    try:
+        payments = session.query(PaymentRequest).filter(
+            PaymentRequest.id.in_(payment_ids),
+            PaymentRequest.status == 'pending'
+        ).order_by(PaymentRequest.id).all()
+        
+        for payment in payments:
+            _grant_premium(session, payment, admin_response)
+        
+        session.commit()
+        for payment in payments:
+            session.refresh(payment)
+        return payments
+    except Exception as e:
+        session.rollback()
+        print(f"Error approving payments: {e}")
+        return []
+    finally:
+        session.close()
+
 def reject_payment(payment_id, admin_response):
-    """Reject payment request"""
+    """Reject pending payment request
+    
+    Returns the payment, None if it doesn't exist or was already processed,
+    False on error.
+    """
     session = get_db_session()
     try:
         payment = session.query(PaymentRequest).filter(
-            PaymentRequest.id == payment_id
+            PaymentRequest.id == payment_id,
+            PaymentRequest.status == 'pending'
         ).first()
         
         if not payment:
-            return False
+            return None
         
         payment.status = 'rejected'
         payment.admin_response = admin_response
         payment.processed_at = datetime.utcnow()
         
         session.commit()
+        session.refresh(payment)
         return payment
     except Exception as e:
         session.rollback()
         print(f"Error rejecting payment: {e}")
         return False
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+def get_broadcast_recipients(after_user_id=0, limit=500):
+    """Get next batch of broadcast recipient ids after given user id"""
+    session = get_db_session()
+    try:
+        rows = session.query(UserLanguage.user_id).filter(
+            UserLanguage.user_id > after_user_id
+        ).order_by(UserLanguage.user_id).limit(limit).all()
+        return [row.user_id for row in rows]
+    except Exception as e:
+        print(f"Error getting broadcast recipients: {e}")
+        return []
+    finally:
+        session.close()
+
+def create_broadcast_job(admin_chat_id, source_chat_id, source_message_id):
+    """Create broadcast job for all users with a language record"""
+    session = get_db_session()
+    try:
+        total = session.query(func.count(UserLanguage.id)).scalar() or 0
+        job = BroadcastJob(
+            admin_chat_id=admin_chat_id,
+            source_chat_id=source_chat_id,
+            source_message_id=source_message_id,
+            total_count=total
+        )
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        return job
+    except Exception as e:
+        session.rollback()
+        print(f"Error creating broadcast job: {e}")
+        return None
+    finally:
+        session.close()
+
+def update_broadcast_job(job_id, **fields):
+    """Persist broadcast progress fields"""
+    session = get_db_session()
+    try:
+        session.query(BroadcastJob).filter(
+            BroadcastJob.id == job_id
+        ).update(dict(fields, updated_at=datetime.utcnow()))
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        print(f"Error updating broadcast job: {e}")
+        return False
+    finally:
+        session.close()
+
+def get_running_broadcast_jobs():
+    """Get broadcast jobs that were interrupted and should resume"""
+    session = get_db_session()
+    try:
+        return session.query(BroadcastJob).filter(
+            BroadcastJob.status == 'running'
+        ).order_by(BroadcastJob.id).all()
+    except Exception as e:
+        print(f"Error getting running broadcasts: {e}")
+        return []
+    finally:
+        session.close()
+
+# Tables available for admin export
+EXPORT_MODELS = {
+    'history': UserHistory,
+    'payments': PaymentRequest,
+    'referrals': ReferralHistory,
+    'jobs': RenderJob
+}
+
+def iter_export_rows(kind, batch_size=1000):
+    """Stream rows of an export table with a server-side cursor
+    
+    Yields the column names first, then one tuple per row. Rows are fetched
+    batch_size at a time, so memory use does not depend on table size.
+    """
+    model = EXPORT_MODELS[kind]
+    columns = list(model.__table__.columns)
+    session = get_db_session()
+    try:
+        yield [column.name for column in columns]
+        
+        stmt = select(*columns).order_by(model.id).execution_options(
+            stream_results=True,
+            yield_per=batch_size
+        )
+        for row in session.execute(stmt):
+            yield tuple(row)
+    finally:
+        session.close()
@@ -0,0 +1,193 @@
+"""Supervised subprocesses: timeouts, resource limits, cancellation
+
+Every process runs in its own process group under a watchdog thread that
+kills the whole group when the wall-clock deadline passes or the cancel
+event gets set. CPU time and address space are capped with rlimits set on
+the child right after it starts, stderr is kept only as a bounded tail, and kill_all() takes down
+whatever is still running at shutdown.
+"""
+
+import os
+import time
+import shutil
+import signal
+import logging
+import resource
+import threading
+import subprocess
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Defaults for ffmpeg/ffprobe; a 60 s kruzhok takes a fraction of these
+PROCESS_TIMEOUT = float(os.environ.get('PROCESS_TIMEOUT', '300'))  # Wall-clock seconds
+PROCESS_CPU_LIMIT = int(os.environ.get('PROCESS_CPU_LIMIT', '900'))  # CPU seconds, all threads
+PROCESS_MEMORY_LIMIT = int(os.environ.get('PROCESS_MEMORY_LIMIT', str(4 * 1024 ** 3)))  # Address space
+STDERR_TAIL_LINES = 200
+STDERR_LINE_MAX = 1000
+
+IONICE = shutil.which('ionice')
+IONICE_IDLE = 3  # Disk I/O only when nobody else needs it
+
+POLL_INTERVAL = 0.25
+
+class ProcessCancelled(Exception):
+    """Process was killed because its cancel event got set (or on shutdown)"""
+
+class ProcessTimeout(subprocess.SubprocessError):
+    """Process ran out of wall-clock or CPU time"""
+
+    def __init__(self, cmd, limit, stderr=''):
+        super().__init__(f"{cmd[0]} exceeded its {limit} limit")
+        self.cmd = cmd
+        self.limit = limit
+        self.stderr = stderr
+
+_live = set()
+_live_lock = threading.Lock()
+
+def _limit_child(pid, nice, cpu_limit, memory_limit):
+    """Apply priority and rlimits to a just started child
+
+    Done from the parent: a preexec_fn is not safe in this threaded process
+    (the child can deadlock before exec) and forces the slow fork path.
+    The child runs unlimited only for the moment until this returns.
+    """
+    try:
+        if nice:
+            os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + nice)
+        if cpu_limit:
+            # SIGXCPU at the soft limit, SIGKILL a few seconds later
+            resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 5))
+        if memory_limit:
+            resource.prlimit(pid, resource.RLIMIT_AS, (memory_limit, memory_limit))
+    except ProcessLookupError:
+        pass  # Already exited
+
+class SupervisedProcess:
+    """Start cmd under a watchdog; wait() returns a CompletedProcess
+
+    stdin=subprocess.PIPE gives a writable .stdin (writes fail with
+    BrokenPipeError once the watchdog killed the process). wait() raises
+    ProcessCancelled, ProcessTimeout or CalledProcessError (with the stderr
+    tail) and always reaps the process.
+    """
+
+    def __init__(self, cmd, cancel_event=None, nice=0, ionice_idle=False, timeout=PROCESS_TIMEOUT,
+                 cpu_limit=PROCESS_CPU_LIMIT, memory_limit=PROCESS_MEMORY_LIMIT,
+                 stdin=subprocess.DEVNULL, capture_stdout=False, pass_fds=()):
+        self.cmd = list(cmd)
+        self._cancel_event = cancel_event
+        self._deadline = time.monotonic() + timeout if timeout else None
+        self._stderr = deque(maxlen=STDERR_TAIL_LINES)
+        self._stdout = []
+        self.killed_for = None  # Why we killed it: 'cancel', 'shutdown' or 'wall-clock time'
+
+        run_cmd = self.cmd
+        if ionice_idle and IONICE:
+            run_cmd = [IONICE, '-c', str(IONICE_IDLE), *run_cmd]
+        self.process = subprocess.Popen(
+            run_cmd,
+            stdin=stdin,
+            stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds,
+            start_new_session=True  # Own process group, killed as a whole
+        )
+        _limit_child(self.process.pid, nice, cpu_limit, memory_limit)
+        self.stdin = self.process.stdin
+        with _live_lock:
+            _live.add(self)
+
+        self._threads = [
+            threading.Thread(target=self._read_stderr, name='proc-stderr', daemon=True),
+            threading.Thread(target=self._watch, name='proc-watchdog', daemon=True)
+        ]
+        if capture_stdout:
+            self._threads.append(threading.Thread(target=self._read_stdout, name='proc-stdout', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _read_stderr(self):
+        # Bounded reads: a line without newline (ffmpeg's \r stats) can't
+        # grow without limit; the rest of an overlong line is dropped
+        continued = False
+        for chunk in iter(lambda: self.process.stderr.readline(STDERR_LINE_MAX), b''):
+            if not continued:
+                line = chunk.decode(errors='replace')
+                self._stderr.append(line if line.endswith('\n') else line + '\n')
+            continued = not chunk.endswith(b'\n')
+
+    def _read_stdout(self):
+        for chunk in iter(lambda: self.process.stdout.read(65536), b''):
+            self._stdout.append(chunk)
+
+    def _watch(self):
+        while True:
+            try:
+                self.process.wait(timeout=POLL_INTERVAL)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+            if self._cancel_event is not None and self._cancel_event.is_set():
+                self.kill('cancel')
+            elif self._deadline is not None and time.monotonic() > self._deadline:
+                self.kill('wall-clock time')
+
+    def kill(self, reason='shutdown'):
+        """Kill the process group (ffmpeg and anything it spawned)"""
+        if self.process.returncode is not None:
+            return  # Already reaped; its pid may belong to someone else now
+        if self.killed_for is None:
+            self.killed_for = reason
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    @property
+    def stderr(self):
+        return ''.join(self._stderr)
+
+    def wait(self):
+        try:
+            returncode = self.process.wait()
+        finally:
+            with _live_lock:
+                _live.discard(self)
+        for thread in self._threads:
+            thread.join(timeout=1)
+        if self.stdin is not None and not self.stdin.closed:
+            try:
+                self.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        if self.killed_for in ('cancel', 'shutdown'):
+            raise ProcessCancelled()
+        if self.killed_for is not None:
+            raise ProcessTimeout(self.cmd, self.killed_for, self.stderr)
+        if returncode == -signal.SIGXCPU:
+            raise ProcessTimeout(self.cmd, 'CPU time', self.stderr)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.cmd, stderr=self.stderr)
+        stdout = b''.join(self._stdout).decode(errors='replace') if self._stdout else None
+        return subprocess.CompletedProcess(self.cmd, returncode, stdout, self.stderr)
+
+def run_supervised(cmd, **kwargs):
+    """Run cmd to completion under SupervisedProcess, return CompletedProcess"""
+    return SupervisedProcess(cmd, **kwargs).wait()
+
+def live_count():
+    with _live_lock:
+        return len(_live)
+
+def kill_all():
+    """Kill every supervised process still running (on shutdown)"""
+    with _live_lock:
+        processes = list(_live)
+    for process in processes:
+        process.kill()
+    if processes:
+        logger.warning(f"Killed {len(processes)} running process(es) on shutdown")
+    return len(processes)
@@ -0,0 +1,80 @@
+"""Throttled percent/ETA edits of a status message"""
+
+import os
+import time
+import threading
+
+# Edits of one message: at most one per interval, and only on visible change
+PROGRESS_EDIT_INTERVAL = float(os.environ.get('PROGRESS_EDIT_INTERVAL', '3'))
+PROGRESS_MIN_STEP = 5  # percent
+
+def format_eta(seconds):
+    """Remaining time as m:ss"""
+    seconds = max(1, int(round(seconds)))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+class ProgressReporter:
+    """Turns output seconds encoded into status edits with percent and ETA
+
+    Called from ffmpeg progress reader threads, so edit(text) must not
+    block; it returns a Future (a queued send). An edit still queued when
+    a newer one is made, or when the reporter is closed, is cancelled.
+    The ETA comes from the encode rate since the first report, so time
+    spent before encoding (queue, mezzanine) does not skew it. total()
+    returns the output length in seconds, or None while it is unknown
+    (source not probed yet).
+    """
+
+    def __init__(self, edit, total, template, interval=PROGRESS_EDIT_INTERVAL, clock=time.monotonic):
+        self._edit = edit
+        self.total = total
+        self.template = template  # With {percent} and {eta}
+        self.interval = interval
+        self._clock = clock
+        self._first = None
+        self._last_edit = clock()  # The static status message was just shown
+        self._percent = 0
+        self._pending = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __call__(self, seconds):
+        with self._lock:
+            total = self.total()
+            if self._closed or not total:
+                return
+            now = self._clock()
+            if self._first is None:
+                self._first = (now, seconds)
+                return
+            percent = min(99, int(seconds * 100 / total))
+            if percent - self._percent < PROGRESS_MIN_STEP or now - self._last_edit < self.interval:
+                return
+            started, start_seconds = self._first
+            if seconds <= start_seconds or now <= started:
+                return
+            rate = (seconds - start_seconds) / (now - started)
+            eta = (total - seconds) / rate
+
+            if self._pending is not None:
+                self._pending.cancel()
+            self._pending = self._edit(self.template.format(percent=percent, eta=format_eta(eta)))
+            self._last_edit = now
+            self._percent = percent
+
+    def show(self, text):
+        """Edit to a static text (e.g. the queue ETA) that close() can still drop"""
+        with self._lock:
+            if self._closed:
+                return
+            if self._pending is not None:
+                self._pending.cancel()
+            self._pending = self._edit(text)
+            self._last_edit = self._clock()
+
+    def close(self):
+        """Stop editing; drops an edit that has not been sent yet"""
+        with self._lock:
+            self._closed = True
+            if self._pending is not None:
+                self._pending.cancel()
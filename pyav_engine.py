@@ -0,0 +1,185 @@
+"""In-process render engine on PyAV (libav bindings)
+
+Decodes the mezzanine, runs the same effect filters through a libavfilter
+graph and encodes into an in-memory MP4, all inside the bot process: no
+ffmpeg/ffprobe subprocesses and no stderr text to buffer. PyAV is
+optional; AVAILABLE is False without it.
+
+nice and split segments are not supported (one process, libx264 threads
+its own encode); callers get the same result as a single CLI encode.
+"""
+
+import io
+import logging
+from fractions import Fraction
+
+try:
+    import av
+except ImportError:  # pragma: no cover - depends on environment
+    av = None
+
+from media import (
+    KRUZHOK_SIZE, MEZZANINE_FPS, MAX_VIDEO_DURATION, PHOTO_DURATION, PHOTO_FPS,
+    VIDEO_EFFECT_FILTERS, PHOTO_EFFECT_FILTERS, DEFAULT_ENCODER, DEFAULT_AUDIO,
+    RenderCancelled, effect_filter_nodes
+)
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = av is not None
+
+AUDIO_RATE = 44100
+AUDIO_LAYOUTS = {1: 'mono', 2: 'stereo'}
+
+def _build_graph(nodes, template=None, **buffer_args):
+    graph = av.filter.Graph()
+    previous = graph.add_buffer(template=template, **buffer_args)
+    for name, args in nodes:
+        node = graph.add(name, args)
+        previous.link_to(node)
+        previous = node
+    previous.link_to(graph.add('buffersink'))
+    graph.configure()
+    return graph
+
+def _pull_all(graph):
+    """Frames the graph can output now"""
+    while True:
+        try:
+            yield graph.pull()
+        except (av.BlockingIOError, av.EOFError):
+            return
+
+def _x264_options(encoder):
+    encoder = encoder or DEFAULT_ENCODER
+    options = {'preset': encoder['preset'], 'crf': str(encoder['crf'])}
+    if encoder.get('maxrate'):
+        options['maxrate'] = f"{encoder['maxrate']}k"
+        options['bufsize'] = f"{encoder['bufsize']}k"
+    if encoder.get('threads'):
+        options['threads'] = str(encoder['threads'])
+    return options
+
+def _add_video_stream(output, fps, encoder=None):
+    stream = output.add_stream('libx264', rate=fps, options=_x264_options(encoder))
+    stream.width = KRUZHOK_SIZE
+    stream.height = KRUZHOK_SIZE
+    stream.pix_fmt = 'yuv420p'
+    return stream
+
+def _check_cancel(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise RenderCancelled()
+
+class _VideoEncoder:
+    """Encode filtered frames at a constant rate, reporting each second done"""
+
+    def __init__(self, output, stream, fps, progress=None):
+        self.output = output
+        self.stream = stream
+        self.fps = fps
+        self.time_base = Fraction(1, fps)
+        self.count = 0
+        self.progress = progress
+
+    def encode(self, frame=None):
+        if frame is not None:
+            frame.pts = self.count
+            frame.time_base = self.time_base
+            self.count += 1
+            if self.progress is not None and self.count % self.fps == 0:
+                self.progress(self.count / self.fps)
+        self.output.mux(self.stream.encode(frame))
+
+def _write(buffer, output_path):
+    with open(output_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+
+def render_video(input_path, output_path, effect_type=1, cancel_event=None, encoder=None,
+                 progress=None):
+    """Render video mezzanine with effect; raises RenderCancelled on cancel"""
+    encoder = encoder or DEFAULT_ENCODER
+    buffer = io.BytesIO()
+    with av.open(input_path) as source, av.open(buffer, 'w', format='mp4') as output:
+        video_in = source.streams.video[0]
+        video_in.thread_type = 'AUTO'
+        audio_kbps = encoder.get('audio_kbps', DEFAULT_AUDIO[0])
+        layout = AUDIO_LAYOUTS.get(encoder.get('audio_channels', DEFAULT_AUDIO[1]), 'stereo')
+        audio_in = source.streams.audio[0] if source.streams.audio and audio_kbps else None
+
+        video = _VideoEncoder(output, _add_video_stream(output, MEZZANINE_FPS, encoder), MEZZANINE_FPS,
+                              progress)
+        graph = _build_graph(effect_filter_nodes(VIDEO_EFFECT_FILTERS, effect_type), template=video_in)
+
+        audio_out = resampler = None
+        audio_samples = 0
+        if audio_in is not None:
+            audio_out = output.add_stream('aac', rate=AUDIO_RATE, layout=layout)
+            audio_out.bit_rate = audio_kbps * 1000
+            resampler = av.AudioResampler(format='fltp', layout=layout, rate=AUDIO_RATE, frame_size=1024)
+
+        def encode_audio(frames):
+            nonlocal audio_samples
+            for frame in frames:
+                frame.pts = audio_samples
+                frame.time_base = Fraction(1, AUDIO_RATE)
+                audio_samples += frame.samples
+                output.mux(audio_out.encode(frame))
+
+        streams = [video_in] + ([audio_in] if audio_in is not None else [])
+        for packet in source.demux(*streams):
+            _check_cancel(cancel_event)
+            for frame in packet.decode():
+                if frame.time is not None and frame.time >= MAX_VIDEO_DURATION:
+                    continue
+                if packet.stream is video_in:
+                    graph.push(frame)
+                    for filtered in _pull_all(graph):
+                        video.encode(filtered)
+                else:
+                    encode_audio(resampler.resample(frame))
+
+        graph.push(None)
+        for filtered in _pull_all(graph):
+            video.encode(filtered)
+        video.encode(None)
+        if audio_out is not None:
+            encode_audio(resampler.resample(None))
+            output.mux(audio_out.encode(None))
+
+    _write(buffer, output_path)
+    return True
+
+def render_photo(input_path, output_path, effect_type=1, cancel_event=None, encoder=None,
+                 progress=None):
+    """Render 5-second kruzhok from photo mezzanine; decodes the image once"""
+    with av.open(input_path) as source:
+        image = next(source.decode(video=0))
+
+    frame_count = int(round(PHOTO_DURATION * PHOTO_FPS))
+    time_base = Fraction(1, PHOTO_FPS)
+    graph = _build_graph(
+        effect_filter_nodes(PHOTO_EFFECT_FILTERS, effect_type),
+        width=image.width, height=image.height, format=image.format.name,
+        time_base=time_base
+    )
+
+    buffer = io.BytesIO()
+    with av.open(buffer, 'w', format='mp4') as output:
+        video = _VideoEncoder(output, _add_video_stream(output, PHOTO_FPS, encoder), PHOTO_FPS, progress)
+        for n in range(frame_count):
+            _check_cancel(cancel_event)
+            image.pts = n
+            image.time_base = time_base
+            graph.push(image)
+            for filtered in _pull_all(graph):
+                if video.count < frame_count:
+                    video.encode(filtered)
+        graph.push(None)
+        for filtered in _pull_all(graph):
+            if video.count < frame_count:
+                video.encode(filtered)
+        video.encode(None)
+
+    _write(buffer, output_path)
+    return True
@@ -0,0 +1,62 @@
+"""Token bucket rate limiting"""
+
+import time
+import threading
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`"""
+    
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+    
+    def delay_for(self, tokens=1):
+        """Seconds until `tokens` can be taken (0 if available now); takes them if so"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+    
+    def try_acquire(self, tokens=1):
+        """Take tokens without waiting, return True on success"""
+        return self.delay_for(tokens) == 0.0
+    
+    def acquire(self, tokens=1, timeout=None, stop_event=None):
+        """Block until tokens are taken; False on timeout or stop_event"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.delay_for(tokens)
+            if delay == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+    
+    def block_for(self, seconds):
+        """Pause the bucket, e.g. after a 429 with retry_after"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = self._blocked_until
@@ -0,0 +1,91 @@
+"""Predict render seconds per job, calibrated from finished renders
+
+A render's time on a worker is the mezzanine step (decode and scale the
+source, grows with its pixels) plus the effect encode (grows with the
+kruzhok length, differs a lot per effect). The prior coefficients below
+come from benchmarks/bench_effects.py on a 4-core box; every finished
+render moves a per (media type, effect) correction factor toward
+actual / predicted, so the model follows the real hardware, encoder
+presets and load. Factors are kept in the disk cache across restarts.
+"""
+
+import os
+import logging
+import threading
+
+import metrics
+from disk_cache import read_cache, write_cache
+
+logger = logging.getLogger(__name__)
+
+# Worker seconds per output second, by effect (video and photo alike)
+EFFECT_SECONDS = {1: 0.15, 2: 0.45, 3: 0.3, 4: 0.15, 5: 0.25}
+DEFAULT_EFFECT_SECONDS = 0.3
+# Mezzanine: worker seconds per source megapixel per output second
+MEGAPIXEL_SECONDS = 0.02
+DEFAULT_PIXELS = 1280 * 720  # Source size before it is known
+START_SECONDS = 0.5  # Process start, probing, muxing
+
+# Weight of one finished render in its correction factor
+CALIBRATION_ALPHA = 0.2
+CALIBRATION_BOUNDS = (0.2, 10.0)
+CALIBRATION_CACHE = 'render_cost'
+SAVE_EVERY = 10
+
+class CostModel:
+    """predict() worker seconds for a render, record() what it really took"""
+
+    def __init__(self, cache_name=CALIBRATION_CACHE):
+        self._cache_name = cache_name
+        self._factors = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        cached = read_cache(cache_name) if cache_name else None
+        if isinstance(cached, dict):
+            self._factors = {key: float(value) for key, value in cached.items()}
+
+    @staticmethod
+    def _key(media_type, effect_type):
+        return f'{media_type}.{effect_type}'
+
+    @staticmethod
+    def _base(effect_type, duration, pixels, mezzanine_ready):
+        seconds = START_SECONDS + EFFECT_SECONDS.get(effect_type, DEFAULT_EFFECT_SECONDS) * duration
+        if not mezzanine_ready:
+            seconds += MEGAPIXEL_SECONDS * (pixels or DEFAULT_PIXELS) / 1e6 * duration
+        return seconds
+
+    def factor(self, media_type, effect_type):
+        return self._factors.get(self._key(media_type, effect_type), 1.0)
+
+    def predict(self, media_type, effect_type, duration, pixels=None, mezzanine_ready=False):
+        """Predicted worker seconds for rendering duration seconds of output
+
+        pixels is the source width*height (None if unknown); with
+        mezzanine_ready the session's mezzanine is already built.
+        """
+        base = self._base(effect_type, duration, pixels, mezzanine_ready)
+        return base * self.factor(media_type, effect_type)
+
+    def record(self, media_type, effect_type, duration, pixels, mezzanine_ready, seconds):
+        """Calibrate from a finished render that took seconds on its worker"""
+        base = self._base(effect_type, duration, pixels, mezzanine_ready)
+        low, high = CALIBRATION_BOUNDS
+        ratio = min(high, max(low, seconds / base))
+        key = self._key(media_type, effect_type)
+        with self._lock:
+            previous = self._factors.get(key, 1.0)
+            predicted = base * previous
+            factor = previous + CALIBRATION_ALPHA * (ratio - previous)
+            self._factors[key] = factor
+            self._unsaved += 1
+            save = self._cache_name and self._unsaved >= SAVE_EVERY
+            if save:
+                self._unsaved = 0
+                factors = dict(self._factors)
+        # Relative error of the prediction this render would have got
+        if seconds > 0:
+            metrics.observe('render_cost.error', abs(seconds - predicted) / seconds)
+        if save:
+            write_cache(self._cache_name, factors)
+        return factor
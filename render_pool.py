@@ -0,0 +1,221 @@
+"""Worker pool for ffmpeg renders
+
+Jobs are queued in lanes: premium and free users, plus background work
+(speculative renders) that only runs when nothing else waits. Premium
+and free lanes share worker starts by weight, a job that waited longer
+than MAX_QUEUE_WAIT goes next (free users can't starve behind a premium
+flood), and each user has at most one job running, so a user queueing
+several renders can't take every worker.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Each render is one ffmpeg process using several threads itself
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+
+LANE_PREMIUM = 'premium'
+LANE_FREE = 'free'
+LANE_BACKGROUND = 'background'
+LANES = (LANE_PREMIUM, LANE_FREE, LANE_BACKGROUND)
+
+# Share of workers when both lanes wait: premium gets 3 of every 4 starts
+LANE_WEIGHTS = {
+    LANE_PREMIUM: int(os.environ.get('RENDER_PREMIUM_WEIGHT', '3')),
+    LANE_FREE: 1
+}
+# A job waiting longer than this is started next, whatever its lane
+MAX_QUEUE_WAIT = float(os.environ.get('RENDER_MAX_QUEUE_WAIT', '30'))
+
+def system_load():
+    """1-minute load average per CPU core (0.0 if unavailable)"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'lane', 'user_id', 'enqueued_at', 'cost', 'started_at')
+
+    def __init__(self, fn, args, kwargs, lane, user_id, enqueued_at, cost=0.0):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.lane = lane
+        self.user_id = user_id
+        self.enqueued_at = enqueued_at
+        self.cost = cost  # Predicted worker seconds
+        self.started_at = None
+
+class RenderPool:
+    """Lane scheduler over a fixed set of worker threads
+
+    pending() counts queued and running jobs, like the thread pool this
+    replaced, so callers deciding on speculation or splitting still work.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, weights=None, max_wait=MAX_QUEUE_WAIT, clock=time.monotonic):
+        self.workers = workers
+        self.weights = weights or LANE_WEIGHTS
+        self.max_wait = max_wait
+        self._clock = clock
+        self._queues = {lane: deque() for lane in LANES}
+        self._credit = {lane: 0 for lane in self.weights}
+        self._last_aged = False
+        self._running_users = set()
+        self._running = set()
+        self._pending = 0
+        self._threads = []
+        self._cond = threading.Condition()
+        metrics.set_gauge('render_pool.pending', self.pending)
+        metrics.set_gauge('render_pool.backlog', self.backlog)
+        for lane in LANES:
+            metrics.set_gauge(f'render_pool.queued.{lane}', lambda lane=lane: len(self._queues[lane]))
+
+    def pending(self):
+        """Renders queued or running"""
+        return self._pending
+
+    def has_idle_worker(self):
+        return self._pending < self.workers
+
+    def queued(self, lane=None):
+        """Jobs waiting (not running) in lane, or in all lanes"""
+        with self._cond:
+            if lane is not None:
+                return len(self._queues[lane])
+            return sum(len(queue) for queue in self._queues.values())
+
+    def backlog(self, lane=LANE_FREE):
+        """Predicted worker seconds ahead of a job submitted to lane now
+
+        Remaining work of running jobs, the lane's queue, and the part of
+        other weighted lanes' queues that the weights let start first.
+        Background jobs wait for everything. Uses submit()'s cost.
+        """
+        now = self._clock()
+        with self._cond:
+            ahead = sum(max(0.0, job.cost - (now - job.started_at)) for job in self._running)
+            for other, queue in self._queues.items():
+                work = sum(job.cost for job in queue)
+                if other == lane or lane not in self.weights:
+                    ahead += work
+                elif other in self.weights:
+                    ahead += work * min(1.0, self.weights[other] / self.weights[lane])
+            return ahead
+
+    def submit(self, fn, *args, lane=LANE_FREE, user_id=None, cost=0.0, **kwargs):
+        """Queue render in lane, return Future
+
+        Jobs of the same user_id run one at a time, in submit order. cost
+        (predicted worker seconds) only feeds backlog().
+        """
+        job = _Job(fn, args, kwargs, lane, user_id, self._clock(), cost)
+        with self._cond:
+            self._ensure_started()
+            self._pending += 1
+            self._queues[lane].append(job)
+            self._cond.notify()
+        job.future.add_done_callback(lambda future: self._drop_cancelled(job))
+        return job.future
+
+    def _drop_cancelled(self, job):
+        """Take a cancelled job out of its queue right away"""
+        if not job.future.cancelled():
+            return
+        with self._cond:
+            # Not queued any more if a worker already took it (and counted it)
+            if job in self._queues[job.lane]:
+                self._queues[job.lane].remove(job)
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def _ensure_started(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'render_{len(self._threads)}', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _first_runnable(self, lane):
+        """Oldest job in lane whose user has nothing running"""
+        for job in self._queues[lane]:
+            if job.user_id is None or job.user_id not in self._running_users:
+                return job
+        return None
+
+    def _next_job(self):
+        """Pick the next job to start, or None if nothing can start now"""
+        candidates = {lane: self._first_runnable(lane) for lane in LANES}
+        candidates = {lane: job for lane, job in candidates.items() if job is not None}
+        if not candidates:
+            return None
+
+        # Starvation guard: a job waiting too long goes first, but at most
+        # every other start, so a backlog doesn't turn the lanes into FIFO
+        weighted = [lane for lane in self.weights if lane in candidates]
+        if weighted and not self._last_aged:
+            oldest = min((candidates[lane] for lane in weighted), key=lambda job: job.enqueued_at)
+            if self._clock() - oldest.enqueued_at >= self.max_wait:
+                self._last_aged = True
+                metrics.incr(f'render_pool.aged.{oldest.lane}')
+                return oldest
+        self._last_aged = False
+
+        # Smooth weighted round robin among weighted lanes with work
+        if weighted:
+            total = sum(self.weights[lane] for lane in weighted)
+            for lane in weighted:
+                self._credit[lane] += self.weights[lane]
+            chosen = max(weighted, key=lambda lane: self._credit[lane])
+            self._credit[chosen] -= total
+            return candidates[chosen]
+
+        # Background jobs only when no user is waiting
+        if not any(self._queues[lane] for lane in self.weights):
+            return candidates.get(LANE_BACKGROUND)
+        return None
+
+    def _take(self):
+        with self._cond:
+            while True:
+                job = self._next_job()
+                if job is not None:
+                    self._queues[job.lane].remove(job)
+                    if not job.future.set_running_or_notify_cancel():
+                        self._pending -= 1
+                        continue
+                    if job.user_id is not None:
+                        self._running_users.add(job.user_id)
+                    job.started_at = self._clock()
+                    self._running.add(job)
+                    metrics.observe(f'render_pool.wait.{job.lane}', self._clock() - job.enqueued_at)
+                    return job
+                # Woken by submit or by a finished job freeing its user;
+                # the timeout re-checks waiting times for the starvation guard
+                waiting = any(self._queues.values())
+                self._cond.wait(timeout=1.0 if waiting else None)
+
+    def _work(self):
+        while True:
+            job = self._take()
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except BaseException as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+            finally:
+                with self._cond:
+                    self._pending -= 1
+                    self._running_users.discard(job.user_id)
+                    self._running.discard(job)
+                    self._cond.notify_all()
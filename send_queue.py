@@ -0,0 +1,287 @@
+"""Outbound Telegram API scheduler with global and per-chat rate limits"""
+
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_RESULT = 0        # Finished kruzhoks and files the user waits for
+PRIORITY_INTERACTIVE = 1   # Replies and edits to what the user just did
+PRIORITY_NOTIFICATION = 2  # Fire-and-forget notices (payments, referrals)
+PRIORITY_BULK = 3          # Broadcasts
+
+PRIORITY_NAMES = {
+    PRIORITY_RESULT: 'result',
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_NOTIFICATION: 'notification',
+    PRIORITY_BULK: 'bulk'
+}
+
+# Bot API limits: ~30 messages/s overall, ~1 message/s per private chat
+# (short bursts tolerated), 20 messages/minute per group
+GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', '30'))
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 5
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 3
+
+SEND_WORKERS = int(os.environ.get('SEND_WORKERS', '8'))
+SEND_QUEUE_MAX = int(os.environ.get('SEND_QUEUE_MAX', '5000'))
+MAX_SEND_ATTEMPTS = 5
+MAX_CHAT_BUCKETS = 10000
+
+def get_retry_after(error):
+    """Return retry_after seconds for a 429 error, None for other errors"""
+    if isinstance(error, ApiTelegramException) and error.error_code == 429:
+        parameters = (error.result_json or {}).get('parameters') or {}
+        return parameters.get('retry_after', 1)
+    return None
+
+class SendQueueFull(Exception):
+    """Raised when a send is dropped because the queue is full"""
+
+class _SendItem:
+    __slots__ = ('priority', 'seq', 'chat_id', 'fn', 'args', 'kwargs',
+                 'future', 'attempts', 'not_before', 'enqueued_at')
+
+    def __init__(self, priority, seq, chat_id, fn, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+        self.not_before = 0.0
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class SendQueue:
+    """Priority queue of API calls, dispatched within global and per-chat limits"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, workers=SEND_WORKERS, max_size=SEND_QUEUE_MAX):
+        self.max_size = max_size
+        self.workers = workers
+        self._global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets = OrderedDict()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = None
+        self._dispatcher = None
+        self._stopped = False
+
+        metrics.set_gauge('send_queue.depth', self.depth)
+
+    def depth(self):
+        """Number of queued (not yet dispatched) calls"""
+        return len(self._heap)
+
+    def _ensure_started(self):
+        if self._dispatcher is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='send')
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='send-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id is not None and chat_id < 0:
+                bucket = TokenBucket(GROUP_CHAT_RATE, capacity=GROUP_CHAT_BURST)
+            else:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, capacity=PRIVATE_CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def submit(self, chat_id, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Queue fn(*args, **kwargs) for chat_id, return Future with its result"""
+        item = _SendItem(priority, next(self._seq), chat_id, fn, args, kwargs)
+        with self._cond:
+            if self._stopped or len(self._heap) >= self.max_size:
+                metrics.incr(f"send_queue.dropped.{PRIORITY_NAMES.get(priority, priority)}")
+                item.future.set_exception(SendQueueFull(f"Send queue full ({len(self._heap)})"))
+                return item.future
+            self._ensure_started()
+            heapq.heappush(self._heap, item)
+            self._cond.notify()
+        return item.future
+
+    def call(self, chat_id, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Queue call and wait for its result (raises the call's exception)"""
+        return self.submit(chat_id, fn, *args, priority=priority, **kwargs).result()
+
+    def _next_ready(self):
+        """Pop highest-priority item whose chat may send now; else (None, wait)"""
+        now = time.monotonic()
+        deferred = []
+        chosen = None
+        wait = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            if item.future.cancelled():
+                continue
+            delay = item.not_before - now
+            if delay <= 0:
+                delay = self._chat_bucket(item.chat_id).delay_for()
+            if delay <= 0:
+                chosen = item
+                break
+            deferred.append(item)
+            wait = delay if wait is None else min(wait, delay)
+        for item in deferred:
+            heapq.heappush(self._heap, item)
+        return chosen, wait
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._heap:
+                    return
+                item, wait = self._next_ready()
+                if item is None:
+                    self._cond.wait(wait)
+                    continue
+
+            self._global_bucket.acquire()
+            # Retried items are already running
+            if item.attempts == 0 and not item.future.set_running_or_notify_cancel():
+                continue
+            metrics.observe(
+                f"send_queue.wait.{PRIORITY_NAMES.get(item.priority, item.priority)}",
+                time.monotonic() - item.enqueued_at
+            )
+            self._executor.submit(self._execute, item)
+
+    def _requeue(self, item, delay):
+        item.attempts += 1
+        item.not_before = time.monotonic() + delay
+        # Uploads read file objects; rewind them for the retry
+        for value in list(item.args) + list(item.kwargs.values()):
+            if hasattr(value, 'seek'):
+                value.seek(0)
+        with self._cond:
+            heapq.heappush(self._heap, item)
+            self._cond.notify()
+
+    def _execute(self, item):
+        started = time.monotonic()
+        try:
+            result = item.fn(*item.args, **item.kwargs)
+        except Exception as e:
+            retry_after = get_retry_after(e)
+            if retry_after is not None and item.attempts + 1 < MAX_SEND_ATTEMPTS:
+                logger.warning(f"429 for chat {item.chat_id}, retrying in {retry_after}s")
+                metrics.incr('send_queue.retry_after')
+                with self._cond:
+                    bucket = self._chat_bucket(item.chat_id)
+                bucket.block_for(retry_after)
+                # Flood limits are per bot too; other chats must wait as well
+                self._global_bucket.block_for(retry_after)
+                self._requeue(item, retry_after)
+                return
+            metrics.incr('send_queue.failed')
+            item.future.set_exception(e)
+            return
+        finally:
+            metrics.observe('send_queue.call', time.monotonic() - started)
+
+        metrics.incr('send_queue.sent')
+        item.future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """Stop after draining queued calls"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._dispatcher is not None and wait:
+            self._dispatcher.join()
+            self._executor.shutdown(wait=True)
+
+# Bot methods sent through the queue: method -> (default priority, chat_id arg index)
+QUEUED_METHODS = {
+    'send_video_note': (PRIORITY_RESULT, 0),
+    'send_document': (PRIORITY_RESULT, 0),
+    'send_message': (PRIORITY_INTERACTIVE, 0),
+    'send_photo': (PRIORITY_INTERACTIVE, 0),
+    'reply_to': (PRIORITY_INTERACTIVE, None),
+    'edit_message_text': (PRIORITY_INTERACTIVE, 1),
+    'edit_message_caption': (PRIORITY_INTERACTIVE, 1),
+    'edit_message_reply_markup': (PRIORITY_INTERACTIVE, 0),
+    'delete_message': (PRIORITY_INTERACTIVE, 0),
+    'copy_message': (PRIORITY_BULK, 0)
+}
+
+class QueuedBot:
+    """Bot proxy that routes sending methods through a SendQueue
+
+    Queued methods block until sent and accept an extra `priority` keyword.
+    Everything else (handlers, get_file, answer_callback_query...) goes
+    straight to the wrapped bot.
+    """
+
+    def __init__(self, bot, queue):
+        self._bot = bot
+        self.send_queue = queue
+
+    def __getattr__(self, name):
+        if name not in QUEUED_METHODS:
+            return getattr(self._bot, name)
+
+        default_priority, chat_index = QUEUED_METHODS[name]
+
+        def queued(*args, priority=None, **kwargs):
+            if chat_index is None:
+                chat_id = args[0].chat.id  # reply_to(message, ...)
+            elif 'chat_id' in kwargs:
+                chat_id = kwargs['chat_id']
+            else:
+                chat_id = args[chat_index]
+            method = getattr(self._bot, name)
+            return self.send_queue.call(
+                chat_id, method, *args,
+                priority=default_priority if priority is None else priority,
+                **kwargs
+            )
+
+        return queued
+
+    def send_later(self, name, *args, priority=PRIORITY_NOTIFICATION, **kwargs):
+        """Queue a sending method without waiting; failures are logged"""
+        _, chat_index = QUEUED_METHODS[name]
+        chat_id = args[0].chat.id if chat_index is None else args[chat_index]
+        future = self.send_queue.submit(
+            chat_id, getattr(self._bot, name), *args,
+            priority=priority, **kwargs
+        )
+
+        def log_failure(done):
+            if not done.cancelled() and done.exception() is not None:
+                logger.warning(f"{name} to {chat_id} failed: {done.exception()}")
+
+        future.add_done_callback(log_failure)
+        return future
+
+    def notify(self, chat_id, text, **kwargs):
+        """Queue a low-priority message to chat_id without waiting"""
+        return self.send_later('send_message', chat_id, text, **kwargs)
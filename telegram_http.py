@@ -0,0 +1,142 @@
+"""Shared keep-alive HTTP session for Bot API and file downloads"""
+
+import os
+import logging
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from telebot import apihelper
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Max pooled connections per host (api.telegram.org); uploads and downloads
+# from concurrent renders each hold one while transferring
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '32'))
+
+# Self-hosted telegram-bot-api server, e.g. http://127.0.0.1:8081
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '').rstrip('/')
+# Server runs with --local: getFile returns absolute paths, uploads may use file://
+TELEGRAM_LOCAL_MODE = os.environ.get('TELEGRAM_LOCAL_MODE', '').lower() in ('1', 'true', 'yes')
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# (connect, read) seconds; read is the longest gap between chunks, so a
+# stalled transfer fails instead of hanging its thread forever
+DOWNLOAD_TIMEOUT = (
+    float(os.environ.get('DOWNLOAD_CONNECT_TIMEOUT', '10')),
+    float(os.environ.get('DOWNLOAD_READ_TIMEOUT', '30'))
+)
+
+_session = None
+
+# Long polling stays open by design, its latency is not interesting
+UNTIMED_ENDPOINTS = {'getUpdates'}
+
+def endpoint_name(url):
+    """Get Bot API method name (or 'file' for downloads) from request URL"""
+    path = urlsplit(url).path
+    if path.startswith('/file/'):
+        return 'file'
+    return path.rsplit('/', 1)[-1]
+
+def _record_latency(response, *args, **kwargs):
+    endpoint = endpoint_name(response.url)
+    if endpoint not in UNTIMED_ENDPOINTS:
+        metrics.observe(f"telegram_api.{endpoint}", response.elapsed.total_seconds())
+    if response.status_code != 200:
+        metrics.incr(f"telegram_api.http_{response.status_code}")
+
+def build_session(pool_size=HTTP_POOL_SIZE):
+    """Create requests session with a tuned keep-alive connection pool"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    session.hooks['response'].append(_record_latency)
+    return session
+
+def install_session(pool_size=HTTP_POOL_SIZE):
+    """Make telebot use one shared pooled session in every thread"""
+    global _session
+    session = _session = build_session(pool_size)
+    apihelper.session = session
+    apihelper.SESSION_TIME_TO_LIVE = None  # Keep connections alive for process lifetime
+    logger.info(f"HTTP session installed (pool size {pool_size})")
+    return session
+
+def get_session():
+    """Get shared session, installing it if needed"""
+    return _session or install_session()
+
+def configure_api_server(api_url=TELEGRAM_API_URL):
+    """Point telebot at a self-hosted Bot API server if configured"""
+    if not api_url:
+        return
+    apihelper.API_URL = api_url + "/bot{0}/{1}"
+    apihelper.FILE_URL = api_url + "/file/bot{0}/{1}"
+    logger.info(f"Using Bot API server {api_url} (local mode: {TELEGRAM_LOCAL_MODE})")
+
+def file_url(token, file_path):
+    """Download URL for a getFile path"""
+    if apihelper.FILE_URL:
+        return apihelper.FILE_URL.format(token, file_path)
+    return f"https://api.telegram.org/file/bot{token}/{file_path}"
+
+def fetch_file(bot, file_id, suffix='', local_mode=None):
+    """Make a Telegram file available on local disk
+    
+    Returns (path, owned). With a local Bot API server the server's own copy
+    is used directly (owned=False, must not be deleted); otherwise the file
+    is streamed to a new temp file (owned=True).
+    """
+    if local_mode is None:
+        local_mode = TELEGRAM_LOCAL_MODE
+    
+    file_info = bot.get_file(file_id)
+    if local_mode and os.path.isabs(file_info.file_path) and os.path.exists(file_info.file_path):
+        metrics.incr('files.local_path')
+        return file_info.file_path, False
+    
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            response = get_session().get(
+                file_url(bot.token, file_info.file_path), stream=True, timeout=DOWNLOAD_TIMEOUT
+            )
+            with response:
+                response.raise_for_status()
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+    except Exception as e:
+        os.unlink(path)
+        # A stall mid-body surfaces as ConnectionError; report both as Timeout
+        if isinstance(e, requests.Timeout) or (
+                isinstance(e, requests.ConnectionError) and e.args and isinstance(e.args[0], ReadTimeoutError)):
+            metrics.incr('files.download_timeout')
+            raise requests.Timeout(f"Download of {file_id} stalled: {e}") from e
+        raise
+    
+    metrics.incr('files.downloaded')
+    return path, True
+
+@contextmanager
+def upload_source(path, local_mode=None):
+    """Yield what to pass as file argument when uploading path
+    
+    A local Bot API server reads file:// paths itself, so nothing is copied
+    over HTTP; otherwise the file is opened for a multipart upload.
+    """
+    if local_mode is None:
+        local_mode = TELEGRAM_LOCAL_MODE
+    
+    if local_mode:
+        yield f"file://{os.path.abspath(path)}"
+    else:
+        with open(path, 'rb') as f:
+            yield f
@@ -71,4 +71,69 @@ def test_bot_functions():
     return True
 
 if __name__ == "__main__":
-    test_bot_functions()
\ No newline at end of file
+    test_bot_functions()
+
+def test_payment_notices_for_non_uz_user(monkeypatch):
+    """Approve/reject notices exist in every language"""
+    import main
+    import models
+
+    models.ensure_schema()
+    notices = []
+    monkeypatch.setattr(main.bot, 'notify', lambda user_id, text: notices.append((user_id, text)))
+    models.set_user_language(8101, 'u', 'U', 'ru')
+    models.set_user_language(8102, 'u', 'U', 'en')
+
+    approved = models.approve_payment(
+        models.create_payment_request(8101, 'u', 'U', 5000, 'weekly', 'r1').id
+    )
+    rejected = models.reject_payment(
+        models.create_payment_request(8102, 'u', 'U', 5000, 'weekly', 'r2').id, 'blurry'
+    )
+    main.notify_payment_approved([approved])
+    main.notify_payment_rejected(rejected, 'blurry')
+
+    assert notices == [
+        (8101, main.MESSAGES['ru']['payment_approved']),
+        (8102, main.MESSAGES['en']['payment_rejected'].format(reason='blurry'))
+    ]
+    # Keys without a translation fall back to Uzbek
+    assert main.get_user_messages(8101)['payment_received'] == main.MESSAGES['uz']['payment_received']
+
+
+def test_broadcast_waits_for_confirm(monkeypatch):
+    """/broadcast previews the message; only one confirm tap starts the job"""
+    import types
+    import main
+    import models
+
+    models.ensure_schema()
+    calls = []
+    started = []
+    monkeypatch.setattr(main, 'is_admin', lambda user_id: True)
+    # No token here: stand in for the whole bot, handlers look it up at call time
+    monkeypatch.setattr(main, 'bot', types.SimpleNamespace(
+        copy_message=lambda *args, **kwargs: calls.append(('copy', args)),
+        send_message=lambda *args, **kwargs: calls.append(('send', args)),
+        edit_message_text=lambda text, *args, **kwargs: calls.append(('edit', text)),
+        answer_callback_query=lambda call_id, text=None: calls.append(('answer', text)),
+        reply_to=lambda *args, **kwargs: calls.append(('reply', args))
+    ))
+    monkeypatch.setattr(main.broadcaster, 'start', started.append)
+
+    chat = types.SimpleNamespace(id=900)
+    admin = types.SimpleNamespace(id=900)
+    main.process_broadcast_message(types.SimpleNamespace(text='Hello', chat=chat, from_user=admin, message_id=55))
+    assert calls[0] == ('copy', (900, 900, 55))
+    assert started == []
+
+    confirm = types.SimpleNamespace(
+        id='c1', data='bcast:ok:55', from_user=admin,
+        message=types.SimpleNamespace(chat=chat, message_id=56)
+    )
+    main.handle_broadcast_confirm_callback(confirm)
+    main.handle_broadcast_confirm_callback(confirm)
+
+    assert len(started) == 1
+    assert started[0].source_message_id == 55 and started[0].status_message_id == 56
+    assert calls[-1] == ('answer', "⚠️ Allaqachon ko'rib chiqilgan")
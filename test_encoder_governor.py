@@ -0,0 +1,77 @@
+"""Tests for the load-adaptive encoder governor"""
+
+import encoder_governor
+from encoder_governor import EncoderGovernor, load_ladder, DEFAULT_LADDER
+
+LADDER = [('medium', 21, 0), ('fast', 23, 0), ('veryfast', 26, 2)]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_governor(depth, workers=2):
+    clock = Clock()
+    governor = EncoderGovernor(lambda: depth[0], workers, ladder=LADDER, level=1,
+                               target_latency=10, clock=clock)
+    return governor, clock
+
+
+def test_steps_up_under_queue_depth_and_holds_within_interval():
+    depth = [5]
+    governor, clock = make_governor(depth)
+
+    clock.now += encoder_governor.UP_INTERVAL
+    assert governor.choose(job='user 1')['preset'] == 'veryfast'
+    assert governor.level == 2
+
+    # Already at the fastest rung
+    clock.now += encoder_governor.UP_INTERVAL
+    assert governor.choose()['threads'] == 2
+
+
+def test_steps_down_only_after_load_stays_low():
+    depth = [5]
+    governor, clock = make_governor(depth)
+    clock.now += encoder_governor.UP_INTERVAL
+    governor.choose()
+
+    depth[0] = 0
+    clock.now += encoder_governor.DOWN_INTERVAL - 1
+    assert governor.choose()['preset'] == 'veryfast'
+    clock.now += 1
+    assert governor.choose()['preset'] == 'fast'
+
+
+def test_slow_renders_raise_pressure():
+    governor, clock = make_governor([0])
+    for _ in range(10):
+        governor.record(25.0)
+    assert governor.pressure() == 2.5
+
+    clock.now += encoder_governor.UP_INTERVAL
+    assert governor.choose() == {'preset': 'veryfast', 'crf': 26, 'threads': 2}
+
+
+def test_old_latencies_expire_and_idle_recovers_quality():
+    governor, clock = make_governor([0])
+    for _ in range(20):
+        governor.record(60.0)
+    assert governor.pressure() == 6.0
+
+    clock.now += encoder_governor.LATENCY_MAX_AGE + 1
+    assert governor.pressure() == 0.0
+    clock.now += encoder_governor.DOWN_INTERVAL
+    assert governor.choose()['preset'] == 'medium'
+
+
+def test_load_ladder_from_env(monkeypatch):
+    monkeypatch.setenv('ENCODER_LADDER', '[["slow", 20, 0], ["superfast", 27, 1]]')
+    assert load_ladder() == [('slow', 20, 0), ('superfast', 27, 1)]
+
+    monkeypatch.setenv('ENCODER_LADDER', 'not json')
+    assert load_ladder() == DEFAULT_LADDER
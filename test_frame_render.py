@@ -0,0 +1,49 @@
+"""Tests for the NumPy/Pillow photo renderer"""
+
+import shutil
+
+import pytest
+
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+import frame_render
+
+
+def make_image(size=48):
+    gradient = np.linspace(0, 255, size, dtype=np.uint8)
+    pixels = np.stack(np.broadcast_arrays(gradient[None, :], gradient[:, None], 128), axis=-1)
+    return Image.fromarray(np.ascontiguousarray(pixels, dtype=np.uint8), 'RGB')
+
+
+def test_static_effects_compute_one_frame():
+    image = make_image()
+    for effect_type in (1, 3):
+        frames = list(frame_render.effect_frames(image, effect_type, 10, 25))
+        assert len(frames) == 10
+        assert all(frame is frames[0] for frame in frames)
+        assert len(frames[0]) == 48 * 48 * 3
+
+
+def test_animated_effects_change_every_frame():
+    image = make_image()
+    for effect_type in (2, 4, 5):
+        frames = list(frame_render.effect_frames(image, effect_type, 5, 25))
+        assert all(len(frame) == 48 * 48 * 3 for frame in frames)
+        assert frames[1] != frames[4]
+
+
+def test_hue_keeps_grey_and_brightness():
+    grey = Image.new('RGB', (8, 8), (100, 100, 100))
+    for frame in frame_render.hue_frames(grey, 40, 25):
+        assert np.abs(frame.astype(int) - 100).max() <= 1
+
+
+@pytest.mark.skipif(not shutil.which('ffmpeg'), reason='ffmpeg not installed')
+def test_render_photo_encodes_all_frames(tmp_path):
+    source = tmp_path / 'photo.bmp'
+    make_image(480).save(source)
+    output = tmp_path / 'out.mp4'
+
+    assert frame_render.render_photo(str(source), str(output), 4, duration=1, fps=25)
+    assert output.stat().st_size > 0
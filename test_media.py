@@ -0,0 +1,180 @@
+"""Tests for ffmpeg command building (ffmpeg itself is not run)"""
+
+import os
+import subprocess
+from types import SimpleNamespace
+
+import media
+
+
+def capture_ffmpeg(monkeypatch, fail=False):
+    commands = []
+
+    def fake_run_ffmpeg(cmd, cancel_event=None, nice=0, progress=None):
+        commands.append(cmd)
+        if fail:
+            raise subprocess.CalledProcessError(1, cmd, stderr='boom')
+
+    monkeypatch.setattr(media, 'run_ffmpeg', fake_run_ffmpeg)
+    return commands
+
+
+def test_only_mezzanine_scales_the_source(monkeypatch):
+    commands = capture_ffmpeg(monkeypatch)
+    mezzanine = media.make_mezzanine('video', 'source.mp4')
+    try:
+        for effect_type in media.VIDEO_EFFECT_FILTERS:
+            assert media.render_media('video', mezzanine, 'out.mp4', effect_type)
+    finally:
+        media.cleanup_file(mezzanine)
+
+    mezzanine_cmd, *effect_cmds = commands
+    vf = mezzanine_cmd[mezzanine_cmd.index('-vf') + 1]
+    assert vf.startswith(media.NORMALIZE_FILTER)
+    assert f'fps={media.MEZZANINE_FPS}' in vf
+    for cmd in effect_cmds:
+        assert cmd[cmd.index('-i') + 1] == mezzanine
+        assert 'scale=' not in cmd[cmd.index('-vf') + 1]
+
+
+def test_zoompan_keeps_kruzhok_size():
+    for filters in (media.VIDEO_EFFECT_FILTERS, media.PHOTO_EFFECT_FILTERS):
+        assert ':s=480x480' in media.effect_filter(filters, 2)
+    assert media.effect_filter(media.VIDEO_EFFECT_FILTERS, 99) == 'format=yuv420p'
+
+
+def test_failed_mezzanine_is_removed(monkeypatch):
+    commands = capture_ffmpeg(monkeypatch, fail=True)
+    try:
+        media.make_mezzanine('photo', 'source.jpg')
+    except subprocess.CalledProcessError:
+        pass
+    else:
+        raise AssertionError('expected ffmpeg error')
+
+    assert not os.path.exists(commands[0][-1])
+
+
+def test_split_points_cover_all_frames():
+    assert media.split_points(10, 4) == [(0, 3), (3, 3), (6, 3), (9, 1)]
+    assert media.split_points(900, 4) == [(0, 225), (225, 225), (450, 225), (675, 225)]
+
+
+def test_split_segments_continue_effect_time(monkeypatch):
+    commands = capture_ffmpeg(monkeypatch)
+    assert media.render_media('video', 'mezzanine.mkv', 'out.mp4', 4, segments=3, duration=30.0)
+
+    *segment_cmds, concat_cmd = commands
+    segment_cmds.sort(key=lambda cmd: float(cmd[cmd.index('-ss') + 1]))  # Encoded in parallel
+    assert [cmd[cmd.index('-ss') + 1] for cmd in segment_cmds] == ['0.000000', '10.000000', '20.000000']
+    assert 'hue=h=sin(2*PI*(t+10.000000))' in segment_cmds[1][segment_cmds[1].index('-vf') + 1]
+    assert all('-an' in cmd for cmd in segment_cmds)
+    assert concat_cmd[concat_cmd.index('-f') + 1] == 'concat'
+    assert concat_cmd[concat_cmd.index('-c:v') + 1] == 'copy'
+
+
+def test_short_video_is_not_split(monkeypatch):
+    commands = capture_ffmpeg(monkeypatch)
+    assert media.render_media('video', 'mezzanine.mkv', 'out.mp4', 1, segments=4, duration=5.0)
+    assert len(commands) == 1
+
+
+def test_plain_source_gets_plain_decode():
+    info = media.MediaInfo(codec='h264', width=720, height=1280, fps=30.0,
+                           color_transfer='bt709', duration=12.0)
+    input_args, filters = media.plan_decode(info, fps=30)
+    assert input_args == []
+    assert filters == [media.NORMALIZE_FILTER, 'fps=30']
+
+
+def test_4k_hdr_60fps_long_source(monkeypatch):
+    monkeypatch.setattr(media, 'has_filter', lambda name: True)
+    info = media.MediaInfo(codec='h264', width=3840, height=2160, fps=59.94,
+                           color_transfer='arib-std-b67', duration=95.0)
+    input_args, filters = media.plan_decode(info, fps=30)
+    assert input_args == ['-skip_loop_filter', 'all', '-t', '60.0']
+    assert filters == ['fps=30', media.NORMALIZE_FILTER, media.TONEMAP_FILTER]
+
+
+def test_large_jpeg_is_downscaled_by_decoder():
+    info = media.MediaInfo(codec='mjpeg', width=4000, height=3000)
+    assert media.plan_decode(info) == (['-lowres', '2'], [media.NORMALIZE_FILTER])
+    assert media.lowres_factor(media.MediaInfo(codec='mjpeg', width=800, height=600)) == 0
+
+
+def test_media_info_from_ffprobe():
+    data = {
+        'format': {'duration': '75.5'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'hevc', 'width': 3840, 'height': 2160,
+             'avg_frame_rate': '60000/1001', 'color_transfer': 'smpte2084',
+             'side_data_list': [{'rotation': -90}]},
+            {'codec_type': 'audio', 'codec_name': 'aac'}
+        ]
+    }
+    info = media.MediaInfo.from_ffprobe(data)
+    assert (info.codec, info.rotation, info.has_audio) == ('hevc', 270, True)
+    assert round(info.fps, 2) == 59.94
+    assert info.display_size == (2160, 3840)
+    assert info.output_duration('video') == 60.0
+    assert info.output_duration('photo') == media.PHOTO_DURATION
+
+
+def test_telegram_metadata_skips_probe_only_when_enough():
+    photo = SimpleNamespace(width=1280, height=960)
+    assert media.MediaInfo.from_telegram('photo', photo).codec == 'mjpeg'
+
+    compressed = SimpleNamespace(mime_type='video/mp4', width=720, height=1280, duration=14)
+    assert media.MediaInfo.from_telegram('video', compressed).duration == 14.0
+
+    original = SimpleNamespace(mime_type='video/quicktime', width=2160, height=3840, duration=14)
+    assert media.MediaInfo.from_telegram('video', original) is None
+
+
+def test_size_targeted_caps_bitrate_and_sets_audio(monkeypatch):
+    monkeypatch.setattr(media, 'OUTPUT_KBPS', 1000)
+    encoder = media.size_targeted(media.DEFAULT_ENCODER, 30, audio=(64, 1))
+    assert encoder['crf'] == 23
+    # Video at maxrate plus a full buffer plus audio stays within the budget
+    kbits = (encoder['maxrate'] * 30 + encoder['bufsize'] + 64 * 30) * (1 + media.MUX_OVERHEAD)
+    assert kbits * 1000 / 8 <= media.output_budget(30)
+    assert encoder['bufsize'] == encoder['maxrate'] * media.VBV_BUFFER_SECONDS
+
+    args = media.x264_args(encoder)
+    assert args[args.index('-maxrate') + 1] == f"{encoder['maxrate']}k"
+    assert media.audio_args(encoder) == ['-c:a', 'aac', '-b:a', '64k', '-ar', '44100', '-ac', '1']
+    assert media.audio_args(media.size_targeted(None, 30, audio=(0, 0))) == ['-an']
+
+    # Long outputs are held to the byte cap
+    monkeypatch.setattr(media, 'OUTPUT_MAX_BYTES', 1_000_000)
+    assert media.output_budget(60) == 1_000_000
+
+
+def test_audio_chosen_by_content(monkeypatch):
+    log = (
+        "[Parsed_astats_1 @ 0x1] Channel: 1\n"
+        "[Parsed_astats_1 @ 0x1] Peak level dB: -12.5\n"
+        "[Parsed_astats_1 @ 0x1] Channel: 2\n"
+        "[Parsed_astats_1 @ 0x1] Peak level dB: -inf\n"
+        "[Parsed_astats_1 @ 0x1] Overall\n"
+        "[Parsed_astats_1 @ 0x1] Peak level dB: -12.5\n"
+    )
+    monkeypatch.setattr(media, 'run_ffmpeg', lambda cmd, cancel_event=None, nice=0: log)
+    levels = media.audio_levels('mezzanine.mkv')
+    assert levels == (-12.5, float('-inf'))
+
+    assert media.choose_audio(levels) == (media.AUDIO_KBPS[1], 1)
+    assert media.choose_audio((-12.5, -15.0)) == (media.AUDIO_KBPS[2], 2)
+    assert media.choose_audio((-80.0, -90.0)) == (0, 0)
+    assert media.choose_audio(None) == media.DEFAULT_AUDIO
+
+
+def test_progress_pipe_is_parsed(monkeypatch):
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, 'w') as f:
+        f.write("frame=0\nout_time_us=N/A\nprogress=continue\n"
+                "frame=45\nout_time_us=1500000\nspeed=3x\nprogress=continue\n"
+                "out_time_us=2000000\nprogress=end\n")
+    seen = []
+    media._read_progress(read_fd, seen.append)
+    assert seen == [0.0, 1.5, 2.0]
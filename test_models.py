@@ -0,0 +1,105 @@
+"""Tests for database helpers on the embedded SQLite backend"""
+
+import models
+
+
+def setup_module(module):
+    models.ensure_schema()
+
+
+def test_ensure_schema_is_cached():
+    assert models.ensure_schema() is False
+
+
+def test_server_database_schema_is_not_cached(monkeypatch):
+    # A database recreated behind the same URL must get its tables back
+    monkeypatch.setattr(models, 'DATABASE_URL', 'postgresql://bot@db/kruzhok')
+    assert models._schema_cache_key() is None
+
+
+def test_sqlite_runs_in_wal_mode():
+    with models.engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+    assert mode.lower() == 'wal'
+
+
+def test_set_user_language_upserts():
+    assert models.set_user_language(1001, 'u', 'User', 'ru')
+    assert models.set_user_language(1001, 'u2', 'User', 'en')
+    assert models.get_user_language(1001) == 'en'
+    assert models.get_admin_counts()['total_users'] >= 1
+
+
+def test_get_or_create_user_subscription_is_idempotent():
+    first = models.get_or_create_user_subscription(2001, 'a', 'A')
+    second = models.get_or_create_user_subscription(2001, 'a', 'A')
+    assert first.id == second.id
+    assert second.daily_limit == 5
+
+
+def test_referral_stats_aggregate():
+    assert models.add_referral(3001, 3002)
+    assert models.add_referral(3001, 3003)
+    assert not models.add_referral(3001, 3003)
+    stats = models.get_referral_stats(3001)
+    assert stats == {'total_referrals': 2, 'total_bonus_kruzhoks': 6}
+    assert models.get_referral_stats(9999) == {'total_referrals': 0, 'total_bonus_kruzhoks': 0}
+
+
+def test_csv_export_streams_all_rows(tmp_path):
+    import csv
+    import gzip
+    from export import write_csv_export
+
+    for i in range(5):
+        models.save_user_history(4000 + i, None, 'U', f'file{i}', 'video', 1, 'Oddiy')
+    output = tmp_path / 'history.csv.gz'
+    row_count = write_csv_export('history', str(output), batch_size=2)
+    with gzip.open(output, 'rt', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert rows[0][:2] == ['id', 'user_id']
+    assert len(rows) - 1 == row_count >= 5
+
+
+def test_pending_payments_keyset_pages_and_bulk_approve():
+    ids = [models.create_payment_request(5000 + i, 'u', 'U', 5000, 'weekly', f'r{i}').id
+           for i in range(7)]
+    seen = []
+    after = None
+    while True:
+        page, has_more = models.get_pending_payments_page(limit=3, after=after)
+        seen.extend(p.id for p in page)
+        if not has_more:
+            break
+        after = (page[-1].created_at, page[-1].id)
+    assert set(ids) <= set(seen)
+    assert len(seen) == len(set(seen))
+
+    approved = models.approve_payments(ids[:4])
+    assert [p.id for p in approved] == ids[:4]
+    assert all(p.status == 'approved' for p in approved)
+    assert models.approve_payments(ids[:4]) == []
+    assert models.get_user_limits(5000)['is_premium']
+
+
+def test_favourite_effect_per_user_and_global():
+    for effect in (3, 3, 5):
+        models.save_user_history(6001, None, 'U', 'f', 'video', effect, 'E')
+    assert models.get_favourite_effect(6001) == 3
+    assert models.get_favourite_effect(6999) is None
+    assert models.get_favourite_effect() is not None
+
+
+def test_bulk_approve_two_payments_of_new_user():
+    ids = [models.create_payment_request(7001, 'u', 'U', 5000, plan, f'r{plan}').id
+           for plan in ('weekly', 'monthly')]
+    approved = models.approve_payments(ids)
+    assert [p.id for p in approved] == ids
+    assert models.get_user_limits(7001)['is_premium']
+
+
+def test_processed_payment_is_not_approved_again():
+    payment = models.create_payment_request(7002, 'u', 'U', 5000, 'weekly', 'r')
+    assert models.reject_payment(payment.id, 'no')
+    assert models.approve_payment(payment.id) is None
+    assert not models.get_user_limits(7002)['is_premium']
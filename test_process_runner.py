@@ -0,0 +1,88 @@
+"""Tests for the supervised process runner"""
+
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+import process_runner
+from process_runner import ProcessCancelled, ProcessTimeout, SupervisedProcess, run_supervised
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_output_and_bounded_stderr():
+    result = run_supervised(
+        python("import sys\nfor i in range(1000): print(i, file=sys.stderr)\nprint('ok')"),
+        capture_stdout=True
+    )
+    assert result.stdout == 'ok\n'
+    lines = result.stderr.splitlines()
+    assert len(lines) == process_runner.STDERR_TAIL_LINES
+    assert lines[-1] == '999'
+
+
+def test_overlong_stderr_line_is_cut():
+    # Like ffmpeg stats: \r-separated, one newline at exit
+    result = run_supervised(python("import sys; sys.stderr.write('frame=1\\r' * 100000 + '\\ndone\\n')"))
+    lines = result.stderr.split('\n')
+    assert len(lines[0]) <= process_runner.STDERR_LINE_MAX
+    assert lines[-2:] == ['done', '']
+
+
+def test_failure_keeps_stderr_tail():
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_supervised(python("import sys; sys.exit('broken input')"))
+    assert 'broken input' in error.value.stderr
+
+
+def test_wall_clock_timeout_kills_process_group():
+    started = time.monotonic()
+    # The shell's child sleep must die with it, or wait() would block on the pipe
+    with pytest.raises(ProcessTimeout) as error:
+        run_supervised(['sh', '-c', 'sleep 30 & wait'], timeout=0.5)
+    assert error.value.limit == 'wall-clock time'
+    assert time.monotonic() - started < 5
+
+
+def test_cpu_limit():
+    with pytest.raises(ProcessTimeout) as error:
+        run_supervised(python('while True: pass'), cpu_limit=1)
+    assert error.value.limit == 'CPU time'
+
+
+def test_memory_limit():
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_supervised(python("import time; time.sleep(0.2); b = bytearray(512 * 1024 * 1024)"),
+                       memory_limit=256 * 1024 ** 2)
+    assert 'MemoryError' in error.value.stderr
+
+
+def test_limits_are_applied_to_the_child():
+    # Set from the parent after spawn, no preexec_fn
+    result = run_supervised(
+        python("import os, time, resource; time.sleep(0.2); "
+               "print(os.nice(0), resource.getrlimit(resource.RLIMIT_CPU)[0])"),
+        nice=5, cpu_limit=60, capture_stdout=True
+    )
+    nice, cpu_limit = result.stdout.split()
+    assert int(nice) >= 5 and cpu_limit == '60'
+
+
+def test_cancel_event_and_kill_all():
+    cancel_event = threading.Event()
+    process = SupervisedProcess(['sleep', '30'], cancel_event=cancel_event)
+    threading.Timer(0.3, cancel_event.set).start()
+    with pytest.raises(ProcessCancelled):
+        process.wait()
+
+    process = SupervisedProcess(['sleep', '30'])
+    assert process_runner.live_count() == 1
+    assert process_runner.kill_all() == 1
+    with pytest.raises(ProcessCancelled):
+        process.wait()
+    assert process_runner.live_count() == 0
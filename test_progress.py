@@ -0,0 +1,113 @@
+"""Tests for throttled progress edits and job telemetry"""
+
+from concurrent.futures import Future
+
+import models
+from job_telemetry import JobTelemetry
+from progress import ProgressReporter, format_eta
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_reporter(total=60):
+    clock = Clock()
+    edits = []
+
+    def edit(text):
+        edits.append(text)
+        return Future()
+
+    reporter = ProgressReporter(edit, total=lambda: total, template='{percent}% {eta}',
+                                interval=3, clock=clock)
+    return reporter, clock, edits
+
+
+def test_edits_are_throttled_and_show_eta():
+    reporter, clock, edits = make_reporter()
+    reporter(0.5)  # First report only sets the rate baseline
+
+    clock.now += 1
+    reporter(6.5)
+    assert edits == []  # Within the interval after the status message
+
+    clock.now += 2
+    reporter(18.5)  # 6 s of output per second: 41.5 s left, ~7 s
+    assert edits == ['30% 0:07']
+
+    clock.now += 1
+    reporter(24.5)
+    assert len(edits) == 1
+
+    clock.now += 3
+    reporter(20.0)  # Interval passed but percent barely moved
+    assert len(edits) == 1
+
+
+def test_close_cancels_queued_edit_and_stops_reporting():
+    reporter, clock, edits = make_reporter()
+    reporter(0.0)
+    clock.now += 5
+    reporter(30.0)
+    pending = reporter._pending
+    reporter.close()
+    assert pending.cancelled()
+
+    clock.now += 5
+    reporter(50.0)
+    assert len(edits) == 1
+
+
+def test_unknown_total_sends_nothing():
+    reporter, clock, edits = make_reporter(total=None)
+    for seconds in range(0, 60, 10):
+        clock.now += 5
+        reporter(seconds)
+    assert edits == []
+    assert format_eta(75.4) == '1:15'
+
+
+def test_job_telemetry_is_saved():
+    models.ensure_schema()
+    clock = Clock()
+    job = JobTelemetry(5001, 'video', 2, clock=clock)
+    with job.stage('download'):
+        clock.now += 1.5
+    job.start('queue')
+    clock.now += 0.5
+    job.stop('queue')
+    with job.stage('db'):
+        clock.now += 0.25
+    with job.stage('db'):
+        clock.now += 0.25
+    assert job.save('done', preset='fast', output_size=1234)
+
+    session = models.get_db_session()
+    try:
+        row = session.query(models.RenderJob).filter_by(user_id=5001).one()
+    finally:
+        session.close()
+    assert (row.status, row.preset, row.output_size) == ('done', 'fast', 1234)
+    assert (row.download_seconds, row.queue_seconds, row.db_seconds) == (1.5, 0.5, 0.5)
+    assert row.encode_seconds is None
+    assert row.total_seconds == 2.5
+
+
+def test_static_edit_is_dropped_on_close():
+    sent = []
+
+    def edit(text):
+        sent.append((text, Future()))
+        return sent[-1][1]
+
+    reporter = ProgressReporter(edit, total=lambda: 60, template='{percent}%')
+    reporter.show('ready in about 1:30')
+    reporter.close()
+    assert sent[0][1].cancelled()
+    reporter.show('late')
+    assert len(sent) == 1
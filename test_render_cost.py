@@ -0,0 +1,35 @@
+"""Tests for the render cost model"""
+
+import render_cost
+from render_cost import CostModel
+
+
+def test_prediction_grows_with_effect_length_and_source_size():
+    model = CostModel(cache_name=None)
+    short = model.predict('video', 1, 5)
+    long = model.predict('video', 1, 60)
+    zoom = model.predict('video', 2, 60)
+    big = model.predict('video', 1, 60, pixels=3840 * 2160)
+    assert short < long < zoom
+    assert big > long
+    # Source size only matters while the mezzanine has to be built
+    assert model.predict('video', 1, 60, pixels=3840 * 2160, mezzanine_ready=True) < long
+
+
+def test_calibration_follows_actual_render_times():
+    model = CostModel(cache_name=None)
+    predicted = model.predict('photo', 3, 5)
+    for _ in range(30):
+        model.record('photo', 3, 5, None, False, predicted * 2)
+    assert abs(model.predict('photo', 3, 5) - predicted * 2) < predicted * 0.05
+    # Other effects keep their own factor
+    assert model.factor('photo', 1) == 1.0
+
+
+def test_factors_survive_restart():
+    model = CostModel(cache_name='test_render_cost')
+    for _ in range(render_cost.SAVE_EVERY):
+        model.record('video', 5, 30, None, True, 100.0)
+    factor = model.factor('video', 5)
+    assert factor > 1.0
+    assert CostModel(cache_name='test_render_cost').factor('video', 5) == factor
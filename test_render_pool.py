@@ -0,0 +1,114 @@
+"""Tests for render pool lanes and per-user fairness"""
+
+import threading
+
+import metrics
+from render_pool import RenderPool, _Job, LANE_PREMIUM, LANE_FREE, LANE_BACKGROUND
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_job(pool, name, lane, user_id=None):
+    return _Job(str, (name,), {}, lane, user_id, pool._clock())
+
+
+def start_order(pool):
+    """Drain the queues with _next_job, as the workers would, one at a time"""
+    order = []
+    while True:
+        job = pool._next_job()
+        if job is None:
+            return order
+        pool._queues[job.lane].remove(job)
+        order.append(job.args[0])
+
+
+def test_premium_gets_weighted_share():
+    pool = RenderPool(workers=1, max_wait=1000)
+    for i in range(4):
+        pool._queues[LANE_FREE].append(make_job(pool, f'f{i}', LANE_FREE))
+        pool._queues[LANE_PREMIUM].append(make_job(pool, f'p{i}', LANE_PREMIUM))
+    pool._queues[LANE_BACKGROUND].append(make_job(pool, 'spec', LANE_BACKGROUND))
+
+    assert start_order(pool) == ['p0', 'p1', 'f0', 'p2', 'p3', 'f1', 'f2', 'f3', 'spec']
+
+
+def test_waiting_free_job_is_not_starved():
+    clock = Clock()
+    pool = RenderPool(workers=1, weights={LANE_PREMIUM: 100, LANE_FREE: 1}, max_wait=30, clock=clock)
+    pool._queues[LANE_FREE].append(make_job(pool, 'free', LANE_FREE))
+    clock.now = 10
+    for i in range(3):
+        pool._queues[LANE_PREMIUM].append(make_job(pool, f'p{i}', LANE_PREMIUM))
+
+    clock.now = 20
+    assert pool._next_job().args[0] == 'p0'
+    clock.now = 40
+    assert pool._next_job().args[0] == 'free'
+    assert pool.queued() == 4  # _next_job only picks
+
+
+def test_one_running_job_per_user():
+    pool = RenderPool(workers=2)
+    release = threading.Event()
+    two_started = threading.Event()
+    started = []
+
+    def render(name):
+        started.append(name)
+        if len(started) == 2:
+            two_started.set()
+        release.wait(5)
+        return name
+
+    first = pool.submit(render, 'a1', user_id=1)
+    second = pool.submit(render, 'a2', user_id=1)
+    other = pool.submit(render, 'b1', user_id=2)
+    # Both workers are busy, but with user 1's first job and user 2's job
+    assert two_started.wait(5)
+    assert sorted(started) == ['a1', 'b1']
+    release.set()
+    assert [f.result(timeout=5) for f in (first, second, other)] == ['a1', 'a2', 'b1']
+    assert pool.pending() == 0
+
+
+def test_queue_wait_is_observed_per_lane():
+    metrics.reset()
+    pool = RenderPool(workers=1)
+    assert pool.submit(lambda: 'done', lane=LANE_PREMIUM).result(timeout=5) == 'done'
+    assert 'render_pool.wait.premium' in metrics.format_metrics()
+
+
+def test_backlog_counts_work_ahead_by_lane():
+    clock = Clock()
+    pool = RenderPool(workers=1, clock=clock)
+    running = _Job(str, ('run',), {}, LANE_FREE, None, 0.0, cost=10.0)
+    running.started_at = 0.0
+    pool._running.add(running)
+    pool._queues[LANE_FREE].append(_Job(str, ('f',), {}, LANE_FREE, None, 0.0, cost=20.0))
+    pool._queues[LANE_PREMIUM].append(_Job(str, ('p',), {}, LANE_PREMIUM, None, 0.0, cost=30.0))
+    pool._queues[LANE_BACKGROUND].append(_Job(str, ('s',), {}, LANE_BACKGROUND, None, 0.0, cost=5.0))
+
+    clock.now = 4.0
+    # Running job has 6 s left; premium work is a third as much in the way
+    assert pool.backlog(LANE_FREE) == 6 + 20 + 30
+    assert pool.backlog(LANE_PREMIUM) == 6 + 30 + 20 / 3
+    assert pool.backlog(LANE_BACKGROUND) == 6 + 20 + 30 + 5
+
+
+def test_cancelled_queued_job_leaves_the_pool():
+    pool = RenderPool(workers=1)
+    release = threading.Event()
+    running = pool.submit(release.wait, 5, lane=LANE_FREE)
+    queued = pool.submit(str, 'spec', lane=LANE_BACKGROUND)
+    assert queued.cancel()
+    assert pool.queued(LANE_BACKGROUND) == 0
+    assert pool.pending() == 1
+    release.set()
+    assert running.result(timeout=5)
@@ -0,0 +1,97 @@
+"""Tests for the outbound send queue"""
+
+import heapq
+import time
+import threading
+
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+from send_queue import SendQueue, QueuedBot, _SendItem, PRIORITY_RESULT, PRIORITY_BULK
+
+
+def api_error(code, retry_after=None):
+    result_json = {'ok': False, 'error_code': code, 'description': f'error {code}'}
+    if retry_after is not None:
+        result_json['parameters'] = {'retry_after': retry_after}
+    return ApiTelegramException('sendMessage', None, result_json)
+
+
+def make_item(queue, priority, chat_id):
+    return _SendItem(priority, next(queue._seq), chat_id, print, (), {})
+
+
+def test_higher_priority_and_ready_chats_go_first():
+    queue = SendQueue(global_rate=1000)
+    bulk = make_item(queue, PRIORITY_BULK, 1)
+    result = make_item(queue, PRIORITY_RESULT, 2)
+    busy = make_item(queue, PRIORITY_RESULT, 3)
+    for item in (bulk, result, busy):
+        heapq.heappush(queue._heap, item)
+
+    # Chat 3 used up its burst, so its item waits even though it ranks first
+    queue._chat_bucket(3).block_for(10)
+
+    first, _ = queue._next_ready()
+    second, _ = queue._next_ready()
+    third, wait = queue._next_ready()
+    assert (first, second, third) == (result, bulk, None)
+    assert wait > 0
+    assert queue.depth() == 1
+
+
+def test_call_retries_after_429():
+    metrics.reset()
+    calls = []
+
+    def flaky_send(chat_id, text):
+        calls.append(text)
+        if len(calls) == 1:
+            raise api_error(429, retry_after=0)
+        return 'ok'
+
+    queue = SendQueue(global_rate=1000)
+    assert queue.call(42, flaky_send, 42, 'hi') == 'ok'
+    assert calls == ['hi', 'hi']
+    assert metrics.snapshot()['counters']['send_queue.retry_after'] == 1
+    queue.shutdown()
+
+
+def test_429_holds_back_other_chats():
+    sent_at = {}
+    limited = threading.Event()
+
+    def send(chat_id, text):
+        if chat_id == 1 and not limited.is_set():
+            sent_at['limited'] = time.monotonic()
+            limited.set()
+            raise api_error(429, retry_after=0.3)
+        sent_at[chat_id] = time.monotonic()
+
+    queue = SendQueue(global_rate=1000)
+    first = queue.submit(1, send, 1, 'hi')
+    assert limited.wait(5)
+    # Chat 1's item is back in the queue once the 429 is handled
+    while queue.depth() == 0 and not first.done():
+        time.sleep(0.01)
+    # A different chat, queued while chat 1 waits out its retry_after
+    queue.call(2, send, 2, 'hi')
+    first.result()
+    assert sent_at[2] - sent_at['limited'] >= 0.25
+    queue.shutdown()
+
+
+def test_queued_bot_routes_send_methods():
+    class Bot:
+        def send_message(self, chat_id, text):
+            return (chat_id, text)
+
+        def get_me(self):
+            return 'me'
+
+    queue = SendQueue(global_rate=1000)
+    bot = QueuedBot(Bot(), queue)
+    assert bot.send_message(5, 'x') == (5, 'x')
+    assert bot.notify(5, 'later').result(timeout=5) == (5, 'later')
+    assert bot.get_me() == 'me'
+    queue.shutdown()
@@ -0,0 +1,116 @@
+"""Tests for Bot API file access against a local stand-in server"""
+
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+import telebot
+from telebot import apihelper
+
+import metrics
+import telegram_http
+
+TOKEN = '123:abc'
+PAYLOAD = b'fake video bytes' * 1000
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    file_path = 'videos/file_1.mp4'
+
+    def _reply(self, body, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith(f'/bot{TOKEN}/getFile'):
+            result = {'file_id': 'f1', 'file_unique_id': 'u1', 'file_path': self.file_path}
+            self._reply(json.dumps({'ok': True, 'result': result}).encode())
+        elif self.path == f'/file/bot{TOKEN}/videos/file_1.mp4':
+            self._reply(PAYLOAD, 'application/octet-stream')
+        elif self.path == f'/file/bot{TOKEN}/videos/stalled.mp4':
+            # Headers and part of the body, then nothing
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(PAYLOAD)))
+            self.end_headers()
+            self.wfile.write(PAYLOAD[:100])
+            self.wfile.flush()
+            time.sleep(2)
+        else:
+            self.send_error(404)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def run_with_server(test):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    saved = apihelper.API_URL, apihelper.FILE_URL
+    try:
+        telegram_http.configure_api_server(f'http://127.0.0.1:{server.server_port}')
+        test(telebot.TeleBot(TOKEN, threaded=False))
+    finally:
+        apihelper.API_URL, apihelper.FILE_URL = saved
+        server.shutdown()
+
+
+def test_fetch_file_streams_download_over_pooled_session():
+    metrics.reset()
+
+    def test(bot):
+        path, owned = telegram_http.fetch_file(bot, 'f1', suffix='.mp4', local_mode=False)
+        try:
+            assert owned
+            with open(path, 'rb') as f:
+                assert f.read() == PAYLOAD
+        finally:
+            os.unlink(path)
+
+    run_with_server(test)
+    assert metrics.snapshot()['timings']['telegram_api.file']['count'] == 1
+
+
+def test_local_mode_uses_server_path_directly(tmp_path):
+    local_file = tmp_path / 'file_1.mp4'
+    local_file.write_bytes(PAYLOAD)
+    StandInHandler.file_path = str(local_file)
+
+    def test(bot):
+        path, owned = telegram_http.fetch_file(bot, 'f1', local_mode=True)
+        assert (path, owned) == (str(local_file), False)
+        with telegram_http.upload_source(path, local_mode=True) as source:
+            assert source == f'file://{local_file}'
+
+    try:
+        run_with_server(test)
+    finally:
+        StandInHandler.file_path = 'videos/file_1.mp4'
+
+
+def test_stalled_download_times_out(monkeypatch):
+    monkeypatch.setattr(telegram_http, 'DOWNLOAD_TIMEOUT', (5, 0.3))
+    StandInHandler.file_path = 'videos/stalled.mp4'
+    created = []
+    real_mkstemp = telegram_http.tempfile.mkstemp
+    monkeypatch.setattr(telegram_http.tempfile, 'mkstemp',
+                        lambda **kwargs: created.append(real_mkstemp(**kwargs)) or created[-1])
+
+    def test(bot):
+        with pytest.raises(requests.Timeout):
+            telegram_http.fetch_file(bot, 'f1', local_mode=False)
+        assert not os.path.exists(created[0][1])
+
+    try:
+        run_with_server(test)
+    finally:
+        StandInHandler.file_path = 'videos/file_1.mp4'
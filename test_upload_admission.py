@@ -0,0 +1,40 @@
+"""Tests for pre-download upload admission"""
+
+from types import SimpleNamespace
+
+import upload_admission
+from upload_admission import UploadLimiter, check_video, pick_photo_size
+
+
+def video(**fields):
+    values = dict(file_size=5 * 1024 * 1024, duration=30, width=1280, height=720, mime_type='video/mp4')
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+
+def test_video_checked_against_limits():
+    assert check_video(video()) is None
+    assert check_video(video(file_size=upload_admission.UPLOAD_MAX_BYTES + 1)) == 'too_large'
+    assert check_video(video(duration=upload_admission.UPLOAD_MAX_DURATION + 1)) == 'too_long'
+    assert check_video(video(width=7680, height=4320)) == 'too_big_frame'
+    assert check_video(video(mime_type='video/x-msvideo')) == 'bad_type'
+    # Missing metadata is not a reason to refuse
+    assert check_video(video(file_size=None, duration=None, mime_type=None)) is None
+
+
+def test_photo_size_closest_to_kruzhok():
+    sizes = [SimpleNamespace(width=w, height=h) for w, h in
+             ((90, 67), (320, 240), (800, 600), (1280, 960), (2560, 1920))]
+    assert pick_photo_size(sizes).width == 800
+    assert pick_photo_size(sizes[:2]).width == 320  # Nothing covers 480: largest
+
+
+def test_flood_is_refused_with_one_warning():
+    limiter = UploadLimiter(per_minute=0.6, burst=2)
+    assert limiter.admit(1) == (0.0, False)
+    assert limiter.admit(1) == (0.0, False)
+    delay, warn = limiter.admit(1)
+    assert delay > 0 and warn
+    assert limiter.admit(1)[1] is False
+    # Other users have their own bucket
+    assert limiter.admit(2) == (0.0, False)
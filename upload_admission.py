@@ -0,0 +1,107 @@
+"""Accept or refuse uploads from message metadata, before downloading
+
+Telegram tells us size, length, dimensions and MIME type of a video in
+the message itself, so files we would refuse later never cost bandwidth
+or disk. Per-user token buckets stop upload floods the same way.
+"""
+
+import os
+import time
+import threading
+
+import metrics
+from ratelimit import TokenBucket
+from media import KRUZHOK_SIZE
+from telegram_http import TELEGRAM_LOCAL_MODE
+
+# getFile on the cloud Bot API stops at 20 MB; a local server has no such cap
+UPLOAD_MAX_BYTES = int(os.environ.get(
+    'UPLOAD_MAX_BYTES', str((512 if TELEGRAM_LOCAL_MODE else 20) * 1024 * 1024)
+))
+# Only the first MAX_VIDEO_DURATION seconds are used, but each extra minute
+# is still downloaded
+UPLOAD_MAX_DURATION = int(os.environ.get('UPLOAD_MAX_DURATION', '600'))
+UPLOAD_MAX_SIDE = int(os.environ.get('UPLOAD_MAX_SIDE', '4096'))  # 4K is fine, 8K is not
+UPLOAD_MIME_TYPES = frozenset(os.environ.get(
+    'UPLOAD_MIME_TYPES', 'video/mp4,video/quicktime,video/webm,video/x-matroska,video/mpeg'
+).split(','))
+
+# Per user: a burst of UPLOAD_BURST, then one upload per 60/UPLOAD_PER_MINUTE s
+UPLOAD_PER_MINUTE = float(os.environ.get('UPLOAD_PER_MINUTE', '6'))
+UPLOAD_BURST = int(os.environ.get('UPLOAD_BURST', '3'))
+# Idle buckets (full again) are dropped once this many users are tracked
+LIMITER_SWEEP_SIZE = 10000
+
+def check_video(video):
+    """Refusal reason for a Telegram Video, None to accept
+
+    Reasons: 'too_large', 'too_long', 'too_big_frame', 'bad_type'.
+    Unknown fields (None) pass; the mezzanine step copes with the rest.
+    """
+    if video.file_size and video.file_size > UPLOAD_MAX_BYTES:
+        return 'too_large'
+    if video.duration and video.duration > UPLOAD_MAX_DURATION:
+        return 'too_long'
+    if max(video.width or 0, video.height or 0) > UPLOAD_MAX_SIDE:
+        return 'too_big_frame'
+    mime_type = getattr(video, 'mime_type', None)
+    if mime_type and mime_type not in UPLOAD_MIME_TYPES:
+        return 'bad_type'
+    return None
+
+def check_photo(photo):
+    """Refusal reason for a Telegram PhotoSize, None to accept"""
+    if photo.file_size and photo.file_size > UPLOAD_MAX_BYTES:
+        return 'too_large'
+    return None
+
+def pick_photo_size(sizes, target=KRUZHOK_SIZE):
+    """Smallest PhotoSize whose short side covers target, else the largest
+
+    The kruzhok is a target x target crop, so bigger sizes only add
+    download and decode time.
+    """
+    by_side = sorted(sizes, key=lambda size: min(size.width, size.height))
+    for size in by_side:
+        if min(size.width, size.height) >= target:
+            return size
+    return by_side[-1]
+
+class UploadLimiter:
+    """Per-user token buckets for inbound uploads"""
+
+    def __init__(self, per_minute=UPLOAD_PER_MINUTE, burst=UPLOAD_BURST, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._clock = clock
+        self._buckets = {}  # user_id -> [TokenBucket, last_used, warned]
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        idle = self.burst / self.rate
+        for user_id, entry in list(self._buckets.items()):
+            if now - entry[1] >= idle:
+                del self._buckets[user_id]
+
+    def admit(self, user_id):
+        """(delay, warn): delay 0.0 admits the upload, else seconds to wait
+
+        warn is True only for the first refused upload after an admitted
+        one, so a flood gets one reply, not one per file.
+        """
+        now = self._clock()
+        with self._lock:
+            if len(self._buckets) >= LIMITER_SWEEP_SIZE:
+                self._sweep(now)
+            entry = self._buckets.get(user_id)
+            if entry is None:
+                entry = self._buckets[user_id] = [TokenBucket(self.rate, self.burst), now, False]
+            entry[1] = now
+            delay = entry[0].delay_for()
+            if delay == 0.0:
+                entry[2] = False
+                return 0.0, False
+            warn = not entry[2]
+            entry[2] = True
+        metrics.incr('upload.flood')
+        return delay, warn